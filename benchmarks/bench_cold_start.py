@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Lambda packages
+
+Runs each package's lambda_function import (the Lambda init phase) in a
+fresh interpreter several times and reports the median time for the
+import alone and for the import with LAMBDA_PRIME_ON_INIT=true.
+Build a package first (./build.sh, optionally BUILD_MODE=slim) to
+measure against its bundled dependencies directory.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--runs N] [package ...]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PACKAGES = ('lambda_token_api', 'r2-to-tiktok-poster', 'fal-to-r2-uploader')
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import lambda_function
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "modules": len(sys.modules)}))
+"""
+
+# Dummy configuration so init code can build clients without real credentials
+BENCH_ENV = {
+    'AWS_DEFAULT_REGION': 'ap-northeast-1',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'R2_ENDPOINT_URL': 'https://example.r2.cloudflarestorage.com',
+    'R2_ACCESS_KEY_ID': 'bench',
+    'R2_SECRET_ACCESS_KEY': 'bench',
+    'TOKEN_STORE_BACKEND': 'sqlite',
+    'TOKEN_STORE_SQLITE_PATH': ':memory:',
+}
+
+
+def run_once(package: str, prime: bool) -> dict:
+    env = dict(os.environ, **BENCH_ENV)
+    env['LAMBDA_PRIME_ON_INIT'] = 'true' if prime else 'false'
+    result = subprocess.run(
+        [sys.executable, '-c', MEASURE],
+        cwd=os.path.join(ROOT, package),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench(package: str, runs: int):
+    for prime in (False, True):
+        samples = [run_once(package, prime) for _ in range(runs)]
+        median_ms = statistics.median(sample['ms'] for sample in samples)
+        modules = samples[-1]['modules']
+        mode = 'prime' if prime else 'lazy'
+        print(f"{package:<22} {mode:<6} {median_ms:>10.1f} {modules:>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('packages', nargs='*', default=PACKAGES)
+    args = parser.parse_args()
+
+    print(f"{'package':<22} {'mode':<6} {'init (ms)':>10} {'modules':>8}")
+    for package in args.packages:
+        bench(package, args.runs)
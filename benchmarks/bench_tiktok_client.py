@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+TikTok API client benchmark for r2-to-tiktok-poster
+
+Starts a local fake TikTok API (HTTP/1.1 keep-alive, fixed server delay, and a
+per-connection delay standing in for the TCP + TLS handshake to the real API)
+and compares three ways of sending the same number of status fetches:
+
+- requests: one requests.post per call, as the poster used to do
+- pooled:   the shared TikTokClient through its synchronous post() from a thread pool
+- async:    the same client awaited concurrently on its event loop
+
+Usage:
+    python benchmarks/bench_tiktok_client.py [--calls N] [--concurrency N] [--delay-ms N] [--handshake-ms N]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'r2-to-tiktok-poster'))
+
+import requests  # noqa: E402
+from tiktok_client import TikTokClient  # noqa: E402
+
+ENDPOINT = '/v2/post/publish/status/fetch/'
+PAYLOAD = json.dumps({'error': {'code': 'ok'}, 'data': {'status': 'PROCESSING_UPLOAD'}}).encode()
+
+
+def make_handler(delay: float, handshake: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately; without this, delayed ACKs stall kept-alive sockets
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            time.sleep(handshake)
+            super().setup()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.server.connections.add(self.client_address)
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(PAYLOAD)))
+            self.end_headers()
+            self.wfile.write(PAYLOAD)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class FakeTikTokServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def bench_requests(base_url: str, calls: int, concurrency: int):
+    def call(i):
+        return requests.post(f"{base_url}{ENDPOINT}", json={'publish_id': str(i)}).status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(call, range(calls)))
+
+
+def bench_pooled(client: TikTokClient, calls: int, concurrency: int):
+    def call(i):
+        return client.post(ENDPOINT, json={'publish_id': str(i)}).status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(call, range(calls)))
+
+
+def bench_async(client: TikTokClient, calls: int, concurrency: int):
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(i):
+            async with semaphore:
+                response = await client.request('POST', ENDPOINT, json={'publish_id': str(i)})
+                return response.status_code
+
+        return await asyncio.gather(*(call(i) for i in range(calls)))
+
+    return client.run(run())
+
+
+def measure(name: str, server, fn, *args):
+    server.connections.clear()
+    start = time.perf_counter()
+    statuses = fn(*args)
+    elapsed = time.perf_counter() - start
+    assert all(status == 200 for status in statuses)
+    calls = len(statuses)
+    print(f"{name:<10} {elapsed * 1000:>10.1f} {calls / elapsed:>10.1f} {len(server.connections):>12}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--delay-ms', type=float, default=20)
+    parser.add_argument('--handshake-ms', type=float, default=60)
+    args = parser.parse_args()
+
+    server = FakeTikTokServer(('127.0.0.1', 0), make_handler(args.delay_ms / 1000, args.handshake_ms / 1000))
+    server.connections = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    client = TikTokClient(base_url=base_url, max_connections=args.concurrency)
+
+    print(f"{'client':<10} {'total (ms)':>10} {'calls/s':>10} {'connections':>12}")
+    try:
+        measure('requests', server, bench_requests, base_url, args.calls, args.concurrency)
+        measure('pooled', server, bench_pooled, client, args.calls, args.concurrency)
+        measure('async', server, bench_async, client, args.calls, args.concurrency)
+    finally:
+        client.close()
+        server.shutdown()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the token store serialization formats
+
+Compares bytes stored/transferred and decode time of the legacy pretty
+JSON (v1), the compact line format (v2) and gzip-compressed v2 at
+10/100/1000 accounts, for a full decode and for a single-account lookup.
+
+Usage:
+    python benchmarks/bench_token_store_format.py
+"""
+
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_token_api'))
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+
+from token_store import TokenBlob
+
+ACCOUNT_COUNTS = (10, 100, 1000)
+FORMATS = (("v1", "none"), ("v2", "none"), ("v2", "gzip"))
+REPEAT = 50
+
+
+def make_tokens(count: int) -> dict:
+    now = time.time()
+    return {
+        f"-000{i:06d}ABCDEFabcdef0123456789": {
+            "access_token": f"act.{i:04d}" + "x" * 60,
+            "refresh_token": f"rft.{i:04d}" + "y" * 60,
+            "open_id": f"-000{i:06d}ABCDEFabcdef0123456789",
+            "scope": "user.info.basic,video.publish,video.upload",
+            "token_type": "Bearer",
+            "expires_in": 86400,
+            "refresh_expires_in": 31536000,
+            "expires_at": now + 86400 + i,
+        }
+        for i in range(count)
+    }
+
+
+def median_ms(fn) -> float:
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def bench(count: int):
+    tokens = make_tokens(count)
+    target = list(tokens)[count // 2]
+
+    for version, compression in FORMATS:
+        raw = TokenBlob.encode(tokens, version=version, compression=compression)
+        full_ms = median_ms(lambda: TokenBlob(raw).to_dict())
+        one_ms = median_ms(lambda: TokenBlob(raw).get(target))
+        label = version if compression == "none" else f"{version}+{compression}"
+        print(f"{count:>6} {label:<10} {len(raw):>10} {full_ms:>12.3f} {one_ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    print(f"{'accounts':>6} {'format':<10} {'bytes':>10} {'full (ms)':>12} {'one (ms)':>12}")
+    for count in ACCOUNT_COUNTS:
+        bench(count)
@@ -4,15 +4,26 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
 
 import json
+import base64
 import logging
 import boto3
 import requests
 import uuid
+from botocore.config import Config
 from urllib.parse import urlparse
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME", "my-tiktok-videos")
+# How r2_url points at the video: "worker" (through the video worker) or
+# "presigned" (a presigned R2 GET URL, so TikTok pulls straight from R2)
+VIDEO_URL_STRATEGY = os.getenv("VIDEO_URL_STRATEGY", "worker").lower()
+VIDEO_WORKER_BASE_URL = os.getenv("VIDEO_WORKER_BASE_URL", "https://video-worker.hurukawasiro3150.workers.dev/videos/")
+PRESIGNED_URL_TTL_SECONDS = int(os.getenv("PRESIGNED_URL_TTL_SECONDS", "3600"))
+
+_r2_client = None
+
 def get_r2_credentials():
     """Retrieve R2 credentials from environment variables"""
     try:
@@ -25,6 +36,54 @@ def get_r2_credentials():
         logger.error(f"Missing required environment variable: {str(e)}")
         raise
 
+def get_r2_client():
+    """Return the R2 client, creating it once per container"""
+    global _r2_client
+    if _r2_client is None:
+        r2_credentials = get_r2_credentials()
+        _r2_client = boto3.client(
+            's3',
+            endpoint_url=r2_credentials['endpoint_url'],
+            aws_access_key_id=r2_credentials['access_key_id'],
+            aws_secret_access_key=r2_credentials['secret_access_key'],
+            region_name='auto',
+            config=Config(signature_version='s3v4')
+        )
+    return _r2_client
+
+def presigned_video_url(key):
+    """Presigned R2 GET URL for a newly uploaded object
+
+    Each upload gets a fresh key, so nothing is cached here; the poster
+    caches the URLs it signs for repeated posts of the same video.
+    """
+    # Signing is local, no request is made to R2
+    return get_r2_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': R2_BUCKET_NAME, 'Key': key},
+        ExpiresIn=PRESIGNED_URL_TTL_SECONDS
+    )
+
+def request_body(event):
+    """Raw request body text (API Gateway base64-encodes it when binary media types match)"""
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return body
+
+def video_url_for(key):
+    """URL of an uploaded video according to VIDEO_URL_STRATEGY"""
+    if VIDEO_URL_STRATEGY == 'presigned':
+        return presigned_video_url(key)
+    return f"{VIDEO_WORKER_BASE_URL}{key}"
+
+# Create the R2 client during the Lambda init phase so warm invocations pay nothing
+if os.getenv("LAMBDA_PRIME_ON_INIT", "false").lower() == "true":
+    try:
+        get_r2_client()
+    except Exception as e:
+        logger.warning(f"R2 client priming failed: {str(e)}")
+
 def lambda_handler(event, context):
     """
     AWS Lambda handler for fal-to-r2-uploader
@@ -33,14 +92,15 @@ def lambda_handler(event, context):
     - video_url: URL from fal.ai
 
     Returns:
-    - r2_url: URL of uploaded video in R2
+    - r2_url: URL of uploaded video in R2 (video worker URL, or a presigned
+      R2 URL valid for PRESIGNED_URL_TTL_SECONDS with VIDEO_URL_STRATEGY=presigned)
     - success: boolean
     - error: error message if failed
     """
 
     try:
         if 'body' in event:
-            body = json.loads(event['body'])
+            body = json.loads(request_body(event))
         else:
             body = event
 
@@ -60,15 +120,7 @@ def lambda_handler(event, context):
 
         logger.info(f"Processing video upload from URL: {video_url}")
 
-        r2_credentials = get_r2_credentials()
-
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=r2_credentials['endpoint_url'],
-            aws_access_key_id=r2_credentials['access_key_id'],
-            aws_secret_access_key=r2_credentials['secret_access_key'],
-            region_name='auto'
-        )
+        s3_client = get_r2_client()
 
         parsed_url = urlparse(video_url)
         file_extension = parsed_url.path.split('.')[-1] if '.' in parsed_url.path else 'mp4'
@@ -84,19 +136,19 @@ def lambda_handler(event, context):
         content_length = len(response.content)
         logger.info(f"Video size: {content_length} bytes")
 
-        logger.info(f"Uploading to R2 bucket: my-tiktok-videos/{unique_filename}")
+        logger.info(f"Uploading to R2 bucket: {R2_BUCKET_NAME}/{unique_filename}")
         from io import BytesIO
         video_data = BytesIO(response.content)
         s3_client.upload_fileobj(
             video_data,
-            'my-tiktok-videos',
+            R2_BUCKET_NAME,
             unique_filename,
             ExtraArgs={
                 'ContentType': 'video/mp4'
             }
         )
 
-        r2_url = f"https://video-worker.hurukawasiro3150.workers.dev/videos/{unique_filename}"
+        r2_url = video_url_for(unique_filename)
 
         logger.info(f"Successfully uploaded video to R2: {r2_url}")
 
@@ -4,8 +4,10 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import json
+import base64
 import pytest
 from unittest.mock import patch, MagicMock
+import lambda_function
 from lambda_function import lambda_handler
 
 
@@ -52,6 +54,39 @@ class TestFalToR2Uploader:
         assert response_body['success'] is False
         assert 'video_url is required' in response_body['error']
 
+    def test_lambda_handler_base64_encoded_body(self):
+        event = {
+            'body': base64.b64encode(json.dumps({'video_url': ''}).encode('utf-8')).decode('ascii'),
+            'isBase64Encoded': True
+        }
+
+        result = lambda_handler(event, {})
+
+        assert result['statusCode'] == 400
+        assert 'video_url is required' in json.loads(result['body'])['error']
+
+
+    @patch('lambda_function.requests.get')
+    def test_lambda_handler_presigned_url_strategy(self, mock_requests_get, monkeypatch):
+        mock_response = MagicMock()
+        mock_response.headers = {'content-length': '1024'}
+        mock_response.content = b'fake_video_content'
+        mock_requests_get.return_value = mock_response
+
+        mock_s3_client = MagicMock()
+        mock_s3_client.generate_presigned_url.side_effect = lambda method, Params, ExpiresIn: (
+            f"https://r2-endpoint.com/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}")
+        monkeypatch.setattr(lambda_function, '_r2_client', mock_s3_client)
+        monkeypatch.setattr(lambda_function, 'VIDEO_URL_STRATEGY', 'presigned')
+
+        event = {'body': json.dumps({'video_url': 'https://v3.fal.media/files/rabbit/output.mp4'})}
+        result = lambda_handler(event, {})
+
+        assert result['statusCode'] == 200
+        response_body = json.loads(result['body'])
+        assert response_body['r2_url'] == (
+            f"https://r2-endpoint.com/my-tiktok-videos/{response_body['filename']}?X-Amz-Expires=3600")
+
 
 if __name__ == '__main__':
     pytest.main([__file__])
@@ -16,17 +16,20 @@ echo "📦 Installing dependencies..."
 mkdir -p dependencies
 pip install -r requirements.txt -t dependencies/
 
+# BUILD_MODE=slim trims unused botocore/boto3 data (shared with the other Lambdas)
+source ../scripts/slim_dependencies.sh
+
 # Create deployment package
 echo "📁 Creating deployment package..."
 
 # Create zip file excluding unnecessary files
 zip -r lambda-deployment.zip . \
   -x "tests/*" \
-  -x "__pycache__/*" \
-  -x "*.pyc" \
+  "${BYTECODE_EXCLUDES[@]}" \
   -x ".git/*" \
   -x "build.sh" \
-  -x "*.md"
+  -x "*.md" \
+  -x "*.sqlite3"
 
 echo "✅ Deployment package created: lambda-deployment.zip"
 echo "📊 Package size: $(du -h lambda-deployment.zip | cut -f1)"
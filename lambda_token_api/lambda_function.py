@@ -4,21 +4,159 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
 
 import json
+import time
+import gzip
+import base64
+import hashlib
 import logging
-from token_store import TokenStore
+from token_store import TokenStore, flush_on_return
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+BATCH_MAX_OPEN_IDS = int(os.getenv("BATCH_MAX_OPEN_IDS", "100"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
 
+# Downstream callers may cache a token until this many seconds before it expires
+TOKEN_CACHE_SKEW_SECONDS = int(os.getenv("TOKEN_CACHE_SKEW_SECONDS", "300"))
+ACCOUNTS_CACHE_CONTROL = 'private, no-cache'
+
+EXPIRING_DEFAULT_MINUTES = int(os.getenv("EXPIRING_DEFAULT_MINUTES", "60"))
+
+ACCOUNTS_PAGE_SIZE = int(os.getenv("ACCOUNTS_PAGE_SIZE", "100"))
+ACCOUNTS_PAGE_MAX = int(os.getenv("ACCOUNTS_PAGE_MAX", "1000"))
+# Bodies smaller than this are returned uncompressed even if the client accepts gzip
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+
+# Create clients and warm the store cache during the Lambda init phase
+# so the first invocation on a container does not pay for it
+if os.getenv("LAMBDA_PRIME_ON_INIT", "false").lower() == "true":
+    try:
+        TokenStore.prime()
+    except Exception as e:
+        logger.warning(f"TokenStore priming failed: {str(e)}")
+
+
+def get_request_header(event, name):
+    """Case-insensitive lookup of a request header"""
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def make_etag(path, version):
+    """Strong ETag for a representation of the store at the given version"""
+    return '"%s"' % hashlib.sha1(f"{path}:{version}".encode("utf-8")).hexdigest()
+
+
+def etag_matches(event, etag):
+    """Whether the request's If-None-Match header matches etag"""
+    header = get_request_header(event, 'If-None-Match')
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def accepts_gzip(event):
+    """Whether the request's Accept-Encoding allows a gzip response"""
+    header = get_request_header(event, 'Accept-Encoding') or ''
+    for coding in header.split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            quality = params.replace(' ', '').lower()
+            try:
+                return not quality.startswith('q=') or float(quality[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def gzip_response(response):
+    """Compress a JSON response body in place (API Gateway decodes isBase64Encoded bodies)"""
+    body = response['body'].encode('utf-8')
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+
+    response['body'] = base64.b64encode(gzip.compress(body, compresslevel=6)).decode('ascii')
+    response['isBase64Encoded'] = True
+    response['headers']['Content-Encoding'] = 'gzip'
+    return response
+
+
+def encode_cursor(open_id):
+    """Opaque pagination cursor pointing after open_id"""
+    return base64.urlsafe_b64encode(json.dumps({'after': open_id}).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        after = data['after']
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(after, str):
+        raise ValueError('invalid cursor')
+    return after
+
+
+def project_token(open_id, token, fields):
+    """Keep only the requested fields of a token record"""
+    if not fields:
+        return token
+    record = dict(token, open_id=open_id)
+    return {field: record[field] for field in fields if field in record}
+
+
+def request_body(event):
+    """Raw request body text (API Gateway base64-encodes it when binary media types match)"""
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return body
+
+
+def not_modified_response(etag, cache_control):
+    return {
+        'statusCode': 304,
+        'headers': {
+            'ETag': etag,
+            'Cache-Control': cache_control,
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': ''
+    }
+
+
+def internal_error_response(error=None):
+    return {
+        'statusCode': 500,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'error': 'Internal server error'
+        })
+    }
+
+
+@flush_on_return(on_error=internal_error_response)
 def lambda_handler(event, context):
     """
     AWS Lambda handler for TikTok token API
 
     Supports:
     - GET /token/{open_id} - Get access token for specified open_id
+      (?refresh=true refreshes it even if it has not expired, e.g. after TikTok rejected it)
     - GET /accounts - Get list of all open_ids
-    - GET /accounts/full - Get all token data (full JSON)
+    - GET /accounts/expiring - Get accounts expiring within ?within_minutes=N
+    - GET /accounts/full - Get all token data, or a page at a time with limit/cursor
+      (query: limit, cursor, fields=open_id,expires_at,...; gzip if accepted)
+    - POST /tokens/batch - Get access tokens for many open_ids in one call
+      (body: {"open_ids": [...]})
     """
 
     try:
@@ -28,11 +166,19 @@ def lambda_handler(event, context):
 
         if http_method == 'GET' and path == '/accounts':
             # GET /accounts - Return list of all open_ids
-            accounts = TokenStore.list_accounts()
+            # The ETag is built from the objects this body was read from, so the two always match
+            with TokenStore.versioned_read() as snapshot:
+                accounts = TokenStore.list_accounts()
+            etag = make_etag(path, snapshot.version)
+            if etag_matches(event, etag):
+                return not_modified_response(etag, ACCOUNTS_CACHE_CONTROL)
+
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
+                    'ETag': etag,
+                    'Cache-Control': ACCOUNTS_CACHE_CONTROL,
                     'Access-Control-Allow-Origin': '*'
                 },
                 'body': json.dumps({
@@ -41,11 +187,133 @@ def lambda_handler(event, context):
                 })
             }
 
+        elif http_method == 'GET' and path == '/accounts/expiring':
+            # GET /accounts/expiring - Accounts whose access token expires soon (no secrets)
+            query = event.get('queryStringParameters') or {}
+            try:
+                within_minutes = float(query.get('within_minutes') or EXPIRING_DEFAULT_MINUTES)
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': 'within_minutes must be a number'
+                    })
+                }
+
+            accounts = TokenStore.list_expiring(within_minutes * 60)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Cache-Control': 'no-store',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'accounts': accounts,
+                    'total': len(accounts),
+                    'within_minutes': within_minutes
+                })
+            }
+
         elif http_method == 'GET' and path == '/accounts/full':
-            # GET /accounts/full - Return all token data (full JSON)
-            raw_tokens = TokenStore._load_raw_tokens()
-            if not raw_tokens:
-                raw_tokens = {}
+            # GET /accounts/full - Return all token data, or one page at a time with limit/cursor
+            query = event.get('queryStringParameters') or {}
+            cursor = query.get('cursor')
+            paged = bool(query.get('limit') or cursor)
+            fields = [field.strip() for field in (query.get('fields') or '').split(',') if field.strip()]
+            try:
+                limit = int(query.get('limit') or ACCOUNTS_PAGE_SIZE) if paged else None
+                after = decode_cursor(cursor) if cursor else None
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': 'limit must be an integer and cursor must come from next_cursor'
+                    })
+                }
+            if paged:
+                limit = max(1, min(limit, ACCOUNTS_PAGE_MAX))
+            use_gzip = accepts_gzip(event)
+
+            representation = f"{path}?limit={limit}&cursor={cursor or ''}&fields={','.join(fields)}&gzip={use_gzip}"
+            with TokenStore.versioned_read() as snapshot:
+                tokens, next_after, total = TokenStore.list_tokens(after=after, limit=limit)
+            etag = make_etag(representation, snapshot.version)
+            if etag_matches(event, etag):
+                return not_modified_response(etag, ACCOUNTS_CACHE_CONTROL)
+
+            result = {
+                'tokens': {open_id: project_token(open_id, token, fields) for open_id, token in tokens.items()},
+                'total': total
+            }
+            if paged:
+                result.update(count=len(tokens), next_cursor=encode_cursor(next_after) if next_after else None)
+
+            response = {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'ETag': etag,
+                    'Cache-Control': ACCOUNTS_CACHE_CONTROL,
+                    'Vary': 'Accept-Encoding',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(result)
+            }
+            return gzip_response(response) if use_gzip else response
+
+        elif http_method == 'POST' and path == '/tokens/batch':
+            # POST /tokens/batch - Get access tokens for many open_ids
+            try:
+                body = json.loads(request_body(event) or '{}')
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': 'Request body must be valid JSON'
+                    })
+                }
+            open_ids = body.get('open_ids') if isinstance(body, dict) else None
+
+            if (not isinstance(open_ids, list) or not open_ids
+                    or not all(isinstance(open_id, str) and open_id for open_id in open_ids)):
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': 'open_ids must be a non-empty list of strings'
+                    })
+                }
+
+            if len(open_ids) > BATCH_MAX_OPEN_IDS:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': f'At most {BATCH_MAX_OPEN_IDS} open_ids are allowed per request'
+                    })
+                }
+
+            results = TokenStore.get_access_tokens(list(dict.fromkeys(open_ids)), max_workers=BATCH_MAX_WORKERS)
+            failed = sum(1 for result in results.values() if 'error' in result)
 
             return {
                 'statusCode': 200,
@@ -54,23 +322,27 @@ def lambda_handler(event, context):
                     'Access-Control-Allow-Origin': '*'
                 },
                 'body': json.dumps({
-                    'tokens': raw_tokens,
-                    'total': len(raw_tokens)
+                    'results': results,
+                    'total': len(results),
+                    'failed': failed
                 })
             }
 
         elif http_method == 'GET' and path_parameters and path_parameters.get('open_id'):
             # GET /token/{open_id} - Get access token for specified open_id
             open_id = path_parameters.get('open_id')
+            query = event.get('queryStringParameters') or {}
 
             # Get access token (with automatic refresh if needed)
-            access_token = TokenStore.get_access_token(open_id)
+            token = TokenStore.get_token(open_id, force=query.get('refresh') == 'true')
+            access_token = token.get('access_token') if token else None
 
             if not access_token:
                 return {
                     'statusCode': 404,
                     'headers': {
                         'Content-Type': 'application/json',
+                        'Cache-Control': 'no-store',
                         'Access-Control-Allow-Origin': '*'
                     },
                     'body': json.dumps({
@@ -78,15 +350,20 @@ def lambda_handler(event, context):
                     })
                 }
 
+            expires_at = token.get('expires_at')
+            max_age = int(expires_at - time.time() - TOKEN_CACHE_SKEW_SECONDS) if expires_at else 0
+
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
+                    'Cache-Control': f'private, max-age={max(0, max_age)}',
                     'Access-Control-Allow-Origin': '*'
                 },
                 'body': json.dumps({
                     'access_token': access_token,
-                    'open_id': open_id
+                    'open_id': open_id,
+                    'expires_at': expires_at
                 })
             }
 
@@ -104,13 +381,7 @@ def lambda_handler(event, context):
 
     except Exception as e:
         logger.error(f"Lambda execution error: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'error': 'Internal server error'
-            })
-        }
+        return internal_error_response(e)
+
+    finally:
+        logger.info(f"TokenStore cache stats: {TokenStore.cache_stats()}")
@@ -0,0 +1,66 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import logging
+import time
+from token_store import TokenStore, flush_on_return
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+REFRESH_WINDOW_SECONDS = int(os.getenv("REFRESH_WINDOW_SECONDS", "3600"))
+REFRESH_MAX_WORKERS = int(os.getenv("REFRESH_MAX_WORKERS", "8"))
+
+
+def select_expiring(tokens: dict, window_seconds: int, now: float) -> dict:
+    """Pick accounts whose access token expires within window_seconds and can be refreshed"""
+    return {
+        open_id: token
+        for open_id, token in tokens.items()
+        if token.get("refresh_token") and token.get("expires_at", 0) <= now + window_seconds
+    }
+
+
+@flush_on_return
+def lambda_handler(event, context):
+    """
+    AWS Lambda handler for scheduled (EventBridge) bulk token refresh
+
+    Refreshes every account whose access token expires within the window
+    so that GET /token/{open_id} never has to refresh on the request path.
+
+    Optional event fields:
+    - window_seconds: Override REFRESH_WINDOW_SECONDS
+    - max_workers: Override REFRESH_MAX_WORKERS
+
+    Returns:
+    - refreshed: open_ids refreshed successfully
+    - failed: open_ids whose refresh failed
+    - skipped: number of accounts not yet due
+    """
+    event = event or {}
+    window_seconds = int(event.get('window_seconds', REFRESH_WINDOW_SECONDS))
+    max_workers = int(event.get('max_workers', REFRESH_MAX_WORKERS))
+
+    # Only the accounts the expiry manifest reports as due are loaded from the store
+    expiring = TokenStore.list_expiring(window_seconds)
+    total = len(TokenStore.list_accounts())
+    tokens = TokenStore.load_tokens([entry['open_id'] for entry in expiring])
+    due = select_expiring(tokens, window_seconds, time.time())
+    logger.info(f"Refreshing {len(due)} of {total} accounts expiring within {window_seconds}s")
+
+    # Refreshes take the same per-account lease as GET /token, and are saved in one write
+    results = TokenStore.refresh_many(due, max_workers=max_workers, min_ttl=window_seconds)
+    refreshed = {open_id: token for open_id, token in results.items() if token}
+    failed = sorted(open_id for open_id, token in results.items() if not token)
+
+    if failed:
+        logger.error(f"Token refresh failed for: {failed}")
+
+    return {
+        'refreshed': sorted(refreshed),
+        'failed': failed,
+        'skipped': total - len(due)
+    }
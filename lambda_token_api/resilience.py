@@ -0,0 +1,220 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import asyncio
+import random
+import threading
+import time
+import logging
+from typing import Optional, Callable, Any
+
+# 外部 API 呼び出しのタイムアウト（接続, 読み取り）
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "3.05"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "10"))
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS)
+
+# リトライ: decorrelated jitter で base〜max の間隔を空け、合計 budget 秒を超えない
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "5"))
+RETRY_BUDGET_SECONDS = float(os.getenv("RETRY_BUDGET_SECONDS", "20"))
+
+# サーキットブレーカー: 連続 threshold 回の失敗で reset 秒間は即座に失敗させる
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# サーバー側の一時的な障害を示すステータス（429 は呼び出し側のレート制御で扱う）
+RETRYABLE_STATUS_CODES = frozenset({408, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """サーキットが開いているため呼び出さずに失敗した"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.1f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _error_names(error: BaseException) -> set:
+    return {cls.__name__ for cls in type(error).__mro__
+            if cls.__module__.split(".")[0] in ("requests", "httpx")}
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """タイムアウトや接続断など、やり直せば成功しうる requests / httpx の例外か"""
+    return bool(_error_names(error) & {"Timeout", "ConnectionError", "TransportError"})
+
+
+def is_unsent_error(error: BaseException) -> bool:
+    """接続できずリクエストが相手に届いていないことが確実な例外か"""
+    return bool(_error_names(error) & {"ConnectTimeout", "ConnectError"})
+
+
+def decorrelated_jitter(previous: float, base: float, cap: float) -> float:
+    """前回の待ち時間から次の待ち時間を決める（base〜前回の3倍の一様乱数、cap で頭打ち）"""
+    return min(cap, random.uniform(base, max(base, previous * 3)))
+
+
+class CircuitBreaker:
+    """依存先ごとのサーキットブレーカー（closed → open → half-open）
+
+    half-open では試行を1件だけ通し、その結果で closed に戻すか再び open にする。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self.clock() - self._opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        """呼び出してよければ戻り、だめなら CircuitOpenError"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_seconds - self.clock()
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpenError(self.name, max(remaining, 0.0) or self.reset_seconds)
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None and self._probing:
+                logging.info(f"[Resilience] {self.name} recovered; closing circuit")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                logging.warning(f"[Resilience] {self.name} failing; opening circuit for {self.reset_seconds}s")
+                self._opened_at = self.clock()
+            self._probing = False
+
+    def release(self):
+        """成否を判断できない結果で終わった half-open の試行枠を返す"""
+        with self._lock:
+            self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+
+class Resilience:
+    """タイムアウト付き HTTP 呼び出しにリトライとサーキットブレーカーを掛ける
+
+    send はリクエストを1回送ってレスポンスを返す関数。リトライするのは一時的な
+    障害（RETRYABLE_STATUS_CODES・タイムアウト・接続断）だけで、idempotent=False の
+    呼び出しは相手に届いていないことが確実な接続失敗のときだけやり直す。
+    リトライし尽くした場合は最後のレスポンスを返すか例外を送出する。
+    """
+
+    def __init__(self, name: str, breaker: Optional[CircuitBreaker] = None,
+                 max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY_SECONDS,
+                 max_delay: float = RETRY_MAX_DELAY_SECONDS, budget: float = RETRY_BUDGET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.name = name
+        self.breaker = breaker or CircuitBreaker(name, clock=clock)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.clock = clock
+        self.sleep = sleep
+
+    def _outcome(self, response: Any = None, error: Optional[BaseException] = None,
+                 idempotent: bool = True) -> bool:
+        """結果をブレーカーに記録し、やり直す価値があるかを返す"""
+        if error is not None:
+            if not is_transient_error(error):
+                self.breaker.release()
+                return False
+            self.breaker.record_failure()
+            return idempotent or is_unsent_error(error)
+        if getattr(response, "status_code", None) in RETRYABLE_STATUS_CODES:
+            self.breaker.record_failure()
+            return idempotent
+        self.breaker.record_success()
+        return False
+
+    def _next_delay(self, attempt: int, delay: float, deadline: float) -> Optional[float]:
+        """次の試行までの待ち時間（試行回数か時間の上限に達していれば None）"""
+        if attempt >= self.max_attempts:
+            return None
+        delay = decorrelated_jitter(delay, self.base_delay, self.max_delay)
+        return delay if self.clock() + delay <= deadline else None
+
+    def call(self, send: Callable[[], Any], idempotent: bool = True) -> Any:
+        deadline = self.clock() + self.budget
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.allow()
+            try:
+                response = send()
+            except Exception as e:
+                if not self._outcome(error=e, idempotent=idempotent):
+                    raise
+                delay = self._next_delay(attempt, delay, deadline)
+                if delay is None:
+                    raise
+                logging.warning(f"[Resilience] {self.name} attempt {attempt} failed ({e}); retrying in {delay:.2f}s")
+            else:
+                if not self._outcome(response, idempotent=idempotent):
+                    return response
+                delay = self._next_delay(attempt, delay, deadline)
+                if delay is None:
+                    return response
+                logging.warning(f"[Resilience] {self.name} attempt {attempt} returned "
+                                f"{response.status_code}; retrying in {delay:.2f}s")
+            self.sleep(delay)
+
+    async def call_async(self, send: Callable[[], Any], idempotent: bool = True) -> Any:
+        """call() のコルーチン版（send はコルーチンを返す関数）"""
+        deadline = self.clock() + self.budget
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.allow()
+            try:
+                response = await send()
+            except Exception as e:
+                if not self._outcome(error=e, idempotent=idempotent):
+                    raise
+                delay = self._next_delay(attempt, delay, deadline)
+                if delay is None:
+                    raise
+                logging.warning(f"[Resilience] {self.name} attempt {attempt} failed ({e}); retrying in {delay:.2f}s")
+            else:
+                if not self._outcome(response, idempotent=idempotent):
+                    return response
+                delay = self._next_delay(attempt, delay, deadline)
+                if delay is None:
+                    return response
+                logging.warning(f"[Resilience] {self.name} attempt {attempt} returned "
+                                f"{response.status_code}; retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def reset(self):
+        self.breaker.reset()
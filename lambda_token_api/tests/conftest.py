@@ -0,0 +1,108 @@
+import os
+import sys
+import threading
+import hashlib
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from botocore.exceptions import ClientError
+
+import token_store
+from token_backends import S3Backend, SQLiteBackend
+
+
+class FakeS3:
+    """S3 クライアントのうち TokenStore が使う操作だけを再現するローカル代替"""
+
+    def __init__(self, latency: float = 0.0):
+        self.objects = {}
+        self.calls = []
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _error(code, operation):
+        return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls.append(("get_object", Key))
+            if Key not in self.objects:
+                raise self._error("NoSuchKey", "GetObject")
+            body, etag = self.objects[Key]
+            if kwargs.get("IfNoneMatch") == etag:
+                raise self._error("304", "GetObject")
+        return {"Body": BytesIO(body), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls.append(("put_object", Key))
+            current = self.objects.get(Key)
+            if "IfMatch" in kwargs and (current is None or current[1] != kwargs["IfMatch"]):
+                raise self._error("PreconditionFailed", "PutObject")
+            if kwargs.get("IfNoneMatch") == "*" and current is not None:
+                raise self._error("PreconditionFailed", "PutObject")
+            etag = '"%s"' % hashlib.md5(Body).hexdigest()
+            self.objects[Key] = (Body, etag)
+        return {"ETag": etag}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self.calls.append(("delete_object", Key))
+            self.objects.pop(Key, None)
+        return {}
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix="", **kwargs):
+        with self._lock:
+            self.calls.append(("list_objects_v2", Prefix))
+            keys = sorted(k for k in self.objects if k.startswith(Prefix))
+            contents = [{"Key": k, "ETag": self.objects[k][1]} for k in keys]
+        yield {"Contents": contents}
+
+    def count(self, operation, key=None):
+        return sum(1 for op, k in self.calls if op == operation and key in (None, k))
+
+
+@pytest.fixture(autouse=True)
+def clear_token_cache(monkeypatch):
+    token_store.TokenStore.clear_cache()
+    monkeypatch.setattr(token_store, "_writes", token_store._WriteBuffer())
+    token_store._oauth.reset()
+    yield
+    token_store.TokenStore.clear_cache()
+
+
+@pytest.fixture
+def without_manifest(monkeypatch):
+    """有効期限インデックスの更新を止め、キャッシュ統計をトークンの読み書きだけにする"""
+    monkeypatch.setattr(token_store.TokenStore, "_update_manifest", classmethod(lambda cls, *args, **kwargs: None))
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    fake = FakeS3()
+    monkeypatch.setattr(token_store, "_backend", S3Backend("tiktok-token-store", client=fake))
+    return fake
+
+
+@pytest.fixture
+def sqlite_backend(monkeypatch, tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "tokens.sqlite3"))
+    monkeypatch.setattr(token_store, "_backend", backend)
+    return backend
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    monkeypatch.setattr(token_store, "TOKEN_LAYOUT", "sharded")
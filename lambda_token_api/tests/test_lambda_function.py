@@ -0,0 +1,225 @@
+import gzip
+import base64
+import json
+import time
+from unittest.mock import patch, MagicMock
+
+import lambda_function
+import token_store
+from lambda_function import lambda_handler
+from token_store import TokenStore
+
+
+def _token(access_token, expires_in, refresh_token="rft.1"):
+    return {"access_token": access_token, "refresh_token": refresh_token, "expires_at": time.time() + expires_in}
+
+
+class TestTokenBatch:
+
+    def _event(self, body):
+        return {'httpMethod': 'POST', 'resource': '/tokens/batch', 'body': json.dumps(body)}
+
+    @patch('requests.post')
+    def test_batch_returns_per_id_results(self, mock_post, fake_s3):
+        refresh_response = MagicMock(status_code=200)
+        refresh_response.json.return_value = {"access_token": "act.b2", "refresh_token": "rft.2", "expires_in": 3600}
+        mock_post.return_value = refresh_response
+        TokenStore.save_tokens({
+            "user_a": _token("act.a", 3600),
+            "user_b": _token("act.b", -60),
+            "user_c": _token("act.c", -60, refresh_token=None),
+        })
+        TokenStore.clear_cache()
+        fake_s3.calls.clear()
+
+        result = lambda_handler(self._event({'open_ids': ['user_a', 'user_b', 'user_c', 'missing']}), {})
+
+        assert result['statusCode'] == 200
+        body = json.loads(result['body'])
+        assert body['results']['user_a']['access_token'] == 'act.a'
+        assert body['results']['user_b']['access_token'] == 'act.b2'
+        assert body['results']['user_c'] == {'error': 'expired'}
+        assert body['results']['missing'] == {'error': 'not_found'}
+        assert body['total'] == 4
+        assert body['failed'] == 2
+        assert mock_post.call_count == 1
+
+    def test_batch_rejects_invalid_body(self, fake_s3):
+        result = lambda_handler(self._event({'open_ids': 'user_a'}), {})
+
+        assert result['statusCode'] == 400
+        assert 'open_ids' in json.loads(result['body'])['error']
+
+    def test_batch_accepts_base64_encoded_body(self, fake_s3):
+        TokenStore.save_token(_token("act.a", 3600), "user_a")
+        event = {'httpMethod': 'POST', 'resource': '/tokens/batch', 'isBase64Encoded': True,
+                 'body': base64.b64encode(json.dumps({'open_ids': ['user_a']}).encode('utf-8')).decode('ascii')}
+
+        result = lambda_handler(event, {})
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body'])['results']['user_a']['access_token'] == 'act.a'
+
+    def test_batch_rejects_malformed_json(self, fake_s3):
+        result = lambda_handler({'httpMethod': 'POST', 'resource': '/tokens/batch', 'body': '{"open_ids": ['}, {})
+
+        assert result['statusCode'] == 400
+        assert result['headers']['Access-Control-Allow-Origin'] == '*'
+        assert 'JSON' in json.loads(result['body'])['error']
+
+
+class TestCacheValidators:
+
+    def _event(self, resource, if_none_match=None):
+        event = {'httpMethod': 'GET', 'resource': resource, 'headers': {}}
+        if if_none_match:
+            event['headers']['if-none-match'] = if_none_match
+        return event
+
+    def test_accounts_returns_304_until_store_changes(self, fake_s3):
+        TokenStore.save_token({"access_token": "act.a", "expires_in": 3600}, "user_a")
+
+        first = lambda_handler(self._event('/accounts'), {})
+        etag = first['headers']['ETag']
+        assert first['statusCode'] == 200
+        assert first['headers']['Cache-Control'] == 'private, no-cache'
+
+        second = lambda_handler(self._event('/accounts', if_none_match=etag), {})
+        assert second['statusCode'] == 304
+        assert second['body'] == ''
+
+        TokenStore.save_token({"access_token": "act.b", "expires_in": 3600}, "user_b")
+        third = lambda_handler(self._event('/accounts', if_none_match=etag), {})
+        assert third['statusCode'] == 200
+        assert json.loads(third['body'])['total'] == 2
+
+    def test_etag_matches_body_after_write_from_another_container(self, fake_s3):
+        TokenStore.save_token({"access_token": "act.a", "expires_in": 3600}, "user_a")
+        first = lambda_handler(self._event('/accounts'), {})
+        stale_cache = dict(token_store._cache._entries)
+
+        # Another container adds user_b; this container's warm cache has not seen it yet
+        TokenStore.save_token({"access_token": "act.b", "expires_in": 3600}, "user_b")
+        token_store._cache._entries.clear()
+        token_store._cache._entries.update(stale_cache)
+
+        second = lambda_handler(self._event('/accounts', if_none_match=first['headers']['ETag']), {})
+        assert second['statusCode'] == 200
+        assert json.loads(second['body'])['accounts'] == ['user_a', 'user_b']
+        third = lambda_handler(self._event('/accounts', if_none_match=second['headers']['ETag']), {})
+        assert third['statusCode'] == 304
+
+    def test_full_accounts_etag_differs_from_accounts(self, fake_s3, sharded):
+        TokenStore.save_token({"access_token": "act.a", "expires_in": 3600}, "user_a")
+
+        accounts = lambda_handler(self._event('/accounts'), {})
+        full = lambda_handler(self._event('/accounts/full'), {})
+
+        assert accounts['headers']['ETag'] != full['headers']['ETag']
+        again = lambda_handler(self._event('/accounts/full', if_none_match=full['headers']['ETag']), {})
+        assert again['statusCode'] == 304
+
+    def test_token_max_age_follows_expiry(self, fake_s3):
+        TokenStore.save_token({"access_token": "act.a", "expires_at": time.time() + 3600}, "user_a")
+
+        result = lambda_handler({'httpMethod': 'GET', 'resource': '/token/{open_id}',
+                                 'pathParameters': {'open_id': 'user_a'}}, {})
+
+        assert result['statusCode'] == 200
+        max_age = int(result['headers']['Cache-Control'].split('max-age=')[1])
+        assert 3600 - 300 - 5 <= max_age <= 3600 - 300
+        assert json.loads(result['body'])['expires_at'] > time.time()
+
+    def test_token_refresh_query_forces_refresh(self, fake_s3):
+        with patch.object(TokenStore, 'get_token', return_value=None) as mock_get_token:
+            lambda_handler({'httpMethod': 'GET', 'resource': '/token/{open_id}',
+                            'pathParameters': {'open_id': 'user_a'},
+                            'queryStringParameters': {'refresh': 'true'}}, {})
+
+        mock_get_token.assert_called_once_with('user_a', force=True)
+
+
+class TestAccountsFullPaging:
+
+    def _event(self, query=None, headers=None):
+        return {'httpMethod': 'GET', 'resource': '/accounts/full',
+                'queryStringParameters': query, 'headers': headers or {}}
+
+    def test_cursor_walks_every_account_once(self, fake_s3):
+        TokenStore.save_tokens({f"user_{i:02d}": _token(f"act.{i}", 3600) for i in range(25)})
+
+        seen, cursor = [], None
+        while True:
+            query = {'limit': '10', **({'cursor': cursor} if cursor else {})}
+            body = json.loads(lambda_handler(self._event(query), {})['body'])
+            assert body['total'] == 25
+            seen.extend(body['tokens'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+
+        assert seen == [f"user_{i:02d}" for i in range(25)]
+
+    def test_without_paging_returns_every_account(self, fake_s3, monkeypatch):
+        monkeypatch.setattr(lambda_function, 'ACCOUNTS_PAGE_SIZE', 10)
+        TokenStore.save_tokens({f"user_{i:02d}": _token(f"act.{i}", 3600) for i in range(25)})
+
+        body = json.loads(lambda_handler(self._event(), {})['body'])
+
+        assert body['total'] == 25
+        assert sorted(body['tokens']) == [f"user_{i:02d}" for i in range(25)]
+        assert 'next_cursor' not in body
+
+    def test_fields_projection(self, fake_s3):
+        TokenStore.save_token(dict(_token("act.a", 3600), scope="video.publish"), "user_a")
+
+        body = json.loads(lambda_handler(self._event({'fields': 'open_id,expires_at,scope'}), {})['body'])
+
+        assert set(body['tokens']['user_a']) == {'open_id', 'expires_at', 'scope'}
+        assert body['tokens']['user_a']['open_id'] == 'user_a'
+
+    def test_gzip_when_accepted(self, fake_s3):
+        TokenStore.save_tokens({f"user_{i:02d}": _token(f"act.{i}", 3600) for i in range(50)})
+
+        plain = lambda_handler(self._event(), {})
+        compressed = lambda_handler(self._event(headers={'Accept-Encoding': 'gzip, deflate'}), {})
+
+        assert 'isBase64Encoded' not in plain
+        assert compressed['isBase64Encoded'] is True
+        assert compressed['headers']['Content-Encoding'] == 'gzip'
+        assert compressed['headers']['ETag'] != plain['headers']['ETag']
+        decoded = gzip.decompress(base64.b64decode(compressed['body'])).decode('utf-8')
+        assert json.loads(decoded) == json.loads(plain['body'])
+
+    def test_rejects_malformed_cursor(self, fake_s3):
+        result = lambda_handler(self._event({'cursor': 'not-a-cursor'}), {})
+
+        assert result['statusCode'] == 400
+
+
+class TestAccountsExpiring:
+
+    def test_lists_accounts_expiring_within_minutes(self, fake_s3):
+        TokenStore.save_tokens({
+            "soon": _token("act.s", 5 * 60),
+            "later": _token("act.l", 3 * 3600),
+        })
+
+        result = lambda_handler({'httpMethod': 'GET', 'resource': '/accounts/expiring',
+                                 'queryStringParameters': {'within_minutes': '30'}}, {})
+
+        assert result['statusCode'] == 200
+        body = json.loads(result['body'])
+        assert [entry['open_id'] for entry in body['accounts']] == ['soon']
+        assert 'access_token' not in result['body']
+
+
+class TestFlushFailure:
+
+    def test_failed_flush_returns_json_500(self, fake_s3):
+        with patch.object(TokenStore, 'flush', side_effect=RuntimeError("store unavailable")):
+            result = lambda_handler({'httpMethod': 'GET', 'resource': '/accounts'}, {})
+
+        assert result['statusCode'] == 500
+        assert result['headers']['Access-Control-Allow-Origin'] == '*'
+        assert json.loads(result['body'])['error'] == 'Internal server error'
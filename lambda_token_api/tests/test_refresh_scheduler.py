@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+import refresh_scheduler
+import token_store
+from token_store import TokenStore
+
+
+def _token(open_id, expires_in, refresh_token="rft.old"):
+    return {
+        "access_token": f"act.{open_id}",
+        "refresh_token": refresh_token,
+        "expires_at": time.time() + expires_in,
+    }
+
+
+def _refresh_response(data):
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {
+        "access_token": f"act.new.{data['refresh_token']}",
+        "refresh_token": "rft.new",
+        "expires_in": 86400,
+    }
+    return response
+
+
+class TestRefreshScheduler:
+
+    @patch('requests.post')
+    def test_refreshes_only_accounts_inside_window(self, mock_post, fake_s3):
+        mock_post.side_effect = lambda url, data, **kwargs: _refresh_response(data)
+        TokenStore.save_tokens({
+            "expiring": _token("expiring", 60, refresh_token="rft.expiring"),
+            "expired": _token("expired", -60, refresh_token="rft.expired"),
+            "fresh": _token("fresh", 86400),
+            "no_refresh": _token("no_refresh", 60, refresh_token=None),
+        })
+        puts_before = fake_s3.count("put_object", "tiktok_tokens.json")
+
+        result = refresh_scheduler.lambda_handler({"window_seconds": 600}, None)
+
+        assert result == {"refreshed": ["expired", "expiring"], "failed": [], "skipped": 2}
+        assert mock_post.call_count == 2
+        assert fake_s3.count("put_object", "tiktok_tokens.json") == puts_before + 1
+        assert TokenStore.load_token("expiring")["access_token"] == "act.new.rft.expiring"
+        assert TokenStore.load_token("fresh")["access_token"] == "act.fresh"
+
+    @patch('requests.post')
+    def test_waits_for_refresh_held_by_another_container(self, mock_post, fake_s3, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_REFRESH_POLL_INTERVAL", 0.01)
+        mock_post.side_effect = lambda url, data, **kwargs: _refresh_response(data)
+        TokenStore.save_tokens({"expiring": _token("expiring", 60, refresh_token="rft.expiring")})
+        fake_s3.put_object(Bucket="b", Key="leases/expiring.json",
+                           Body='{"owner": "other", "expires_at": %f}' % (time.time() + 10))
+
+        def other_container_finishes():
+            time.sleep(0.05)
+            fake_s3.put_object(Bucket="b", Key="tiktok_tokens.json",
+                               Body=json.dumps({"expiring": _token("expiring", 86400, refresh_token="rft.rotated")}))
+            fake_s3.delete_object(Bucket="b", Key="leases/expiring.json")
+
+        threading.Thread(target=other_container_finishes).start()
+        result = refresh_scheduler.lambda_handler({"window_seconds": 600}, None)
+
+        assert result["refreshed"] == ["expiring"]
+        mock_post.assert_not_called()
+        assert TokenStore.load_token("expiring")["refresh_token"] == "rft.rotated"
+
+    @patch('requests.post')
+    def test_failed_refresh_keeps_existing_token(self, mock_post, fake_s3):
+        mock_post.return_value = MagicMock(status_code=400, text="invalid_grant")
+        TokenStore.save_tokens({"expiring": _token("expiring", 60)})
+
+        result = refresh_scheduler.lambda_handler({}, None)
+
+        assert result["failed"] == ["expiring"]
+        assert TokenStore.load_token("expiring")["access_token"] == "act.expiring"
@@ -0,0 +1,142 @@
+import asyncio
+from unittest.mock import patch, MagicMock
+
+import pytest
+import requests
+
+import token_store
+from resilience import Resilience, CircuitBreaker, CircuitOpenError, decorrelated_jitter, DEFAULT_TIMEOUT
+from token_store import TokenStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _resilience(clock, **kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker("test", failure_threshold=3, reset_seconds=30, clock=clock))
+    return Resilience("test", clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def _response(status_code):
+    return MagicMock(status_code=status_code)
+
+
+class TestResilience:
+
+    def test_retries_retryable_status_then_succeeds(self):
+        clock = FakeClock()
+        send = MagicMock(side_effect=[_response(503), _response(502), _response(200)])
+
+        response = _resilience(clock, max_attempts=3).call(send)
+
+        assert response.status_code == 200
+        assert send.call_count == 3
+        assert len(clock.sleeps) == 2
+
+    def test_client_errors_are_not_retried(self):
+        clock = FakeClock()
+        send = MagicMock(return_value=_response(400))
+
+        assert _resilience(clock).call(send).status_code == 400
+        assert send.call_count == 1
+
+    def test_non_idempotent_calls_retry_only_unsent_requests(self):
+        clock = FakeClock()
+        resilience = _resilience(clock)
+
+        send = MagicMock(side_effect=requests.exceptions.ReadTimeout("slow"))
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            resilience.call(send, idempotent=False)
+        assert send.call_count == 1
+
+        send = MagicMock(side_effect=[requests.exceptions.ConnectTimeout("down"), _response(200)])
+        assert resilience.call(send, idempotent=False).status_code == 200
+        assert send.call_count == 2
+
+    def test_gives_up_within_budget(self):
+        clock = FakeClock()
+        send = MagicMock(return_value=_response(503))
+
+        response = _resilience(clock, max_attempts=10, base_delay=1, max_delay=4, budget=5,
+                               breaker=CircuitBreaker("test", failure_threshold=100, clock=clock)).call(send)
+
+        assert response.status_code == 503
+        assert sum(clock.sleeps) <= 5
+
+    def test_jitter_stays_within_bounds(self):
+        delays = [decorrelated_jitter(2.0, 0.2, 5.0) for _ in range(200)]
+        assert all(0.2 <= delay <= 5.0 for delay in delays)
+        assert len(set(delays)) > 1
+
+    def test_async_call_retries(self):
+        clock = FakeClock()
+        responses = iter([_response(500), _response(200)])
+
+        async def send():
+            return next(responses)
+
+        response = asyncio.run(_resilience(clock, base_delay=0.001, max_delay=0.001).call_async(send))
+
+        assert response.status_code == 200
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_failures_and_fails_fast(self):
+        clock = FakeClock()
+        resilience = _resilience(clock, max_attempts=1)
+        send = MagicMock(return_value=_response(503))
+
+        for _ in range(3):
+            resilience.call(send)
+        with pytest.raises(CircuitOpenError) as error:
+            resilience.call(send)
+
+        assert send.call_count == 3
+        assert error.value.retry_after == pytest.approx(30)
+
+    def test_half_open_probe_closes_or_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=10, clock=clock)
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        clock.now = 10
+        breaker.allow()
+        # Only one probe at a time while half-open
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        clock.now = 20
+        breaker.allow()
+        breaker.record_success()
+        assert breaker.state == "closed"
+        breaker.allow()
+
+
+class TestRefreshResilience:
+
+    @patch('requests.post')
+    def test_refresh_uses_timeout_and_skips_when_circuit_open(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.return_value = {"access_token": "act.new", "expires_in": 3600}
+
+        assert TokenStore._request_refresh("rft.1", "user_a")["access_token"] == "act.new"
+        assert mock_post.call_args.kwargs["timeout"] == DEFAULT_TIMEOUT
+
+        for _ in range(token_store._oauth.breaker.failure_threshold):
+            token_store._oauth.breaker.record_failure()
+        assert TokenStore._request_refresh("rft.1", "user_a") is None
+        assert mock_post.call_count == 1
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+import token_store
+from conftest import FakeS3
+from token_backends import TokenBackend, S3Backend, SQLiteBackend, NotModified, PreconditionFailed, create_backend
+from token_store import TokenStore
+
+
+@pytest.fixture(params=["s3", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "s3":
+        return S3Backend("tiktok-token-store", client=FakeS3())
+    return SQLiteBackend(str(tmp_path / "tokens.sqlite3"))
+
+
+class TestBackendContract:
+
+    def test_get_missing_returns_none(self, backend):
+        assert backend.get("tokens/missing.json") is None
+
+    def test_put_get_and_not_modified(self, backend):
+        etag = backend.put("tokens/a.json", b'{"a": 1}')
+
+        stored = backend.get("tokens/a.json")
+        assert stored.body == b'{"a": 1}'
+        assert stored.etag == etag
+        with pytest.raises(NotModified):
+            backend.get("tokens/a.json", if_none_match=etag)
+
+    def test_conditional_put(self, backend):
+        with pytest.raises(PreconditionFailed):
+            backend.put("tokens/a.json", b"1", if_match='"nope"')
+        etag = backend.put("tokens/a.json", b"1", if_none_match="*")
+        with pytest.raises(PreconditionFailed):
+            backend.put("tokens/a.json", b"2", if_none_match="*")
+        with pytest.raises(PreconditionFailed):
+            backend.put("tokens/a.json", b"2", if_match='"stale"')
+        assert backend.put("tokens/a.json", b"2", if_match=etag) != etag
+
+    def test_list_keys_by_prefix_and_delete(self, backend):
+        for key in ("tokens/b.json", "tokens/a.json", "leases/a.json", "tokens0"):
+            backend.put(key, b"{}")
+
+        assert backend.list_keys("tokens/") == ["tokens/a.json", "tokens/b.json"]
+        backend.delete("tokens/a.json")
+        assert backend.list_keys("tokens/") == ["tokens/b.json"]
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class GetOnlyBackend(TokenBackend):
+            def get(self, key, if_none_match=None):
+                return None
+
+        with pytest.raises(TypeError):
+            GetOnlyBackend()
+
+
+class TestSQLiteTokenStore:
+
+    def test_token_store_on_sqlite(self, sqlite_backend, sharded):
+        TokenStore.save_token({"access_token": "act.a", "expires_in": 3600}, "user_a")
+        TokenStore.clear_cache()
+
+        assert TokenStore.load_token("user_a")["access_token"] == "act.a"
+        assert TokenStore.list_accounts() == ["user_a"]
+        assert TokenStore.delete_account("user_a") is True
+        assert TokenStore.list_accounts() == []
+
+    def test_concurrent_blob_writers_on_sqlite(self, sqlite_backend, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_CAS_MAX_RETRIES", 200)
+
+        def writer(n):
+            for i in range(5):
+                TokenStore.save_token({"access_token": "act", "expires_in": 3600}, f"user_{n}_{i}")
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        TokenStore.clear_cache()
+        assert len(TokenStore.list_accounts()) == 40
+
+    def test_create_backend_rejects_unknown_driver(self):
+        with pytest.raises(ValueError):
+            create_backend("redis")
@@ -6,11 +6,18 @@ Run this locally to test S3 token operations before deploying to Lambda
 
 import os
 import sys
+import json
+import threading
+import time
 from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+import pytest
 
 # Add the current directory to the path so we can import token_store
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dependencies'))
 
+import token_store
 from token_store import TokenStore
 
 def test_token_operations():
@@ -108,6 +115,437 @@ def test_s3_connection():
         print("  - S3 bucket 'tiktok-token-store' exists")
         print("  - Proper IAM permissions for S3 access")
 
+class TestShardedLayout:
+
+    def _token(self, open_id, access_token="act.1"):
+        return {
+            "access_token": access_token,
+            "refresh_token": "rft.1",
+            "expires_in": 3600,
+            "open_id": open_id,
+        }
+
+    def test_save_and_load_touch_only_the_account_shard(self, fake_s3, sharded):
+        TokenStore.save_token(self._token("user_a"))
+        TokenStore.save_token(self._token("user_b"))
+        TokenStore.clear_cache()
+        fake_s3.calls.clear()
+
+        token = TokenStore.load_token("user_a")
+
+        assert token["access_token"] == "act.1"
+        assert fake_s3.calls == [("get_object", "tokens/user_a.json")]
+
+    def test_list_and_delete_accounts(self, fake_s3, sharded):
+        TokenStore.save_token(self._token("user_a"))
+        TokenStore.save_token(self._token("user/b"))
+
+        assert sorted(TokenStore.list_accounts()) == ["user/b", "user_a"]
+        assert TokenStore.delete_account("user/b") is True
+        assert TokenStore.delete_account("user/b") is False
+        assert TokenStore.list_accounts() == ["user_a"]
+
+    def test_migrate_from_legacy_blob(self, fake_s3, monkeypatch):
+        TokenStore.save_token(self._token("user_a"))
+        TokenStore.save_token(self._token("user_b"))
+
+        monkeypatch.setattr(token_store, "TOKEN_LAYOUT", "sharded")
+        TokenStore.save_token(self._token("user_b", access_token="act.newer"))
+
+        migrated = TokenStore.migrate_to_sharded(delete_legacy=True)
+
+        assert migrated == 1
+        assert "tiktok_tokens.json" not in fake_s3.objects
+        assert TokenStore.load_token("user_a")["access_token"] == "act.1"
+        assert TokenStore.load_token("user_b")["access_token"] == "act.newer"
+
+
+
+@pytest.mark.usefixtures("without_manifest")
+class TestTokenCache:
+
+    def _token(self, open_id, expires_in=3600):
+        return {"access_token": f"act.{open_id}", "refresh_token": "rft.1", "expires_in": expires_in}
+
+    def test_warm_reads_do_not_hit_s3(self, fake_s3, sharded):
+        TokenStore.save_token(self._token("user_a"), "user_a")
+        fake_s3.calls.clear()
+
+        for _ in range(5):
+            assert TokenStore.load_token("user_a")["access_token"] == "act.user_a"
+
+        assert fake_s3.count("get_object") == 0
+        assert TokenStore.cache_stats()["hits"] == 5
+
+    def test_revalidates_with_etag_after_ttl(self, fake_s3, sharded, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_CACHE_TTL", 0)
+        TokenStore.save_token(self._token("user_a"), "user_a")
+
+        assert TokenStore.load_token("user_a")["access_token"] == "act.user_a"
+        stats = TokenStore.cache_stats()
+        assert stats["revalidations"] == 1
+        assert stats["misses"] == 0
+
+        fake_s3.put_object(Bucket="b", Key="tokens/user_a.json", Body='{"access_token": "act.other"}')
+        assert TokenStore.load_token("user_a")["access_token"] == "act.other"
+        assert TokenStore.cache_stats()["misses"] == 1
+
+    def test_expired_token_is_not_served_from_cache(self, fake_s3, sharded):
+        TokenStore.save_token(self._token("user_a", expires_in=-1), "user_a")
+        fake_s3.calls.clear()
+
+        TokenStore.load_token("user_a")
+
+        assert fake_s3.count("get_object") == 1
+        assert TokenStore.cache_stats()["revalidations"] == 1
+
+    def test_expired_account_does_not_disable_cache_for_others(self, fake_s3):
+        TokenStore.save_token(self._token("user_a"), "user_a")
+        TokenStore.save_token(self._token("user_b", expires_in=-1), "user_b")
+        fake_s3.calls.clear()
+        hits = TokenStore.cache_stats()["hits"]
+
+        for _ in range(5):
+            assert TokenStore.get_access_token("user_a") == "act.user_a"
+
+        assert fake_s3.count("get_object") == 0
+        assert TokenStore.cache_stats()["hits"] == hits + 5
+
+    def test_lru_eviction(self, fake_s3, sharded, monkeypatch):
+        monkeypatch.setattr(token_store._cache, "max_size", 2)
+        for open_id in ("user_a", "user_b", "user_c"):
+            TokenStore.save_token(self._token(open_id), open_id)
+        fake_s3.calls.clear()
+
+        TokenStore.load_token("user_a")
+
+        assert fake_s3.calls == [("get_object", "tokens/user_a.json")]
+        assert TokenStore.cache_stats()["evictions"] == 2
+
+    def test_cached_data_is_not_shared_with_callers(self, fake_s3):
+        TokenStore.save_token(self._token("user_a"), "user_a")
+
+        TokenStore.load_token("user_a")["access_token"] = "mutated"
+
+        assert TokenStore.load_token("user_a")["access_token"] == "act.user_a"
+
+
+class TestConditionalWrites:
+
+    def test_concurrent_writers_do_not_lose_updates(self, monkeypatch):
+        from conftest import FakeS3
+
+        from token_backends import S3Backend
+
+        fake = FakeS3(latency=0.001)
+        monkeypatch.setattr(token_store, "_backend", S3Backend("tiktok-token-store", client=fake))
+        monkeypatch.setattr(token_store, "TOKEN_CAS_MAX_RETRIES", 200)
+        monkeypatch.setattr(token_store, "TOKEN_CAS_BACKOFF_MAX", 0.05)
+
+        def writer(n):
+            for i in range(5):
+                open_id = f"user_{n}_{i}"
+                TokenStore.save_token({"access_token": f"act.{open_id}", "expires_in": 3600}, open_id)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        TokenStore.clear_cache()
+        assert len(TokenStore.list_accounts()) == 80
+        assert fake.count("put_object") > 80
+
+    def test_stale_cached_etag_is_retried(self, fake_s3):
+        TokenStore.save_token({"access_token": "act.a", "expires_in": 3600}, "user_a")
+        fake_s3.put_object(Bucket="b", Key="tiktok_tokens.json",
+                           Body='{"user_b": {"access_token": "act.b"}}')
+
+        TokenStore.save_token({"access_token": "act.c", "expires_in": 3600}, "user_c")
+
+        TokenStore.clear_cache()
+        assert sorted(TokenStore._load_raw_tokens()) == ["user_b", "user_c"]
+
+    def test_gives_up_after_max_retries(self, fake_s3, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_CAS_MAX_RETRIES", 3)
+        monkeypatch.setattr(token_store, "TOKEN_CAS_BACKOFF_BASE", 0)
+        real_put = fake_s3.put_object
+        competing_writes = []
+
+        def conflicting_put(**kwargs):
+            competing_writes.append(kwargs["Key"])
+            real_put(Bucket="b", Key=kwargs["Key"], Body='{"n": %d}' % len(competing_writes))
+            return real_put(**kwargs)
+
+        monkeypatch.setattr(fake_s3, "put_object", conflicting_put)
+
+        with pytest.raises(token_store.ConcurrentUpdateError):
+            TokenStore.save_token({"access_token": "act.a"}, "user_a")
+
+
+class TestSingleFlightRefresh:
+
+    def _expired(self):
+        return {"access_token": "act.old", "refresh_token": "rft.old", "expires_at": time.time() - 1}
+
+    def _slow_refresh(self, *args, **kwargs):
+        time.sleep(0.05)
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"access_token": "act.new", "refresh_token": "rft.new", "expires_in": 3600}
+        return response
+
+    @patch('requests.post')
+    def test_concurrent_callers_share_one_refresh(self, mock_post, fake_s3):
+        mock_post.side_effect = self._slow_refresh
+        TokenStore.save_token(self._expired(), "user_a")
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(TokenStore.get_access_token("user_a")))
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == ["act.new"] * 10
+        assert mock_post.call_count == 1
+        assert not any(key.startswith("leases/") for key in fake_s3.objects)
+
+    @patch('requests.post')
+    def test_waits_for_refresh_held_by_another_container(self, mock_post, fake_s3, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_REFRESH_POLL_INTERVAL", 0.01)
+        TokenStore.save_token(self._expired(), "user_a")
+        fake_s3.put_object(Bucket="b", Key="leases/user_a.json",
+                           Body='{"owner": "other", "expires_at": %f}' % (time.time() + 10))
+
+        def other_container_finishes():
+            time.sleep(0.05)
+            fake_s3.put_object(Bucket="b", Key="tiktok_tokens.json",
+                               Body='{"user_a": {"access_token": "act.other", "expires_at": %f}}' % (time.time() + 3600))
+
+        threading.Thread(target=other_container_finishes).start()
+
+        assert TokenStore.get_access_token("user_a") == "act.other"
+        mock_post.assert_not_called()
+
+    @patch('requests.post')
+    def test_force_refreshes_a_rejected_token_once(self, mock_post, fake_s3):
+        mock_post.side_effect = self._slow_refresh
+        TokenStore.save_token({"access_token": "act.old", "refresh_token": "rft.old",
+                               "expires_at": time.time() + 3600}, "user_a")
+
+        assert TokenStore.get_token("user_a", force=True)["access_token"] == "act.new"
+        assert mock_post.call_count == 1
+
+        # 拒否されたトークンが既に別のトークンに更新されていれば、再び更新はしない
+        stale = TokenStore.load_token("user_a")
+        assert TokenStore._refresh_with_lease(stale["refresh_token"], "user_a",
+                                              stale_access_token="act.old")["access_token"] == "act.new"
+        assert mock_post.call_count == 1
+
+    @patch('requests.post')
+    def test_takes_over_expired_lease(self, mock_post, fake_s3):
+        mock_post.side_effect = self._slow_refresh
+        TokenStore.save_token(self._expired(), "user_a")
+        fake_s3.put_object(Bucket="b", Key="leases/user_a.json",
+                           Body='{"owner": "crashed", "expires_at": %f}' % (time.time() - 1))
+
+        assert TokenStore.get_access_token("user_a") == "act.new"
+        assert "leases/user_a.json" not in fake_s3.objects
+
+    @patch('requests.post')
+    def test_does_not_refresh_without_the_lease(self, mock_post, fake_s3, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_REFRESH_LEASE_TTL", 0.05)
+        monkeypatch.setattr(token_store, "TOKEN_REFRESH_POLL_INTERVAL", 0.01)
+        TokenStore.save_token(self._expired(), "user_a")
+        fake_s3.put_object(Bucket="b", Key="leases/user_a.json",
+                           Body='{"owner": "other", "expires_at": %f}' % (time.time() + 60))
+
+        assert TokenStore.get_access_token("user_a") is None
+        mock_post.assert_not_called()
+
+
+class TestStoreFormat:
+
+    TOKENS = {
+        "user_a": {"access_token": "act.a", "expires_at": 200.0},
+        "ユーザー\tb": {"access_token": "act.b", "expires_at": 100.0},
+    }
+
+    def test_v2_round_trip_and_lazy_lookup(self):
+        raw = token_store.TokenBlob.encode(self.TOKENS, version="v2", compression="none")
+        blob = token_store.TokenBlob(raw)
+
+        assert blob.version == 2
+        assert raw.count(b"\n") == 2
+        assert blob.get("ユーザー\tb") == {"access_token": "act.b", "expires_at": 100.0}
+        assert blob.get("missing") is None
+        assert sorted(blob.keys()) == sorted(self.TOKENS)
+        assert blob.to_dict() == self.TOKENS
+        assert blob.header["min_expires_at"] == 100.0
+
+    def test_gzip_is_detected_on_read(self):
+        raw = token_store.TokenBlob.encode(self.TOKENS, version="v2", compression="gzip")
+
+        assert raw[:2] == b"\x1f\x8b"
+        assert token_store.TokenBlob(raw).get("user_a")["access_token"] == "act.a"
+
+    def test_reads_legacy_pretty_json(self, fake_s3):
+        fake_s3.put_object(Bucket="b", Key="tiktok_tokens.json", Body=json.dumps(self.TOKENS, indent=2))
+
+        assert TokenStore.load_token("user_a")["access_token"] == "act.a"
+        assert sorted(TokenStore.list_accounts()) == sorted(self.TOKENS)
+
+    def test_default_writes_stay_readable_by_older_versions(self, fake_s3):
+        fake_s3.put_object(Bucket="b", Key="tiktok_tokens.json", Body=json.dumps(self.TOKENS, indent=2))
+
+        TokenStore.save_token({"access_token": "act.c"}, "user_c")
+
+        # Older releases read the blob with a plain json.loads
+        body = json.loads(fake_s3.objects["tiktok_tokens.json"][0])
+        assert sorted(body) == sorted(list(self.TOKENS) + ["user_c"])
+
+    def test_writes_upgrade_legacy_blob_to_v2(self, fake_s3, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_STORE_FORMAT", "v2")
+        fake_s3.put_object(Bucket="b", Key="tiktok_tokens.json", Body=json.dumps(self.TOKENS, indent=2))
+
+        TokenStore.save_token({"access_token": "act.c"}, "user_c")
+
+        body = fake_s3.objects["tiktok_tokens.json"][0]
+        assert token_store.TokenBlob(body).version == 2
+        TokenStore.clear_cache()
+        assert sorted(TokenStore.list_accounts()) == sorted(list(self.TOKENS) + ["user_c"])
+
+class TestWriteCoalescing:
+
+    def _refresh_response(self, *args, **kwargs):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"access_token": "act.new", "refresh_token": "rft.new", "expires_in": 3600}
+        return response
+
+    def test_saves_inside_block_become_one_write(self, fake_s3):
+        with TokenStore.coalesce_writes():
+            for i in range(5):
+                TokenStore.save_token({"access_token": f"act.{i}"}, f"user_{i}")
+            assert fake_s3.count("put_object") == 0
+            assert TokenStore.load_token("user_3")["access_token"] == "act.3"
+            assert sorted(TokenStore.list_accounts()) == [f"user_{i}" for i in range(5)]
+
+        assert fake_s3.count("put_object", "tiktok_tokens.json") == 1
+        TokenStore.clear_cache()
+        assert TokenStore.load_token("user_4")["access_token"] == "act.4"
+
+    def test_failed_flush_keeps_pending_tokens(self, fake_s3):
+        with patch.object(TokenStore, "_write_tokens", side_effect=RuntimeError("store unavailable")):
+            with pytest.raises(RuntimeError):
+                with TokenStore.coalesce_writes():
+                    TokenStore.save_token({"access_token": "act.a"}, "user_a")
+
+        assert TokenStore.load_token("user_a")["access_token"] == "act.a"
+        assert TokenStore.flush() == 1
+        assert "tiktok_tokens.json" in fake_s3.objects
+
+    def test_window_mode_flushes_on_handler_return(self, fake_s3, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_WRITE_COALESCE_SECONDS", 60)
+
+        @token_store.flush_on_return
+        def handler():
+            TokenStore.save_token({"access_token": "act.a"}, "user_a")
+            TokenStore.save_token({"access_token": "act.b"}, "user_b")
+            assert fake_s3.count("put_object") == 0
+
+        handler()
+        assert fake_s3.count("put_object", "tiktok_tokens.json") == 1
+
+    def test_failed_flush_returns_error_response(self, fake_s3, monkeypatch):
+        monkeypatch.setattr(token_store, "TOKEN_WRITE_COALESCE_SECONDS", 60)
+
+        @token_store.flush_on_return(on_error=lambda e: {"statusCode": 500})
+        def handler():
+            TokenStore.save_token({"access_token": "act.a"}, "user_a")
+            return {"statusCode": 200}
+
+        @token_store.flush_on_return
+        def failing_handler():
+            TokenStore.save_token({"access_token": "act.b"}, "user_b")
+            raise ValueError("handler failed")
+
+        with patch.object(TokenStore, "_write_tokens", side_effect=RuntimeError("store unavailable")):
+            assert handler() == {"statusCode": 500}
+            with pytest.raises(ValueError):
+                failing_handler()
+
+    @patch('requests.post')
+    def test_batch_refresh_writes_blob_once(self, mock_post, fake_s3):
+        mock_post.side_effect = self._refresh_response
+        expired = {"access_token": "act.old", "refresh_token": "rft.old", "expires_at": time.time() - 1}
+        TokenStore.save_tokens({f"user_{i}": dict(expired) for i in range(3)})
+        fake_s3.calls.clear()
+
+        results = TokenStore.get_access_tokens([f"user_{i}" for i in range(3)])
+
+        assert all(r["access_token"] == "act.new" for r in results.values())
+        puts = [key for op, key in fake_s3.calls if op == "put_object"]
+        assert puts.count("tiktok_tokens.json") == 1
+        assert not any(key.startswith("leases/") for key in fake_s3.objects)
+
+
+class TestExpiryManifest:
+
+    def _tokens(self, now):
+        return {
+            "soon": {"access_token": "act.s", "refresh_token": "rft.s", "expires_at": now + 60, "refresh_expires_at": now + 86400},
+            "expired": {"access_token": "act.e", "refresh_token": "rft.e", "expires_at": now - 60},
+            "later": {"access_token": "act.l", "refresh_token": "rft.l", "expires_at": now + 7200},
+        }
+
+    def test_list_expiring_reads_only_the_manifest(self, fake_s3):
+        now = time.time()
+        TokenStore.save_tokens(self._tokens(now))
+        TokenStore.clear_cache()
+        fake_s3.calls.clear()
+
+        expiring = TokenStore.list_expiring(600, now=now)
+
+        assert [entry["open_id"] for entry in expiring] == ["expired", "soon"]
+        assert expiring[1]["refresh_expires_at"] == now + 86400
+        assert expiring[1]["last_refreshed"] >= now
+        assert "access_token" not in expiring[0]
+        assert fake_s3.calls == [("get_object", "manifest/expiry.json")]
+        assert sorted(TokenStore.list_accounts()) == ["expired", "later", "soon"]
+
+    def test_delete_removes_manifest_entry(self, sqlite_backend, sharded):
+        now = time.time()
+        TokenStore.save_tokens(self._tokens(now))
+
+        assert TokenStore.delete_account("soon")
+
+        assert [entry["open_id"] for entry in TokenStore.list_expiring(600, now=now)] == ["expired"]
+        assert sorted(TokenStore.list_accounts()) == ["expired", "later"]
+
+    def test_rebuilds_manifest_for_existing_store(self, fake_s3):
+        now = time.time()
+        fake_s3.put_object(Bucket="b", Key="tiktok_tokens.json", Body=json.dumps(self._tokens(now)))
+
+        assert [entry["open_id"] for entry in TokenStore.list_expiring(600, now=now)] == ["expired", "soon"]
+        assert "manifest/expiry.json" in fake_s3.objects
+
+        TokenStore.save_token({"access_token": "act.n", "expires_at": now + 30}, "new")
+        assert [entry["open_id"] for entry in TokenStore.list_expiring(600, now=now)] == ["expired", "new", "soon"]
+
+    def test_corrupt_manifest_falls_back_to_the_store(self, fake_s3):
+        now = time.time()
+        TokenStore.save_tokens(self._tokens(now))
+        fake_s3.put_object(Bucket="b", Key="manifest/expiry.json", Body="{not json")
+        TokenStore.clear_cache()
+
+        assert sorted(TokenStore.list_accounts()) == ["expired", "later", "soon"]
+        assert [entry["open_id"] for entry in TokenStore.list_expiring(600, now=now)] == ["expired", "soon"]
+
+
 if __name__ == "__main__":
     print("TikTok Token Store Test Script")
     print("=" * 40)
@@ -0,0 +1,206 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import threading
+import hashlib
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Optional, List, Dict, NamedTuple
+
+
+class BackendError(Exception):
+    """バックエンドのストレージ操作に失敗した"""
+
+
+class NotModified(BackendError):
+    """If-None-Match の ETag が現在のオブジェクトと一致した"""
+
+
+class PreconditionFailed(BackendError):
+    """If-Match / If-None-Match の条件を満たさなかった"""
+
+
+class _NoSuchKey(BackendError):
+    pass
+
+
+class StoredObject(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class TokenBackend(ABC):
+    """TokenStore が使うキー/バイト列ストアのインターフェース
+
+    すべてのドライバーは ETag による条件付き読み書きをサポートする。
+    """
+
+    @abstractmethod
+    def get(self, key: str, if_none_match: Optional[str] = None) -> Optional[StoredObject]:
+        """オブジェクトを取得する。存在しなければ None、ETag が一致すれば NotModified"""
+
+    @abstractmethod
+    def put(self, key: str, body: bytes, if_match: Optional[str] = None,
+            if_none_match: Optional[str] = None) -> str:
+        """オブジェクトを保存して新しい ETag を返す。条件を満たさなければ PreconditionFailed"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """オブジェクトを削除する（存在しなくてもエラーにしない）"""
+
+    def list_keys(self, prefix: str) -> List[str]:
+        """prefix で始まるキーを昇順で返す"""
+        return sorted(self.list_versions(prefix))
+
+    @abstractmethod
+    def list_versions(self, prefix: str) -> Dict[str, str]:
+        """prefix で始まるキーとその ETag を返す"""
+
+
+class S3Backend(TokenBackend):
+    """S3 ドライバー（デフォルト）"""
+
+    def __init__(self, bucket: str, region_name: str = "ap-northeast-1", client=None):
+        self.bucket = bucket
+        if client is None:
+            import boto3
+            client = boto3.client("s3", region_name=region_name)
+        self.client = client
+
+    @contextmanager
+    def _translate_errors(self):
+        """botocore の ClientError をバックエンド共通の例外に変換する"""
+        from botocore.exceptions import ClientError
+
+        try:
+            yield
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if status == 304 or code in ("304", "NotModified"):
+                raise NotModified(code) from e
+            if code in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise PreconditionFailed(code) from e
+            if code == "NoSuchKey":
+                raise _NoSuchKey(code) from e
+            raise BackendError(str(e)) from e
+
+    def get(self, key: str, if_none_match: Optional[str] = None) -> Optional[StoredObject]:
+        request = {"Bucket": self.bucket, "Key": key}
+        if if_none_match:
+            request["IfNoneMatch"] = if_none_match
+        try:
+            with self._translate_errors():
+                response = self.client.get_object(**request)
+        except _NoSuchKey:
+            return None
+        return StoredObject(response["Body"].read(), response.get("ETag"))
+
+    def put(self, key: str, body: bytes, if_match: Optional[str] = None,
+            if_none_match: Optional[str] = None) -> str:
+        request = {
+            "Bucket": self.bucket,
+            "Key": key,
+            "Body": body,
+            "ContentType": "application/json",
+        }
+        if if_match:
+            request["IfMatch"] = if_match
+        if if_none_match:
+            request["IfNoneMatch"] = if_none_match
+        with self._translate_errors():
+            response = self.client.put_object(**request)
+        return response.get("ETag")
+
+    def delete(self, key: str):
+        with self._translate_errors():
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list_versions(self, prefix: str) -> Dict[str, str]:
+        versions = {}
+        with self._translate_errors():
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    versions[obj["Key"]] = obj.get("ETag")
+        return versions
+
+
+class SQLiteBackend(TokenBackend):
+    """ローカル SQLite ドライバー
+
+    キーを主キーとするテーブルに保存するので、open_id ごとの参照はインデックスで O(log N)。
+    ネットワーク不要なのでセルフホスト環境やテスト・ベンチマークに使う。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    @staticmethod
+    def _etag(body: bytes) -> str:
+        return '"%s"' % hashlib.md5(body).hexdigest()
+
+    def get(self, key: str, if_none_match: Optional[str] = None) -> Optional[StoredObject]:
+        with self._lock:
+            row = self._conn.execute("SELECT body, etag FROM objects WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if if_none_match and if_none_match == row[1]:
+            raise NotModified(key)
+        return StoredObject(bytes(row[0]), row[1])
+
+    def put(self, key: str, body: bytes, if_match: Optional[str] = None,
+            if_none_match: Optional[str] = None) -> str:
+        etag = self._etag(body)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT etag FROM objects WHERE key = ?", (key,)).fetchone()
+                if if_match and (row is None or row[0] != if_match):
+                    raise PreconditionFailed(key)
+                if if_none_match == "*" and row is not None:
+                    raise PreconditionFailed(key)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO objects (key, body, etag) VALUES (?, ?, ?)",
+                    (key, body, etag),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return etag
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+
+    def list_versions(self, prefix: str) -> Dict[str, str]:
+        if not prefix:
+            query, params = "SELECT key, etag FROM objects ORDER BY key", ()
+        else:
+            # prefix の範囲を主キーのインデックスで走査する
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            query, params = "SELECT key, etag FROM objects WHERE key >= ? AND key < ? ORDER BY key", (prefix, upper)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return dict(rows)
+
+
+def create_backend(name: str, **options) -> TokenBackend:
+    """設定名からバックエンドを生成する（"s3" | "sqlite"）"""
+    if name == "s3":
+        return S3Backend(options["bucket"], region_name=options.get("region_name", "ap-northeast-1"))
+    if name == "sqlite":
+        return SQLiteBackend(options["path"])
+    raise ValueError(f"Unknown token store backend: {name}")
@@ -6,12 +6,20 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
 import threading
 import time
 import json
-from typing import Optional, List
-import os
-import requests
+import gzip
+import bisect
+import hashlib
+import random
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from typing import Optional, List, Dict, Callable, Any
+from urllib.parse import quote, unquote
 import logging
-import boto3
-from botocore.exceptions import ClientError
+from token_backends import BackendError, NotModified, PreconditionFailed, create_backend
+from resilience import Resilience, CircuitOpenError, DEFAULT_TIMEOUT
 
 CLIENT_KEY = os.getenv("CLIENT_KEY")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
@@ -21,33 +29,512 @@ TOKEN_FILE = "tiktok_tokens.json"
 BUCKET_NAME = "tiktok-token-store"
 OBJECT_KEY = "tiktok_tokens.json"
 
-s3 = boto3.client("s3", region_name="ap-northeast-1")
-_lock = threading.Lock()
+# 保存先のドライバー（"s3" | "sqlite"）
+TOKEN_STORE_BACKEND = os.getenv("TOKEN_STORE_BACKEND", "s3")
+TOKEN_STORE_SQLITE_PATH = os.getenv("TOKEN_STORE_SQLITE_PATH", "/tmp/tiktok_tokens.sqlite3")
+
+# "blob": 全アカウントを OBJECT_KEY の1オブジェクトに保存（従来形式）
+# "sharded": open_id ごとに SHARD_PREFIX 配下の個別オブジェクトに保存（sqlite では主キーで索引される）
+TOKEN_LAYOUT = os.getenv("TOKEN_LAYOUT", "sharded" if TOKEN_STORE_BACKEND == "sqlite" else "blob")
+SHARD_PREFIX = os.getenv("TOKEN_SHARD_PREFIX", "tokens/")
+
+# ウォームコンテナ内のキャッシュ設定（TTL 経過後は ETag で S3 に再検証する）
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "256"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "30"))
+
+# OBJECT_KEY の保存形式
+# "v2": ヘッダー行 + 1アカウント1行のコンパクト形式（1アカウントだけをデコードできる）
+# "v1": 従来の indent=2 の JSON
+# 読み込みはどちらの形式にも対応するが、v2 を読めない旧バージョンは v2 の blob を空とみなして
+# 上書きしてしまうため、デフォルトは v1。全コンテナ・ポスターの更新後に v2 に切り替える
+TOKEN_STORE_FORMAT = os.getenv("TOKEN_STORE_FORMAT", "v1")
+TOKEN_STORE_COMPRESSION = os.getenv("TOKEN_STORE_COMPRESSION", "none")  # "none" | "gzip"
+
+# 条件付き PUT（If-Match）が競合したときの再試行設定
+TOKEN_CAS_MAX_RETRIES = int(os.getenv("TOKEN_CAS_MAX_RETRIES", "10"))
+TOKEN_CAS_BACKOFF_BASE = float(os.getenv("TOKEN_CAS_BACKOFF_BASE", "0.02"))
+TOKEN_CAS_BACKOFF_MAX = float(os.getenv("TOKEN_CAS_BACKOFF_MAX", "1.0"))
+
+# open_id と有効期限だけを expires_at 順に並べた小さなインデックス（保存のたびに更新）
+MANIFEST_KEY = os.getenv("TOKEN_MANIFEST_KEY", "manifest/expiry.json")
+MANIFEST_VERSION = 1
+
+# 0 より大きい場合は write-behind モード: 保存をこの秒数までバッファし、まとめて1回で書き込む
+# （ハンドラーは flush_on_return で終了前に必ず flush する）
+TOKEN_WRITE_COALESCE_SECONDS = float(os.getenv("TOKEN_WRITE_COALESCE_SECONDS", "0"))
+
+# 同一 open_id のリフレッシュをコンテナ間で1回にまとめるためのリース設定
+LEASE_PREFIX = os.getenv("TOKEN_LEASE_PREFIX", "leases/")
+TOKEN_REFRESH_LEASE_TTL = float(os.getenv("TOKEN_REFRESH_LEASE_TTL", "15"))
+TOKEN_REFRESH_POLL_INTERVAL = float(os.getenv("TOKEN_REFRESH_POLL_INTERVAL", "0.25"))
+
+# TOKEN_URL 呼び出しのリトライとサーキットブレーカー（リトライはリースの有効期間内に収める）
+_oauth = Resilience("tiktok_oauth", budget=TOKEN_REFRESH_LEASE_TTL)
+
+# バックエンド（boto3 クライアント等）は初回利用時に生成する（コールドスタート短縮のため import 時には作らない）
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(
+                    TOKEN_STORE_BACKEND,
+                    bucket=BUCKET_NAME,
+                    region_name="ap-northeast-1",
+                    path=TOKEN_STORE_SQLITE_PATH,
+                )
+    return _backend
+
+
+class ConcurrentUpdateError(Exception):
+    """条件付き書き込みが再試行上限まで競合し続けた"""
+
+
+_FORMAT_NAME = "tiktok-token-store"
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+class TokenBlob:
+    """OBJECT_KEY の内容。v2 形式では必要なアカウントの行だけをデコードする
+
+    v2 形式:
+        {"format":"tiktok-token-store","version":2,"count":N,"min_expires_at":...}
+        "open_id"\t{...token...}
+        ...
+    """
+
+    def __init__(self, raw: bytes):
+        if raw[:2] == _GZIP_MAGIC:
+            raw = gzip.decompress(raw)
+        self._raw = raw
+        self._tokens = None
+        self.header = None
+
+        first_line = raw.split(b"\n", 1)[0]
+        if first_line.startswith(b'{"format":"' + _FORMAT_NAME.encode() + b'"'):
+            self.header = json.loads(first_line)
+        else:
+            self._tokens = json.loads(raw.decode("utf-8")) if raw.strip() else {}
+
+    @property
+    def version(self) -> int:
+        return self.header["version"] if self.header else 1
+
+    def get(self, open_id: str) -> Optional[dict]:
+        if self._tokens is not None:
+            return self._tokens.get(open_id)
+
+        marker = b"\n" + json.dumps(open_id).encode("utf-8") + b"\t"
+        start = self._raw.find(marker)
+        if start < 0:
+            return None
+        start += len(marker)
+        end = self._raw.find(b"\n", start)
+        return json.loads(self._raw[start:end if end >= 0 else None])
+
+    def keys(self) -> List[str]:
+        if self._tokens is not None:
+            return list(self._tokens.keys())
+        return [json.loads(line.split(b"\t", 1)[0]) for line in self._raw.split(b"\n")[1:] if line]
+
+    def to_dict(self) -> dict:
+        if self._tokens is not None:
+            return self._tokens
+        # JSON エンコード済みの値には生のタブ・改行が含まれないので、1つの JSON オブジェクトに組み替えて一度にデコードする
+        body = self._raw.split(b"\n", 1)[1] if b"\n" in self._raw else b""
+        return json.loads(b"{" + body.replace(b"\t", b":").replace(b"\n", b",") + b"}")
+
+    @staticmethod
+    def encode(tokens: dict, version: Optional[str] = None, compression: Optional[str] = None) -> bytes:
+        version = version or TOKEN_STORE_FORMAT
+        compression = compression or TOKEN_STORE_COMPRESSION
+
+        if version == "v1":
+            raw = json.dumps(tokens, indent=2).encode("utf-8")
+        else:
+            min_expires_at = _earliest_expiry(tokens)
+            header = {
+                "format": _FORMAT_NAME,
+                "version": 2,
+                "count": len(tokens),
+                "min_expires_at": None if min_expires_at == float("inf") else min_expires_at,
+            }
+            lines = [json.dumps(header, separators=(",", ":"))]
+            for open_id in sorted(tokens):
+                lines.append(
+                    json.dumps(open_id) + "\t" + json.dumps(tokens[open_id], separators=(",", ":"))
+                )
+            raw = "\n".join(lines).encode("utf-8")
+
+        if compression == "gzip":
+            raw = gzip.compress(raw, mtime=0)
+        return raw
+
+
+class _CacheEntry:
+    __slots__ = ("raw", "etag", "validated_at", "fresh_until")
+
+    def __init__(self, raw: bytes, etag: str, now: float):
+        self.raw = raw
+        self.etag = etag
+        self.validate(now)
+
+    def validate(self, now: float):
+        self.validated_at = now
+        self.fresh_until = now + TOKEN_CACHE_TTL
+
+
+def _earliest_expiry(data: dict) -> float:
+    """トークン（またはトークンの dict）の中で最も早い expires_at を返す"""
+    if "access_token" in data or "expires_at" in data:
+        return data.get("expires_at", float("inf"))
+    expiries = [t.get("expires_at", float("inf")) for t in data.values() if isinstance(t, dict)]
+    return min(expiries, default=float("inf"))
+
+
+class _ReadSnapshot:
+    """versioned_read() の間に読んだオブジェクトの ETag を記録する"""
+
+    def __init__(self):
+        self.etags = {}
+
+    @property
+    def version(self) -> str:
+        """読んだオブジェクトとバッファ中の書き込みから作るバージョン文字列"""
+        digest = hashlib.sha1()
+        for key in sorted(self.etags):
+            digest.update(f"{key}\0{self.etags[key]}\n".encode("utf-8"))
+        pending = _writes.pending()
+        if pending:
+            digest.update(json.dumps(pending, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+
+_snapshots = threading.local()
+
+
+class _TokenCache:
+    """S3 オブジェクトキー単位のエンコード済みオブジェクトのキャッシュ（LRU）
+
+    読み出しのたびにバイト列からデコードするので、呼び出し元がデータを書き換えても影響しない。
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, raw: bytes, etag: Optional[str]):
+        if not etag or self.max_size <= 0:
+            self.discard(key)
+            return
+        with self._lock:
+            self._entries[key] = _CacheEntry(raw, etag, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def record(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.revalidations = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+            }
+
+
+_cache = _TokenCache(TOKEN_CACHE_SIZE)
+
+
+class _Flight:
+    """コンテナ内で進行中のリフレッシュ1件。後続の呼び出しは done を待って result を共有する"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class _WriteBuffer:
+    """まだストアに書き込んでいないトークンと、その書き込み後に解放するリース"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tokens = {}
+        self.flushing = {}
+        self.leases = []
+        self.since = None
+        self.depth = 0
+
+    def active(self) -> bool:
+        return self.depth > 0 or TOKEN_WRITE_COALESCE_SECONDS > 0
+
+    def lookup(self, open_id: str):
+        """バッファ中のトークンを (見つかったか, トークン) で返す"""
+        with self.lock:
+            for pending in (self.tokens, self.flushing):
+                if open_id in pending:
+                    return True, json.loads(json.dumps(pending[open_id]))
+        return False, None
+
+    def pending(self) -> dict:
+        with self.lock:
+            merged = dict(self.flushing)
+            merged.update(self.tokens)
+            return json.loads(json.dumps(merged))
+
+
+_writes = _WriteBuffer()
+
+
+def flush_on_return(handler=None, on_error: Optional[Callable[[Exception], Any]] = None):
+    """Lambda ハンドラー用デコレーター: 返却前にバッファ中の書き込みを必ず flush する
+
+    flush に失敗した場合はログを残し、on_error があればその戻り値を返す（なければ例外を送出）。
+    ハンドラー自体が例外を送出した場合は、flush の失敗でその例外を置き換えない。
+    """
+    if handler is None:
+        return lambda handler: flush_on_return(handler, on_error)
+
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            result = handler(*args, **kwargs)
+        except BaseException:
+            try:
+                TokenStore.flush()
+            except Exception as e:
+                logging.error(f"[TokenStore] failed to flush buffered token writes: {e}")
+            raise
+        try:
+            TokenStore.flush()
+        except Exception as e:
+            logging.error(f"[TokenStore] failed to flush buffered token writes: {e}")
+            if on_error is None:
+                raise
+            return on_error(e)
+        return result
+    return wrapper
 
 
 class TokenStore:
 
     @classmethod
-    def _load_raw_tokens(cls) -> Optional[dict]:
+    def _is_sharded(cls) -> bool:
+        return TOKEN_LAYOUT == "sharded"
+
+    @classmethod
+    def _shard_key(cls, open_id: str) -> str:
+        return f"{SHARD_PREFIX}{quote(open_id, safe='')}.json"
+
+    @classmethod
+    def _read_object(cls, key: str) -> Optional[dict]:
+        """キャッシュ経由でオブジェクトを読み込む"""
+        return cls._read_versioned(key)[0]
+
+    @classmethod
+    def _read_versioned(cls, key: str, revalidate: bool = False):
+        """キャッシュ経由でオブジェクトをデコードして ETag と共に返す"""
+        data, etag = cls._read_decoded(key, revalidate=revalidate)
+        if isinstance(data, TokenBlob):
+            data = data.to_dict()
+        return data, etag
+
+    @classmethod
+    def _read_blob(cls, revalidate: bool = False) -> Optional[TokenBlob]:
+        """OBJECT_KEY を全体をデコードせずに読み込む"""
         try:
-            response = s3.get_object(Bucket=BUCKET_NAME, Key=OBJECT_KEY)
-            content = response["Body"].read().decode("utf-8")
-            return json.loads(content)
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
-                return {}
+            return cls._read_decoded(OBJECT_KEY, revalidate=revalidate)[0]
+        except BackendError:
             raise
         except Exception:
-            return {}
+            return None
+
+    @classmethod
+    def _decode(cls, key: str, raw: bytes):
+        if key == OBJECT_KEY:
+            return TokenBlob(raw)
+        if raw[:2] == _GZIP_MAGIC:
+            raw = gzip.decompress(raw)
+        return json.loads(raw.decode("utf-8"))
+
+    @classmethod
+    def _encode(cls, key: str, data: dict) -> bytes:
+        if key == OBJECT_KEY:
+            return TokenBlob.encode(data)
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def _read_decoded(cls, key: str, revalidate: bool = False):
+        """キャッシュ経由でオブジェクトと ETag を読み込む（versioned_read() 中は必ず再検証して ETag を記録する）"""
+        snapshot = getattr(_snapshots, "current", None)
+        if snapshot is None:
+            return cls._read_cached(key, revalidate=revalidate)
+        data, etag = cls._read_cached(key, revalidate=True)
+        snapshot.etags[key] = etag
+        return data, etag
+
+    @classmethod
+    def _read_cached(cls, key: str, revalidate: bool = False):
+        """キャッシュ経由でオブジェクトと ETag を読み込む
+
+        TTL 内なら S3 へアクセスしない（トークンの期限切れは呼び出し元が open_id ごとに判定する）。
+        それ以外は保持している ETag で If-None-Match を送り、304 ならキャッシュを再利用する。
+        """
+        now = time.time()
+        entry = _cache.get(key)
+        if entry is not None and not revalidate and now < entry.fresh_until:
+            _cache.record("hits")
+            return cls._decode(key, entry.raw), entry.etag
+
+        try:
+            stored = get_backend().get(key, if_none_match=entry.etag if entry is not None else None)
+        except NotModified:
+            if entry is None:
+                raise
+            _cache.record("revalidations")
+            entry.validate(now)
+            return cls._decode(key, entry.raw), entry.etag
+
+        if stored is None:
+            _cache.record("misses")
+            _cache.discard(key)
+            return None, None
+
+        _cache.record("misses")
+        _cache.put(key, stored.body, stored.etag)
+        return cls._decode(key, stored.body), stored.etag
+
+    @classmethod
+    def _write_object(cls, key: str, data: dict, if_match: Optional[str] = None,
+                      if_none_match: Optional[str] = None) -> Optional[str]:
+        raw = cls._encode(key, data)
+        try:
+            etag = get_backend().put(key, raw, if_match=if_match, if_none_match=if_none_match)
+        except BackendError:
+            _cache.discard(key)
+            raise
+        _cache.put(key, raw, etag)
+        return etag
+
+    @classmethod
+    def _update_object(cls, key: str, mutate) -> Optional[dict]:
+        """オブジェクトを compare-and-swap で更新する
+
+        mutate は現在の内容（存在しなければ None）を受け取り、新しい内容を返す。
+        None を返した場合は書き込まない。ETag が一致しない（他のコンテナが先に書き込んだ）
+        場合は最新を読み直して jitter 付きバックオフで再試行する。
+        """
+        for attempt in range(TOKEN_CAS_MAX_RETRIES):
+            current, etag = cls._read_versioned(key, revalidate=attempt > 0)
+            updated = mutate(current)
+            if updated is None:
+                return current
+
+            try:
+                if etag:
+                    cls._write_object(key, updated, if_match=etag)
+                else:
+                    cls._write_object(key, updated, if_none_match="*")
+                return updated
+            except PreconditionFailed:
+                pass
+
+            delay = min(TOKEN_CAS_BACKOFF_MAX, TOKEN_CAS_BACKOFF_BASE * (2 ** attempt))
+            time.sleep(random.uniform(0, delay))
+
+        raise ConcurrentUpdateError(f"[TokenStore] gave up updating {key} after {TOKEN_CAS_MAX_RETRIES} attempts")
+
+    @classmethod
+    def _delete_object(cls, key: str):
+        get_backend().delete(key)
+        _cache.discard(key)
+
+    @classmethod
+    def prime(cls):
+        """初期化フェーズ用: バックエンドを生成し、ストアを読み込んで接続とキャッシュを温める"""
+        import requests  # noqa: F401  リフレッシュ時の import コストを先に払う
+
+        get_backend()
+        if not cls._is_sharded():
+            cls._read_blob()
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        """ウォームコンテナ内キャッシュのヒット/ミス/再検証回数を取得"""
+        return _cache.stats()
+
+    @classmethod
+    def clear_cache(cls):
+        """キャッシュと統計をクリア"""
+        _cache.clear()
+
+    @classmethod
+    def _list_shard_ids(cls) -> List[str]:
+        """SHARD_PREFIX 配下のシャードから open_id の一覧を取得"""
+        open_ids = []
+        for key in get_backend().list_keys(SHARD_PREFIX):
+            name = key[len(SHARD_PREFIX):]
+            if name.endswith(".json"):
+                open_ids.append(unquote(name[:-len(".json")]))
+        return open_ids
+
+    @classmethod
+    def _load_raw_tokens(cls) -> Optional[dict]:
+        if cls._is_sharded():
+            tokens = {}
+            for open_id in cls._list_shard_ids():
+                token = cls._read_object(cls._shard_key(open_id))
+                if token is not None:
+                    tokens[open_id] = token
+        else:
+            try:
+                tokens = cls._read_object(OBJECT_KEY) or {}
+            except BackendError:
+                raise
+            except Exception:
+                tokens = {}
+
+        tokens.update(_writes.pending())
+        return tokens
 
     @classmethod
     def _save_raw_tokens(cls, tokens: dict):
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=OBJECT_KEY,
-            Body=json.dumps(tokens, indent=2),
-            ContentType="application/json",
-        )
+        cls._write_object(OBJECT_KEY, tokens)
 
     @classmethod
     def save_token(cls, token: dict, open_id: Optional[str] = None):
@@ -55,49 +542,338 @@ class TokenStore:
         if not token:
             return token
 
-        with _lock:
-            if "expires_in" in token and "expires_at" not in token:
-                token["expires_at"] = time.time() + token["expires_in"]
+        target_open_id = open_id or token.get("open_id")
+        cls.save_tokens({target_open_id: token})
+        return token
+
+    @classmethod
+    def save_tokens(cls, tokens: Dict[str, dict]) -> Dict[str, dict]:
+        """複数アカウントのトークンをまとめて保存する（blob 形式では1回の書き込み）"""
+        tokens = {open_id: token for open_id, token in tokens.items() if token}
+        if not tokens:
+            return tokens
 
-            target_open_id = open_id or token.get("open_id")
+        for token in tokens.values():
+            cls._stamp_expiry(token)
 
-            tokens = cls._load_raw_tokens() or {}
-            tokens[target_open_id] = token
-            cls._save_raw_tokens(tokens)
+        if _writes.active():
+            cls._buffer_tokens(tokens)
+        else:
+            cls._write_tokens(tokens)
 
-        return token
+        return tokens
+
+    @classmethod
+    def _write_tokens(cls, tokens: Dict[str, dict]):
+        if cls._is_sharded():
+            for open_id, token in tokens.items():
+                cls._write_object(cls._shard_key(open_id), token)
+        else:
+            def put_tokens(current):
+                current = current or {}
+                current.update(tokens)
+                return current
+
+            cls._update_object(OBJECT_KEY, put_tokens)
+
+        cls._update_manifest(upsert=tokens)
+
+    @classmethod
+    def _buffer_tokens(cls, tokens: Dict[str, dict]):
+        with _writes.lock:
+            _writes.tokens.update(tokens)
+            if _writes.since is None:
+                _writes.since = time.time()
+            due = (TOKEN_WRITE_COALESCE_SECONDS > 0
+                   and time.time() - _writes.since >= TOKEN_WRITE_COALESCE_SECONDS)
+        if due:
+            cls.flush()
+
+    @classmethod
+    @contextmanager
+    def coalesce_writes(cls):
+        """この with ブロック内の保存をバッファし、終了時に1回の書き込みでまとめて保存する"""
+        with _writes.lock:
+            _writes.depth += 1
+        try:
+            yield
+        finally:
+            with _writes.lock:
+                _writes.depth -= 1
+                outermost = _writes.depth == 0
+            if outermost:
+                cls.flush()
+
+    @classmethod
+    def flush(cls) -> int:
+        """バッファ中のトークンを書き込み、保留中のリースを解放する。書き込んだ件数を返す"""
+        with _writes.lock:
+            tokens, leases = _writes.tokens, _writes.leases
+            _writes.tokens, _writes.leases, _writes.since = {}, [], None
+            _writes.flushing.update(tokens)
+
+        try:
+            if tokens:
+                cls._write_tokens(tokens)
+        except Exception:
+            # 書き込めなかったトークン（更新済みのリフレッシュトークンを含む）を失わないよう戻す
+            with _writes.lock:
+                for open_id, token in tokens.items():
+                    _writes.tokens.setdefault(open_id, token)
+                _writes.leases = leases + _writes.leases
+                if _writes.since is None:
+                    _writes.since = time.time()
+            raise
+        finally:
+            with _writes.lock:
+                for open_id in tokens:
+                    _writes.flushing.pop(open_id, None)
+
+        for open_id, owner in leases:
+            cls._release_lease_now(open_id, owner)
+        return len(tokens)
+
+    @classmethod
+    def _stamp_expiry(cls, token: dict):
+        if "expires_in" in token and "expires_at" not in token:
+            token["expires_at"] = time.time() + token["expires_in"]
+        if "refresh_expires_in" in token and "refresh_expires_at" not in token:
+            token["refresh_expires_at"] = time.time() + token["refresh_expires_in"]
 
     @classmethod
     def load_token(cls, open_id: str) -> Optional[dict]:
-        """指定されたopen_idのトークンを読み込む"""
-        target_open_id = open_id
+        """指定されたopen_idのトークンを読み込む
 
-        with _lock:
-            tokens = cls._load_raw_tokens()
-            if not tokens:
-                return None
-            return tokens.get(target_open_id)
+        キャッシュ上のトークンが期限切れなら、他のコンテナが更新済みかもしれないので S3 と再検証する。
+        """
+        token = cls._load_token(open_id)
+        if token and token.get("expires_at", float("inf")) <= time.time():
+            token = cls._load_token(open_id, revalidate=True)
+        return token
+
+    @classmethod
+    def _load_token(cls, open_id: str, revalidate: bool = False) -> Optional[dict]:
+        """トークンを読み込む。revalidate=True ならキャッシュの TTL に関わらず ETag で S3 と照合する"""
+        found, token = _writes.lookup(open_id)
+        if found:
+            return token
+
+        if cls._is_sharded():
+            return cls._read_versioned(cls._shard_key(open_id), revalidate=revalidate)[0]
+
+        blob = cls._read_blob(revalidate=revalidate)
+        return blob.get(open_id) if blob else None
 
     @classmethod
     def get_access_token(cls, open_id: str) -> Optional[str]:
         """参照＋期限切れ判定＋自動更新"""
-        target_open_id = open_id
-        token = cls.load_token(target_open_id)
+        token = cls.get_token(open_id)
+        return token.get("access_token") if token else None
+
+    @classmethod
+    def get_token(cls, open_id: str, force: bool = False) -> Optional[dict]:
+        """有効なトークン全体（expires_at を含む）を取得し、期限切れなら自動更新する
+
+        force=True は保存済みのアクセストークンが TikTok に拒否された場合に使い、期限に関わらず更新する
+        （他のコンテナが既に別のトークンに更新していればそれを返す）。
+        """
+        token = cls._load_token(open_id, revalidate=True) if force else cls.load_token(open_id)
         if not token:
             return None
 
         now = time.time()
-        if token.get("expires_at", 0) <= now:
+        if force or token.get("expires_at", 0) <= now:
             refresh_token = token.get("refresh_token")
             if refresh_token:
-                new = cls._refresh(refresh_token, target_open_id)
-                return new.get("access_token") if new else None
+                stale_access_token = token.get("access_token") if force else None
+                return cls._refresh_single_flight(refresh_token, open_id, stale_access_token=stale_access_token)
             return None
-        return token.get("access_token")
+        return token
+
+    @classmethod
+    @contextmanager
+    def versioned_read(cls):
+        """ブロック内の読み込みを S3 と再検証し、読んだオブジェクトの ETag からバージョンを作る
+
+        返したスナップショットの version は、ブロック内で読んだ内容そのものに対応するので、
+        レスポンス本文と組み合わせる ETag に使える。
+        """
+        previous = getattr(_snapshots, "current", None)
+        snapshot = _snapshots.current = _ReadSnapshot()
+        try:
+            yield snapshot
+        finally:
+            _snapshots.current = previous
+
+    @classmethod
+    def load_tokens(cls, open_ids: List[str]) -> Dict[str, dict]:
+        """複数の open_id のトークンを読み込む（blob 形式ではストアを1回だけ読む）"""
+        pending = _writes.pending()
+        stored_ids = [open_id for open_id in open_ids if open_id not in pending]
+
+        if cls._is_sharded():
+            tokens = {open_id: cls._read_object(cls._shard_key(open_id)) for open_id in stored_ids}
+        else:
+            blob = cls._read_blob() if stored_ids else None
+            tokens = {open_id: blob.get(open_id) for open_id in stored_ids} if blob else {}
+
+        tokens.update({open_id: pending[open_id] for open_id in open_ids if open_id in pending})
+        return {open_id: token for open_id, token in tokens.items() if token}
+
+    @classmethod
+    def get_access_tokens(cls, open_ids: List[str], max_workers: int = 8) -> Dict[str, dict]:
+        """複数アカウントのアクセストークンを取得し、期限切れのものは並列に更新する
+
+        open_id ごとに {"access_token", "expires_at"} または {"error"} を返す。
+        """
+        tokens = cls.load_tokens(open_ids)
+        now = time.time()
+        results = {}
+        expired = {}
+        for open_id in open_ids:
+            token = tokens.get(open_id)
+            if not token:
+                results[open_id] = {"error": "not_found"}
+            elif token.get("expires_at", 0) > now:
+                results[open_id] = {"access_token": token.get("access_token"), "expires_at": token.get("expires_at")}
+            elif not token.get("refresh_token"):
+                results[open_id] = {"error": "expired"}
+            else:
+                expired[open_id] = token
+
+        def refresh_one(item):
+            open_id, token = item
+            try:
+                return open_id, cls._refresh_single_flight(token["refresh_token"], open_id)
+            except Exception as e:
+                logging.error(f"[TokenStore] refresh failed for {open_id}: {e}")
+                return open_id, None
+
+        if expired:
+            # 更新結果は1回の書き込みにまとめ、その後でリースを解放する
+            with cls.coalesce_writes(), \
+                    ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(expired)))) as pool:
+                for open_id, new in pool.map(refresh_one, expired.items()):
+                    if new:
+                        results[open_id] = {"access_token": new.get("access_token"), "expires_at": new.get("expires_at")}
+                    else:
+                        results[open_id] = {"error": "refresh_failed"}
+
+        return results
+
+    @classmethod
+    def _refresh_single_flight(cls, refresh_token: str, open_id: str, min_ttl: float = 0,
+                               stale_access_token: Optional[str] = None) -> Optional[dict]:
+        """同じ open_id への同時リフレッシュを1回にまとめ、全呼び出し元に同じ結果を返す"""
+        with _inflight_lock:
+            flight = _inflight.get(open_id)
+            leader = flight is None
+            if leader:
+                flight = _inflight[open_id] = _Flight()
+
+        if not leader:
+            flight.done.wait(TOKEN_REFRESH_LEASE_TTL * 2)
+            return flight.result
+
+        try:
+            flight.result = cls._refresh_with_lease(refresh_token, open_id, min_ttl, stale_access_token)
+        finally:
+            with _inflight_lock:
+                _inflight.pop(open_id, None)
+            flight.done.set()
+        return flight.result
+
+    @classmethod
+    def _refresh_with_lease(cls, refresh_token: str, open_id: str, min_ttl: float = 0,
+                            stale_access_token: Optional[str] = None) -> Optional[dict]:
+        """ストア上のリースを取得したコンテナだけがリフレッシュし、他は保存結果を待つ
+
+        保存済みのトークンが min_ttl 秒より長く有効で、拒否された stale_access_token でもなければ、
+        更新済みとみなしてそれを返す。
+        """
+        def refreshed(token):
+            return (token and token.get("expires_at", 0) > time.time() + min_ttl
+                    and (stale_access_token is None or token.get("access_token") != stale_access_token))
+
+        deadline = time.time() + TOKEN_REFRESH_LEASE_TTL * 2
+        while time.time() < deadline:
+            owner = cls._acquire_lease(open_id)
+            current = cls._load_token(open_id, revalidate=True)
+            if refreshed(current):
+                # 他のコンテナが既に更新済み
+                if owner:
+                    cls._release_lease(open_id, owner)
+                return current
+
+            if owner:
+                try:
+                    latest_refresh_token = (current or {}).get("refresh_token") or refresh_token
+                    return cls._refresh(latest_refresh_token, open_id)
+                finally:
+                    cls._release_lease(open_id, owner)
+
+            time.sleep(TOKEN_REFRESH_POLL_INTERVAL)
+
+        # リースなしで更新すると、他のコンテナがローテーション済みのリフレッシュトークンを使いかねない
+        logging.warning(f"[TokenStore] refresh lease for {open_id} not released in time; not refreshing")
+        current = cls._load_token(open_id, revalidate=True)
+        return current if refreshed(current) else None
+
+    @classmethod
+    def _lease_key(cls, open_id: str) -> str:
+        return f"{LEASE_PREFIX}{quote(open_id, safe='')}.json"
+
+    @classmethod
+    def _acquire_lease(cls, open_id: str) -> Optional[str]:
+        """リースを取得できれば所有者 ID を返す。期限切れのリースは引き継ぐ"""
+        key = cls._lease_key(open_id)
+        owner = uuid.uuid4().hex
+        lease = {"owner": owner, "expires_at": time.time() + TOKEN_REFRESH_LEASE_TTL}
+        try:
+            cls._write_object(key, lease, if_none_match="*")
+            return owner
+        except PreconditionFailed:
+            pass
+
+        current, etag = cls._read_versioned(key, revalidate=True)
+        if current is None or current.get("expires_at", 0) > time.time():
+            return None
+        try:
+            cls._write_object(key, lease, if_match=etag)
+            return owner
+        except PreconditionFailed:
+            return None
+
+    @classmethod
+    def _release_lease(cls, open_id: str, owner: str):
+        """リースを解放する。書き込みをバッファ中なら flush 後まで解放を遅らせる"""
+        with _writes.lock:
+            if _writes.active():
+                _writes.leases.append((open_id, owner))
+                return
+        cls._release_lease_now(open_id, owner)
+
+    @classmethod
+    def _release_lease_now(cls, open_id: str, owner: str):
+        key = cls._lease_key(open_id)
+        try:
+            current = cls._read_versioned(key, revalidate=True)[0]
+            if current and current.get("owner") == owner:
+                cls._delete_object(key)
+        except Exception as e:
+            logging.warning(f"[TokenStore] failed to release refresh lease for {open_id}: {e}")
 
     @classmethod
     def _refresh(cls, refresh_token: str, open_id: str) -> Optional[dict]:
         """トークンを更新"""
+        token = cls._request_refresh(refresh_token, open_id)
+        if token:
+            cls.save_token(token, open_id)
+        return token
+
+    @classmethod
+    def _request_refresh(cls, refresh_token: str, open_id: str) -> Optional[dict]:
+        """TOKEN_URL にリフレッシュを要求する（保存はしない）"""
         if not refresh_token:
             return None
 
@@ -107,34 +883,211 @@ class TokenStore:
             "grant_type": "refresh_token",
             "refresh_token": refresh_token,
         }
-        resp = requests.post(TOKEN_URL, data=data)
+        import requests
+
+        # リフレッシュトークンは使い回されない可能性があるため、届いていないことが確実な失敗だけやり直す
+        try:
+            resp = _oauth.call(lambda: requests.post(TOKEN_URL, data=data, timeout=DEFAULT_TIMEOUT),
+                               idempotent=False)
+        except CircuitOpenError as e:
+            logging.error(f"[TokenStore] refresh skipped for {open_id}: {e}")
+            return None
         if resp.status_code != 200:
             logging.error(f"[TokenStore] refresh failed for {open_id}: {resp.text}")
             return None
         token = resp.json()
-        cls.save_token(token, open_id)
+        cls._stamp_expiry(token)
         return token
 
+    @classmethod
+    def refresh_many(cls, tokens: Dict[str, dict], max_workers: int = 8,
+                     min_ttl: float = 0) -> Dict[str, Optional[dict]]:
+        """複数アカウントのトークンを並列に更新して保存し、open_id ごとの新トークン（失敗時 None）を返す
+
+        get_token と同じリースを通すので、オンデマンドの更新と同じリフレッシュトークンを二重に使わない。
+        min_ttl 秒より長く有効なトークンが既に保存されているアカウントは更新しない。
+        保存は1回の書き込みにまとめ、その後でリースを解放する。
+        """
+        def refresh_one(item):
+            open_id, token = item
+            try:
+                return open_id, cls._refresh_single_flight(token.get("refresh_token"), open_id, min_ttl)
+            except Exception as e:
+                logging.error(f"[TokenStore] refresh failed for {open_id}: {e}")
+                return open_id, None
+
+        if not tokens:
+            return {}
+        with cls.coalesce_writes(), \
+                ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tokens)))) as pool:
+            return dict(pool.map(refresh_one, tokens.items()))
+
+    @staticmethod
+    def _manifest_row(open_id: str, token: dict, last_refreshed: Optional[float]) -> list:
+        # [expires_at, open_id, refresh_expires_at, last_refreshed]（expires_at が無いものは先頭に並ぶ）
+        return [token.get("expires_at") or 0.0, open_id, token.get("refresh_expires_at"), last_refreshed]
+
+    @classmethod
+    def _build_manifest(cls, rows: Dict[str, list]) -> dict:
+        return {"version": MANIFEST_VERSION, "entries": sorted(rows.values(), key=lambda row: (row[0], row[1]))}
+
+    @classmethod
+    def _rebuild_manifest_rows(cls) -> Dict[str, list]:
+        """ストア全体を読み込んでインデックスの行を作る（インデックスが無い既存ストア用）"""
+        if cls._is_sharded():
+            tokens = {}
+            for open_id in cls._list_shard_ids():
+                token = cls._read_object(cls._shard_key(open_id))
+                if token is not None:
+                    tokens[open_id] = token
+        else:
+            blob = cls._read_blob()
+            tokens = blob.to_dict() if blob else {}
+        return {open_id: cls._manifest_row(open_id, token, None) for open_id, token in tokens.items()}
+
+    @classmethod
+    def _update_manifest(cls, upsert: Optional[Dict[str, dict]] = None, remove: List[str] = ()):
+        """保存・削除をインデックスに反映する。失敗してもトークンの保存自体は失敗させない"""
+        now = time.time()
+
+        def apply(current):
+            if current is None:
+                # 書き込み済みのトークンも含めてストアから作り直す
+                rows = cls._rebuild_manifest_rows()
+            else:
+                rows = {row[1]: row for row in current.get("entries", [])}
+            for open_id in remove:
+                rows.pop(open_id, None)
+            for open_id, token in (upsert or {}).items():
+                rows[open_id] = cls._manifest_row(open_id, token, now)
+            return cls._build_manifest(rows)
+
+        try:
+            cls._update_object(MANIFEST_KEY, apply)
+        except Exception as e:
+            logging.warning(f"[TokenStore] failed to update expiry manifest: {e}")
+            # 古いインデックスを残さないよう削除し、次回の参照時に再構築させる
+            try:
+                cls._delete_object(MANIFEST_KEY)
+            except Exception:
+                pass
+
+    @classmethod
+    def _manifest_entries(cls) -> List[list]:
+        """有効期限インデックスの行を expires_at 順に返す（無ければストアから再構築して保存する）"""
+        try:
+            manifest = cls._read_object(MANIFEST_KEY)
+            if manifest is None:
+                rebuilt = cls._build_manifest(cls._rebuild_manifest_rows())
+                manifest = cls._update_object(MANIFEST_KEY, lambda current: None if current else rebuilt)
+        except BackendError:
+            raise
+        except Exception as e:
+            # 壊れたインデックスや競合で空の一覧を返さないよう、ストアから作り直した行を使う
+            logging.error(f"[TokenStore] failed to read expiry manifest, rebuilding from the store: {e}")
+            manifest = cls._build_manifest(cls._rebuild_manifest_rows())
+        rows = manifest.get("entries", []) if manifest else []
+
+        pending = _writes.pending()
+        if pending:
+            merged = {row[1]: row for row in rows}
+            for open_id, token in pending.items():
+                merged[open_id] = cls._manifest_row(open_id, token, None)
+            rows = cls._build_manifest(merged)["entries"]
+        return rows
+
+    @classmethod
+    def list_expiring(cls, within_seconds: float, now: Optional[float] = None) -> List[dict]:
+        """アクセストークンが within_seconds 秒以内に期限切れになる（期限切れ済みを含む）アカウントを返す
+
+        トークン本体は読まず、有効期限インデックスの二分探索だけで求める。
+        """
+        now = time.time() if now is None else now
+        rows = cls._manifest_entries()
+        end = bisect.bisect_right(rows, now + within_seconds, key=lambda row: row[0])
+        return [
+            {"open_id": open_id, "expires_at": expires_at,
+             "refresh_expires_at": refresh_expires_at, "last_refreshed": last_refreshed}
+            for expires_at, open_id, refresh_expires_at, last_refreshed in rows[:end]
+        ]
+
     @classmethod
     def list_accounts(cls) -> List[str]:
-        """保存されているアカウントのopen_idリストを取得"""
-        with _lock:
-            tokens = cls._load_raw_tokens()
-            return list(tokens.keys()) if tokens else []
+        """保存されているアカウントのopen_idリストを取得（有効期限インデックスから読む）"""
+        return [row[1] for row in cls._manifest_entries()]
+
+    @classmethod
+    def list_tokens(cls, after: Optional[str] = None, limit: Optional[int] = 100):
+        """open_id 順で after より後のトークンを最大 limit 件（None なら全件）返す
+
+        (トークン辞書, 続きがある場合は次の after に渡す open_id / なければ None, 総件数) を返す。
+        """
+        open_ids = sorted(cls.list_accounts())
+        start = bisect.bisect_right(open_ids, after) if after is not None else 0
+        end = len(open_ids) if limit is None else start + limit
+        page_ids = open_ids[start:end]
+        tokens = cls.load_tokens(page_ids)
+
+        next_after = page_ids[-1] if page_ids and end < len(open_ids) else None
+        return {open_id: tokens[open_id] for open_id in page_ids if open_id in tokens}, next_after, len(open_ids)
 
     @classmethod
     def delete_account(cls, open_id: str) -> bool:
         """指定されたアカウントのトークンを削除"""
-        with _lock:
-            tokens = cls._load_raw_tokens()
-            if not tokens or open_id not in tokens:
+        if _writes.lookup(open_id)[0]:
+            cls.flush()
+
+        if cls._is_sharded():
+            key = cls._shard_key(open_id)
+            if cls._read_object(key) is None:
                 return False
+            cls._delete_object(key)
+            cls._update_manifest(remove=[open_id])
+            return True
+
+        tokens = cls._load_raw_tokens()
+        if not tokens or open_id not in tokens:
+            return False
 
+        deleted = []
+
+        def remove_token(tokens):
+            deleted.clear()
+            if not tokens or open_id not in tokens:
+                return None
             del tokens[open_id]
-            cls._save_raw_tokens(tokens)
-            return True
+            deleted.append(open_id)
+            return tokens
+
+        cls._update_object(OBJECT_KEY, remove_token)
+        if deleted:
+            cls._update_manifest(remove=deleted)
+        return bool(deleted)
 
     @classmethod
     def has_account(cls, open_id: str) -> bool:
         """指定されたアカウントのトークンが存在するかチェック"""
         return cls.load_token(open_id) is not None
+
+    @classmethod
+    def migrate_to_sharded(cls, delete_legacy: bool = False) -> int:
+        """従来の OBJECT_KEY 形式からシャード形式へ移行し、移行したアカウント数を返す
+
+        既にシャードが存在するアカウントはシャード側を新しいものとして上書きしない。
+        TOKEN_LAYOUT を "sharded" に切り替える前に一度実行する。
+        """
+        legacy = cls._read_object(OBJECT_KEY) or {}
+
+        migrated = 0
+        for open_id, token in legacy.items():
+            try:
+                cls._write_object(cls._shard_key(open_id), token, if_none_match="*")
+                migrated += 1
+            except PreconditionFailed:
+                pass
+
+        if delete_legacy and legacy:
+            cls._delete_object(OBJECT_KEY)
+
+        logging.info(f"[TokenStore] migrated {migrated} accounts to {SHARD_PREFIX}")
+        return migrated
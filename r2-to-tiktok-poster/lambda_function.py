@@ -3,24 +3,191 @@ import os
 # 相対パスで dependencies ディレクトリを追加
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
 
+import asyncio
+import base64
 import json
+import math
+import hashlib
 import logging
 import requests
+import threading
 import time
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Optional, Dict, Any, List, Tuple
+from publish_records import (get_record_store, new_record, apply_status, is_due,
+                             idempotency_key, claim_idempotency, is_shared_store, IDEMPOTENCY_WINDOW_SECONDS)
+from r2_upload import r2_object_key, describe_video, upload_video, pull_url, get_r2_client
+from rate_limiter import RateLimiter, RateLimitExceeded, parse_retry_after
+from tiktok_client import get_tiktok_client
+
+# resilience.py は lambda_token_api と共有（build.sh が dependencies に同梱、ソースでは隣のディレクトリから読む）
+try:
+    from resilience import Resilience, CircuitOpenError, DEFAULT_TIMEOUT
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_token_api'))
+    from resilience import Resilience, CircuitOpenError, DEFAULT_TIMEOUT
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def get_access_token(open_id: str) -> Optional[str]:
-    """Get access token from existing token API"""
-    token_api_url = f"https://6kg6mdmiz6.execute-api.ap-northeast-1.amazonaws.com/prod/token/{open_id}"
+# "embedded" reads tokens with the token API's TokenStore in-process instead of over HTTP
+TOKEN_STORE_MODE = os.getenv("TOKEN_STORE_MODE", "http").lower()
+TOKEN_API_BASE_URL = os.getenv("TOKEN_API_BASE_URL", "https://6kg6mdmiz6.execute-api.ap-northeast-1.amazonaws.com/prod")
+
+# Access tokens are reused until this many seconds before they expire
+ACCESS_TOKEN_CACHE_SKEW_SECONDS = int(os.getenv("ACCESS_TOKEN_CACHE_SKEW_SECONDS", "300"))
+
+# Requests are queued behind the per-account / per-app rate limits for at most this long
+TIKTOK_RATE_LIMIT_WAIT_SECONDS = float(os.getenv("TIKTOK_RATE_LIMIT_WAIT_SECONDS", "30"))
+# Delay applied after a 429 that carries no Retry-After / X-RateLimit-Reset header
+TIKTOK_RATE_LIMIT_DEFAULT_RETRY_SECONDS = float(os.getenv("TIKTOK_RATE_LIMIT_DEFAULT_RETRY_SECONDS", "5"))
+# Key of the app-wide rate limit bucket
+TIKTOK_CLIENT_KEY = os.getenv("TIKTOK_CLIENT_KEY", os.getenv("CLIENT_KEY", "default"))
+
+# Batch posting ({"items": [...]}) limits
+POST_BATCH_MAX_ITEMS = int(os.getenv("POST_BATCH_MAX_ITEMS", "50"))
+POST_BATCH_MAX_WORKERS = int(os.getenv("POST_BATCH_MAX_WORKERS", "8"))
+
+# Creator info (privacy options etc.) is reused per open_id for this many seconds
+CREATOR_INFO_TTL_SECONDS = int(os.getenv("CREATOR_INFO_TTL_SECONDS", "300"))
+# Optional JSON file the creator info cache is persisted to (e.g. on an EFS mount)
+CREATOR_INFO_CACHE_FILE = os.getenv("CREATOR_INFO_CACHE_FILE", "")
+
+# Default for the request's wait_for_status option: false returns right after video/init
+POST_WAIT_FOR_STATUS = os.getenv("POST_WAIT_FOR_STATUS", "true").lower() == "true"
+# How TikTok gets the video: PULL_FROM_URL (TikTok fetches r2_video_url) or
+# FILE_UPLOAD (the poster streams the object from R2 to TikTok in chunks)
+TIKTOK_VIDEO_SOURCE = os.getenv("TIKTOK_VIDEO_SOURCE", "PULL_FROM_URL").upper()
+VIDEO_SOURCES = ("PULL_FROM_URL", "FILE_UPLOAD")
+# Status fetches in flight at once when polling many publish records
+STATUS_POLL_CONCURRENCY = int(os.getenv("STATUS_POLL_CONCURRENCY", "16"))
+# Retry-After for a repeated post whose first attempt is still being initialised
+POST_IN_PROGRESS_RETRY_SECONDS = int(os.getenv("POST_IN_PROGRESS_RETRY_SECONDS", "10"))
+# Most (open_id, publish_id) pairs accepted by one bulk status request
+STATUS_BULK_MAX_ITEMS = int(os.getenv("STATUS_BULK_MAX_ITEMS", "500"))
+
+# TikTok error codes meaning the creator settings we validated against are out of date
+STALE_CREATOR_INFO_ERRORS = {"privacy_level_option_mismatch"}
+# Endpoints that must not be re-sent after a timeout, since TikTok may already have acted on them
+NON_IDEMPOTENT_ENDPOINTS = {"/v2/post/publish/video/init/"}
+
+_rate_limiter = RateLimiter()
+
+_token_store = None
+_token_store_lock = threading.Lock()
+
+_token_api_session = None
+_token_api_session_lock = threading.Lock()
+# Timeouts are per attempt; retries and the circuit breakers bound the whole call
+_tiktok_resilience = Resilience("tiktok")
+_token_api_resilience = Resilience("token_api")
+
+# open_id -> (access_token, expires_at)
+_access_token_cache: Dict[str, Tuple[str, float]] = {}
+_access_token_lock = threading.Lock()
+
+_creator_info_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_creator_info_lock = threading.Lock()
+_creator_info_file_loaded = False
+
+
+class TikTokAPIError(Exception):
+    """Error response from the TikTok API"""
+
+    def __init__(self, message: str, code: Optional[str] = None, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.code = code
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class PrivacyLevelError(ValueError):
+    """Requested privacy level is not offered by the creator"""
+
+def get_token_store():
+    """
+    TokenStore class for TOKEN_STORE_MODE=embedded, imported on first use
+
+    build.sh bundles token_store.py / token_backends.py from lambda_token_api;
+    in a source checkout they are imported from the sibling directory.
+
+    Returns:
+        TokenStore, or None if embedded mode is off or the module is unavailable
+    """
+    global _token_store
+    if TOKEN_STORE_MODE != 'embedded':
+        return None
+    if _token_store is None:
+        with _token_store_lock:
+            if _token_store is None:
+                try:
+                    from token_store import TokenStore
+                except ImportError:
+                    sibling = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_token_api')
+                    if not os.path.isdir(sibling):
+                        logger.warning("TOKEN_STORE_MODE=embedded but token_store is not bundled; using the token API")
+                        return None
+                    sys.path.append(sibling)
+                    from token_store import TokenStore
+                _token_store = TokenStore
+    return _token_store
+
+def get_token_api_session() -> requests.Session:
+    """Keep-alive session for the token API, shared by all invocations of the container"""
+    global _token_api_session
+    if _token_api_session is None:
+        with _token_api_session_lock:
+            if _token_api_session is None:
+                session = requests.Session()
+                session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=POST_BATCH_MAX_WORKERS))
+                _token_api_session = session
+    return _token_api_session
+
+def _cached_access_token(open_id: str) -> Optional[str]:
+    with _access_token_lock:
+        entry = _access_token_cache.get(open_id)
+        if entry and time.time() < entry[1] - ACCESS_TOKEN_CACHE_SKEW_SECONDS:
+            return entry[0]
+    return None
+
+def _remember_access_token(open_id: str, token: Optional[Dict[str, Any]]):
+    """Cache a token until shortly before it expires (tokens without expires_at are not cached)"""
+    if token and token.get('access_token') and token.get('expires_at'):
+        with _access_token_lock:
+            _access_token_cache[open_id] = (token['access_token'], float(token['expires_at']))
+
+def invalidate_access_token(open_id: Optional[str] = None):
+    """Drop the cached access token for open_id (or for every account)"""
+    with _access_token_lock:
+        if open_id is None:
+            _access_token_cache.clear()
+        else:
+            _access_token_cache.pop(open_id, None)
+
+def _fetch_token(open_id: str, force: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Get {"access_token", "expires_at"} from the embedded TokenStore or the existing token API
+
+    force refreshes the stored token even if it has not expired (after TikTok rejected it).
+    """
+    token_store = get_token_store()
+    if token_store is not None:
+        try:
+            return token_store.get_token(open_id, force=force)
+        except Exception as e:
+            logger.error(f"Embedded TokenStore lookup failed, falling back to the token API: {str(e)}")
+
+    token_api_url = f"{TOKEN_API_BASE_URL}/token/{open_id}"
+    if force:
+        token_api_url += "?refresh=true"
 
     try:
-        response = requests.get(token_api_url)
+        response = _token_api_resilience.call(
+            lambda: get_token_api_session().get(token_api_url, timeout=DEFAULT_TIMEOUT))
         if response.status_code == 200:
-            data = response.json()
-            return data.get('access_token')
+            return response.json()
         else:
             logger.error(f"Failed to get access token: {response.status_code} - {response.text}")
             return None
@@ -28,29 +195,192 @@ def get_access_token(open_id: str) -> Optional[str]:
         logger.error(f"Error getting access token: {str(e)}")
         return None
 
-def make_tiktok_api_request(endpoint: str, data: Dict[str, Any], access_token: str) -> Dict[str, Any]:
-    """Make authenticated API request to TikTok"""
-    headers = {
+def _fetch_tokens(open_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Get tokens for many open_ids with one TokenStore read or one call to the token API's batch route"""
+    token_store = get_token_store()
+    if token_store is not None:
+        try:
+            results = token_store.get_access_tokens(open_ids)
+            return {open_id: results.get(open_id) for open_id in open_ids}
+        except Exception as e:
+            logger.error(f"Embedded TokenStore batch lookup failed, falling back to the token API: {str(e)}")
+
+    try:
+        response = _token_api_resilience.call(lambda: get_token_api_session().post(
+            f"{TOKEN_API_BASE_URL}/tokens/batch", json={"open_ids": open_ids}, timeout=DEFAULT_TIMEOUT))
+        if response.status_code == 200:
+            results = response.json().get('results', {})
+            return {open_id: results.get(open_id) for open_id in open_ids}
+        logger.error(f"Failed to get access tokens in batch: {response.status_code} - {response.text}")
+    except Exception as e:
+        logger.error(f"Error getting access tokens in batch: {str(e)}")
+
+    # Fall back to one lookup per account
+    return {open_id: _fetch_token(open_id) for open_id in open_ids}
+
+def get_access_token(open_id: str, force: bool = False) -> Optional[str]:
+    """
+    Get access token, reusing the one cached in this container until shortly before it expires
+
+    force skips the cache and has the token store refresh the token.
+    """
+    cached = None if force else _cached_access_token(open_id)
+    if cached:
+        return cached
+
+    token = _fetch_token(open_id, force=force)
+    _remember_access_token(open_id, token)
+    return token.get('access_token') if token else None
+
+def get_access_tokens(open_ids: List[str]) -> Dict[str, Optional[str]]:
+    """Get access tokens for many open_ids, fetching only the ones not cached in one call"""
+    access_tokens = {open_id: _cached_access_token(open_id) for open_id in open_ids}
+    missing = [open_id for open_id, access_token in access_tokens.items() if not access_token]
+    if missing:
+        for open_id, token in _fetch_tokens(missing).items():
+            _remember_access_token(open_id, token)
+            access_tokens[open_id] = token.get('access_token') if token else None
+    return access_tokens
+
+def call_with_token_retry(open_id: str, access_token: str, operation):
+    """
+    Run operation(access_token); if TikTok rejects the token with a 401, drop the
+    cached token, have the token store refresh it and retry once
+
+    Returns:
+        Tuple of (operation result, access token that was used)
+    """
+    try:
+        return operation(access_token), access_token
+    except TikTokAPIError as e:
+        if e.status_code != 401:
+            raise
+        logger.info(f"Access token for {open_id} was rejected; fetching a fresh one")
+
+    invalidate_access_token(open_id)
+    fresh_token = get_access_token(open_id, force=True)
+    if not fresh_token or fresh_token == access_token:
+        raise TikTokAPIError("API request failed: access token rejected and no fresh token available",
+                             code="access_token_invalid", status_code=401)
+    return operation(fresh_token), fresh_token
+
+async def call_with_token_retry_async(open_id: str, access_token: str, operation):
+    """call_with_token_retry for operations that return a coroutine"""
+    try:
+        return await operation(access_token), access_token
+    except TikTokAPIError as e:
+        if e.status_code != 401:
+            raise
+        logger.info(f"Access token for {open_id} was rejected; fetching a fresh one")
+
+    invalidate_access_token(open_id)
+    fresh_token = await asyncio.to_thread(get_access_token, open_id, force=True)
+    if not fresh_token or fresh_token == access_token:
+        raise TikTokAPIError("API request failed: access token rejected and no fresh token available",
+                             code="access_token_invalid", status_code=401)
+    return await operation(fresh_token), fresh_token
+
+def _tiktok_headers(access_token: str) -> Dict[str, str]:
+    return {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json; charset=UTF-8",
     }
 
-    api_base_url = "https://open.tiktokapis.com"
-    logger.info(f"Making API request to {api_base_url}{endpoint}")
+def _rate_limit_account_key(access_token: str) -> str:
+    # TikTok applies its per-user quotas per user access token
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
 
-    response = requests.post(f"{api_base_url}{endpoint}", headers=headers, json=data)
+def _rate_limit_error(error: RateLimitExceeded) -> TikTokAPIError:
+    return TikTokAPIError(f"API rate limit exceeded: {str(error)}", code="rate_limit_exceeded",
+                          status_code=429, retry_after=error.retry_after)
 
+def _note_rate_limit(endpoint: str, account_key: str, response) -> bool:
+    """Feed a response's rate limit signals to the limiter; True if it was a 429 to retry"""
+    retry_after = parse_retry_after(response.headers)
+    if response.status_code == 429:
+        retry_after = TIKTOK_RATE_LIMIT_DEFAULT_RETRY_SECONDS if retry_after is None else retry_after
+        logger.warning(f"Rate limited on {endpoint}; retrying in {retry_after:.1f}s")
+        _rate_limiter.penalize(endpoint, account_key, TIKTOK_CLIENT_KEY, retry_after)
+        return True
+
+    # Honour a quota that the response says is used up before the next request hits it
+    remaining = {key.lower(): value for key, value in response.headers.items()}.get("x-ratelimit-remaining")
+    if remaining == "0" and retry_after:
+        _rate_limiter.penalize(endpoint, account_key, TIKTOK_CLIENT_KEY, retry_after)
+    return False
+
+def _parse_tiktok_response(response) -> Dict[str, Any]:
+    """Response body of a successful call; raises TikTokAPIError otherwise"""
     if response.status_code != 200:
-        raise Exception(f"API request failed: {response.status_code} - {response.text}")
+        try:
+            code = response.json().get("error", {}).get("code")
+        except ValueError:
+            code = None
+        raise TikTokAPIError(f"API request failed: {response.status_code} - {response.text}",
+                             code=code, status_code=response.status_code)
 
     response_data = response.json()
 
     if response_data.get("error", {}).get("code") != "ok":
         error_msg = response_data.get("error", {}).get("message", "Unknown error")
-        raise Exception(f"API error: {error_msg}")
+        raise TikTokAPIError(f"API error: {error_msg}", code=response_data.get("error", {}).get("code"),
+                             status_code=response.status_code)
 
     return response_data
 
+def _circuit_open_error(error: CircuitOpenError) -> TikTokAPIError:
+    return TikTokAPIError(f"API unavailable: {str(error)}", code="circuit_open",
+                          status_code=503, retry_after=error.retry_after)
+
+def make_tiktok_api_request(endpoint: str, data: Dict[str, Any], access_token: str) -> Dict[str, Any]:
+    """
+    Make authenticated API request to TikTok, waiting out per-account and per-app rate limits
+
+    Transient failures are retried with jittered backoff (video/init only when the
+    request never reached TikTok); while TikTok keeps failing, calls fail fast
+    with a 503 TikTokAPIError instead of waiting on timeouts.
+    """
+    headers = _tiktok_headers(access_token)
+    account_key = _rate_limit_account_key(access_token)
+    deadline = time.monotonic() + TIKTOK_RATE_LIMIT_WAIT_SECONDS
+
+    while True:
+        try:
+            _rate_limiter.acquire(endpoint, account_key, TIKTOK_CLIENT_KEY, deadline)
+        except RateLimitExceeded as e:
+            raise _rate_limit_error(e)
+
+        logger.info(f"Making API request to {endpoint}")
+        try:
+            response = _tiktok_resilience.call(lambda: get_tiktok_client().post(endpoint, headers=headers, json=data),
+                                               idempotent=endpoint not in NON_IDEMPOTENT_ENDPOINTS)
+        except CircuitOpenError as e:
+            raise _circuit_open_error(e)
+        if not _note_rate_limit(endpoint, account_key, response):
+            return _parse_tiktok_response(response)
+
+async def make_tiktok_api_request_async(endpoint: str, data: Dict[str, Any], access_token: str) -> Dict[str, Any]:
+    """make_tiktok_api_request for coroutines running on the TikTok client's event loop"""
+    headers = _tiktok_headers(access_token)
+    account_key = _rate_limit_account_key(access_token)
+    deadline = time.monotonic() + TIKTOK_RATE_LIMIT_WAIT_SECONDS
+
+    while True:
+        try:
+            await _rate_limiter.acquire_async(endpoint, account_key, TIKTOK_CLIENT_KEY, deadline)
+        except RateLimitExceeded as e:
+            raise _rate_limit_error(e)
+
+        logger.info(f"Making API request to {endpoint}")
+        try:
+            response = await _tiktok_resilience.call_async(
+                lambda: get_tiktok_client().request("POST", endpoint, headers=headers, json=data),
+                idempotent=endpoint not in NON_IDEMPOTENT_ENDPOINTS)
+        except CircuitOpenError as e:
+            raise _circuit_open_error(e)
+        if not _note_rate_limit(endpoint, account_key, response):
+            return _parse_tiktok_response(response)
+
 def query_creator_info(access_token: str) -> Dict[str, Any]:
     """
     Query creator information before posting (required by TikTok UX guidelines)
@@ -65,22 +395,103 @@ def query_creator_info(access_token: str) -> Dict[str, Any]:
     response_data = make_tiktok_api_request(endpoint, {}, access_token)
     return response_data["data"]
 
-def prepare_video_source(video_path: str) -> Dict[str, str]:
+def _load_creator_info_file():
+    """Populate the in-process cache from CREATOR_INFO_CACHE_FILE once per container"""
+    global _creator_info_file_loaded
+    if _creator_info_file_loaded or not CREATOR_INFO_CACHE_FILE:
+        return
+    _creator_info_file_loaded = True
+    try:
+        with open(CREATOR_INFO_CACHE_FILE) as f:
+            for open_id, entry in json.load(f).items():
+                _creator_info_cache.setdefault(open_id, (entry["fetched_at"], entry["info"]))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable creator info cache file: {str(e)}")
+
+
+def _save_creator_info_file():
+    if not CREATOR_INFO_CACHE_FILE:
+        return
+    data = {open_id: {"fetched_at": fetched_at, "info": info}
+            for open_id, (fetched_at, info) in _creator_info_cache.items()}
+    try:
+        tmp_path = f"{CREATOR_INFO_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, CREATOR_INFO_CACHE_FILE)
+    except Exception as e:
+        logger.warning(f"Failed to persist creator info cache: {str(e)}")
+
+
+def load_creator_info(open_id: str, access_token: str, force_refresh: bool = False) -> Tuple[Dict[str, Any], bool]:
     """
-    Prepare video source information for TikTok API (URL sources only)
+    Get creator info for open_id, reusing a cached copy younger than CREATOR_INFO_TTL_SECONDS
+
+    Returns:
+        Tuple of (creator info, whether it was served from the cache)
+    """
+    with _creator_info_lock:
+        _load_creator_info_file()
+        entry = _creator_info_cache.get(open_id)
+        if entry and not force_refresh and time.time() - entry[0] < CREATOR_INFO_TTL_SECONDS:
+            return entry[1], True
+
+    creator_info = query_creator_info(access_token)
+
+    with _creator_info_lock:
+        _creator_info_cache[open_id] = (time.time(), creator_info)
+        _save_creator_info_file()
+    return creator_info, False
+
+
+def get_creator_info(open_id: str, access_token: str, force_refresh: bool = False) -> Dict[str, Any]:
+    """Cached query_creator_info keyed by open_id"""
+    return load_creator_info(open_id, access_token, force_refresh=force_refresh)[0]
+
+
+def invalidate_creator_info(open_id: Optional[str] = None):
+    """Drop the cached creator info for open_id (or for every account)"""
+    with _creator_info_lock:
+        if open_id is None:
+            _creator_info_cache.clear()
+        else:
+            _creator_info_cache.pop(open_id, None)
+        _save_creator_info_file()
+
+
+def is_stale_creator_info_error(error: Exception) -> bool:
+    """Whether a failed post may succeed after re-reading the creator's settings"""
+    if isinstance(error, PrivacyLevelError):
+        return True
+    return isinstance(error, TikTokAPIError) and error.code in STALE_CREATOR_INFO_ERRORS
+
+
+def prepare_video_source(video_path: str, video_source: Optional[str] = None) -> Dict[str, str]:
+    """
+    Prepare video source information for TikTok API
 
     Args:
         video_path: URL to video file
+        video_source: PULL_FROM_URL or FILE_UPLOAD (defaults to TIKTOK_VIDEO_SOURCE)
 
     Returns:
-        Dict containing source info for TikTok API
+        Dict containing source info for TikTok API; for FILE_UPLOAD the R2
+        object key, to be completed with the chunk plan before video/init
 
     Raises:
-        ValueError: If video_path is not a valid URL
+        ValueError: If video_path is not a valid URL, or not an R2 video for FILE_UPLOAD
     """
+    video_source = (video_source or TIKTOK_VIDEO_SOURCE).upper()
+    if video_source not in VIDEO_SOURCES:
+        raise ValueError(f"Unsupported video_source: {video_source}. Options: {list(VIDEO_SOURCES)}")
+
     if not video_path.startswith(("http://", "https://")):
         raise ValueError(f"Only URL sources are supported. Got: {video_path}")
 
+    if video_source == "FILE_UPLOAD":
+        return {"source": "FILE_UPLOAD", "r2_key": r2_object_key(video_path)}
     return {"source": "PULL_FROM_URL", "video_url": video_path}
 
 def post_video_to_tiktok(
@@ -91,7 +502,9 @@ def post_video_to_tiktok(
     disable_duet: bool = False,
     disable_comment: bool = False,
     disable_stitch: bool = False,
-    video_cover_timestamp_ms: Optional[int] = None
+    video_cover_timestamp_ms: Optional[int] = None,
+    creator_info: Optional[Dict[str, Any]] = None,
+    video_source: Optional[str] = None
 ) -> str:
     """
     Post a video to TikTok following official API best practices
@@ -105,21 +518,24 @@ def post_video_to_tiktok(
         disable_comment: Whether to disable comments
         disable_stitch: Whether to disable stitch feature
         video_cover_timestamp_ms: Timestamp for video cover
+        creator_info: Result of query_creator_info if already known (queried otherwise)
+        video_source: PULL_FROM_URL or FILE_UPLOAD (defaults to TIKTOK_VIDEO_SOURCE)
 
     Returns:
         str: publish_id for tracking the post status
     """
 
-    creator_info = query_creator_info(access_token)
+    video_info = prepare_video_source(video_path, video_source)
+
+    if creator_info is None:
+        creator_info = query_creator_info(access_token)
 
     available_privacy_levels = creator_info.get("privacy_level_options", [])
     if privacy_level not in available_privacy_levels:
-        raise ValueError(
+        raise PrivacyLevelError(
             f"Privacy level '{privacy_level}' not available. Options: {available_privacy_levels}"
         )
 
-    video_info = prepare_video_source(video_path)
-
     post_info = {
         "title": title,
         "privacy_level": privacy_level,
@@ -131,6 +547,18 @@ def post_video_to_tiktok(
     if video_cover_timestamp_ms is not None:
         post_info["video_cover_timestamp_ms"] = video_cover_timestamp_ms
 
+    video = None
+    if video_info["source"] == "FILE_UPLOAD":
+        video = describe_video(video_info.pop("r2_key"))
+        video_info.update({
+            "video_size": video["video_size"],
+            "chunk_size": video["chunk_size"],
+            "total_chunk_count": video["total_chunk_count"],
+        })
+    else:
+        # Resolved here rather than in prepare_video_source, which also validates requests up front
+        video_info["video_url"] = pull_url(video_info["video_url"])
+
     data = {
         "post_info": post_info,
         "source_info": video_info,
@@ -138,8 +566,47 @@ def post_video_to_tiktok(
 
     response_data = make_tiktok_api_request("/v2/post/publish/video/init/", data, access_token)
 
+    if video is not None:
+        upload_video(response_data["data"]["upload_url"], video)
+
     return response_data["data"]["publish_id"]
 
+def post_video_for_account(
+    open_id: str,
+    access_token: str,
+    creator_info: Optional[Dict[str, Any]] = None,
+    creator_info_from_cache: bool = True,
+    **post_options
+) -> str:
+    """
+    Post a video using the cached creator info of open_id
+
+    If the post is rejected because the cached creator settings are out of date,
+    the creator info is re-queried once and the post retried.
+
+    Args:
+        open_id: TikTok user's open_id
+        access_token: TikTok access token
+        creator_info: Creator info already loaded for this request (looked up otherwise)
+        creator_info_from_cache: Whether creator_info came from the cache rather than TikTok
+        **post_options: Arguments for post_video_to_tiktok
+
+    Returns:
+        str: publish_id for tracking the post status
+    """
+    if creator_info is None:
+        creator_info, creator_info_from_cache = load_creator_info(open_id, access_token)
+
+    try:
+        return post_video_to_tiktok(access_token=access_token, creator_info=creator_info, **post_options)
+    except (PrivacyLevelError, TikTokAPIError) as e:
+        if not creator_info_from_cache or not is_stale_creator_info_error(e):
+            raise
+        logger.info(f"Cached creator info for {open_id} looks stale ({str(e)}); refreshing and retrying")
+
+    creator_info = get_creator_info(open_id, access_token, force_refresh=True)
+    return post_video_to_tiktok(access_token=access_token, creator_info=creator_info, **post_options)
+
 def get_post_status(access_token: str, publish_id: str) -> Dict[str, Any]:
     """
     Check the status of a post using its publish_id
@@ -157,6 +624,509 @@ def get_post_status(access_token: str, publish_id: str) -> Dict[str, Any]:
 
     return response_data["data"]
 
+async def get_post_status_async(access_token: str, publish_id: str) -> Dict[str, Any]:
+    """get_post_status for coroutines running on the TikTok client's event loop"""
+    response_data = await make_tiktok_api_request_async("/v2/post/publish/status/fetch/",
+                                                        {"publish_id": publish_id}, access_token)
+    return response_data["data"]
+
+def track_publish(publish_id: str, open_id: str, status: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Record a new post so its status can be polled later (failures are logged, not raised)"""
+    record = new_record(publish_id, open_id)
+    if status is not None:
+        apply_status(record, status)
+    try:
+        get_record_store().put(record, created=True)
+    except Exception as e:
+        logger.error(f"Failed to record publish {publish_id}: {str(e)}")
+        return None
+    return record
+
+def update_publish(record: Dict[str, Any], status: Dict[str, Any]) -> Dict[str, Any]:
+    """Store a fetched status on a tracked post (failures are logged, not raised)"""
+    apply_status(record, status)
+    try:
+        get_record_store().put(record)
+    except Exception as e:
+        logger.error(f"Failed to update publish {record['publish_id']}: {str(e)}")
+    return record
+
+def begin_post(open_id: str, video_url: str, title: str,
+               caller_key: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Claim the idempotency key of a post before calling video/init
+
+    Returns:
+        Tuple of (claimed key or None, earlier claim to answer with instead of posting).
+        If the claim store fails, the post goes ahead without idempotency.
+    """
+    if IDEMPOTENCY_WINDOW_SECONDS <= 0:
+        return None, None
+    if not is_shared_store():
+        # Retries land in other containers, so a claim held in this one would not stop them
+        logger.warning("PUBLISH_RECORD_BUCKET is not set; posting without idempotency")
+        return None, None
+    key = idempotency_key(open_id, video_url, title, caller_key)
+    try:
+        existing = claim_idempotency(get_record_store(), key, open_id)
+    except Exception as e:
+        logger.error(f"Failed to claim idempotency key for {open_id}: {str(e)}")
+        return None, None
+    if existing is not None:
+        logger.info(f"Repeated post for {open_id} (publish_id {existing.get('publish_id')}); not posting again")
+        return None, existing
+    return key, None
+
+def finish_post(key: Optional[str], open_id: str, publish_id: Optional[str] = None):
+    """Attach the publish_id to a claim, or release the claim of a post that failed"""
+    if key is None:
+        return
+    store = get_record_store()
+    try:
+        if publish_id is None:
+            store.delete_claim(key)
+        else:
+            store.put_claim({"key": key, "open_id": open_id, "publish_id": publish_id, "created_at": time.time()})
+    except Exception as e:
+        logger.error(f"Failed to update idempotency claim for {open_id}: {str(e)}")
+
+def is_definite_rejection(error: Exception) -> bool:
+    """
+    Whether a failed post certainly did not create a TikTok post
+
+    Validation errors, requests that never left this container (open circuit) and
+    error answers from TikTok qualify. Timeouts, connection errors and 5xx responses
+    may have reached TikTok and created the post, so they do not.
+    """
+    if isinstance(error, ValueError):
+        return True
+    if isinstance(error, TikTokAPIError):
+        if error.code == "circuit_open":
+            return True
+        return error.status_code is not None and error.status_code < 500 and error.status_code != 408
+    return False
+
+def fail_post(key: Optional[str], open_id: str, error: Exception):
+    """
+    Release the claim of a post that was definitely rejected
+
+    When the outcome is unknown the claim is kept, so a retry answers 409 instead of
+    posting twice until IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS passes.
+    """
+    if key is None:
+        return
+    if is_definite_rejection(error):
+        finish_post(key, open_id)
+    else:
+        logger.warning(f"Post for {open_id} may have reached TikTok ({type(error).__name__}); keeping its idempotency claim")
+
+def repeated_post_result(claim: Dict[str, Any]) -> Dict[str, Any]:
+    """publish_id and last known status of the post an idempotency claim refers to"""
+    publish_id = claim.get("publish_id")
+    record = get_record_store().get(publish_id) if publish_id else None
+    return {
+        'publish_id': publish_id,
+        'status': record.get('status') if record else None,
+        'fail_reason': record.get('fail_reason') if record else None,
+        'uploaded_at': record.get('uploaded_at') if record else None,
+        'duplicate': True
+    }
+
+def poll_publish_status(publish_id: str, force: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Bring a publish record up to date, fetching the status from TikTok if a check is due
+
+    Args:
+        publish_id: The publish_id returned from post_video
+        force: Fetch even if the backoff delay has not elapsed yet
+
+    Returns:
+        The (possibly updated) publish record, or None if the publish_id is unknown
+    """
+    store = get_record_store()
+    record = store.get(publish_id)
+    if record is None or record.get("terminal") or not (force or is_due(record)):
+        return record
+
+    access_token = get_access_token(record["open_id"])
+    if not access_token:
+        logger.error(f"No access token to poll publish {publish_id} for open_id {record['open_id']}")
+        return record
+
+    status, _ = call_with_token_retry(record["open_id"], access_token,
+                                      lambda token: get_post_status(token, publish_id))
+    apply_status(record, status)
+    store.put(record)
+    return record
+
+def poll_publish_statuses(publish_ids: List[str], force: bool = False,
+                          concurrency: int = STATUS_POLL_CONCURRENCY) -> Dict[str, Any]:
+    """
+    poll_publish_status for many publish_ids at once
+
+    Tokens for all due records are fetched in one call, then the status
+    fetches run concurrently on the shared TikTok client.
+
+    Returns:
+        Dict of publish_id to its record (None if unknown) or the exception its poll raised
+    """
+    return get_tiktok_client().run(_poll_publish_statuses(publish_ids, force, concurrency))
+
+async def _poll_publish_statuses(publish_ids: List[str], force: bool, concurrency: int) -> Dict[str, Any]:
+    store = get_record_store()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def load(publish_id):
+        async with semaphore:
+            return await asyncio.to_thread(store.get, publish_id)
+
+    records = await asyncio.gather(*(load(publish_id) for publish_id in publish_ids), return_exceptions=True)
+    results = dict(zip(publish_ids, records))
+    due = {publish_id: record for publish_id, record in results.items()
+           if isinstance(record, dict) and not record.get("terminal") and (force or is_due(record))}
+    if not due:
+        return results
+
+    access_tokens = await asyncio.to_thread(get_access_tokens, sorted({record["open_id"] for record in due.values()}))
+
+    async def poll(publish_id, record):
+        access_token = access_tokens.get(record["open_id"])
+        if not access_token:
+            logger.error(f"No access token to poll publish {publish_id} for open_id {record['open_id']}")
+            return record
+        async with semaphore:
+            status, _ = await call_with_token_retry_async(
+                record["open_id"], access_token, lambda token: get_post_status_async(token, publish_id))
+            apply_status(record, status)
+            await asyncio.to_thread(store.put, record)
+        return record
+
+    polled = await asyncio.gather(*(poll(publish_id, record) for publish_id, record in due.items()),
+                                  return_exceptions=True)
+    results.update(zip(due, polled))
+    return results
+
+def fetch_publish_statuses(posts: List[Tuple[str, str]],
+                           concurrency: int = STATUS_POLL_CONCURRENCY) -> Dict[str, Any]:
+    """
+    Fetch the TikTok status of many posts, tracked or not
+
+    Posts are grouped by account so each access token is fetched once, then
+    the status fetches run concurrently on the shared TikTok client.
+
+    Args:
+        posts: (open_id, publish_id) pairs
+        concurrency: Status fetches in flight at once
+
+    Returns:
+        Dict of publish_id to its status data or the exception its fetch raised
+    """
+    return get_tiktok_client().run(_fetch_publish_statuses(posts, concurrency))
+
+async def _fetch_publish_statuses(posts: List[Tuple[str, str]], concurrency: int) -> Dict[str, Any]:
+    publish_ids = {}
+    for open_id, publish_id in posts:
+        publish_ids.setdefault(publish_id, open_id)
+    access_tokens = await asyncio.to_thread(get_access_tokens, list(dict.fromkeys(publish_ids.values())))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def fetch(publish_id, open_id):
+        if not access_tokens.get(open_id):
+            raise TikTokAPIError("Failed to get access token for the specified open_id",
+                                 code="access_token_missing", status_code=401)
+        async with semaphore:
+            # Later fetches for the account pick up a token refreshed after a 401
+            status, access_tokens[open_id] = await call_with_token_retry_async(
+                open_id, access_tokens[open_id], lambda token: get_post_status_async(token, publish_id))
+        return status
+
+    results = await asyncio.gather(*(fetch(publish_id, open_id) for publish_id, open_id in publish_ids.items()),
+                                   return_exceptions=True)
+    return dict(zip(publish_ids, results))
+
+def bulk_status_handler(body: Dict[str, Any]) -> Dict[str, Any]:
+    """POST with {"posts": [{"open_id": ..., "publish_id": ...}, ...]} - Statuses of many posts"""
+    posts = body.get('posts')
+    if (not isinstance(posts, list) or not posts
+            or not all(isinstance(post, dict) and post.get('open_id') and post.get('publish_id') for post in posts)):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': 'posts must be a non-empty list of {open_id, publish_id}'
+            })
+        }
+
+    if len(posts) > STATUS_BULK_MAX_ITEMS:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': f'At most {STATUS_BULK_MAX_ITEMS} posts are allowed per request'
+            })
+        }
+
+    results = fetch_publish_statuses([(post['open_id'], post['publish_id']) for post in posts],
+                                     concurrency=STATUS_POLL_CONCURRENCY)
+    statuses = {}
+    errors = {}
+    for publish_id, result in results.items():
+        if isinstance(result, Exception):
+            logger.error(f"Failed to fetch status of {publish_id}: {str(result)}")
+            errors[publish_id] = str(result)
+        else:
+            statuses[publish_id] = {key: result[key] for key in ('status', 'fail_reason', 'uploaded_at')
+                                    if result.get(key) is not None}
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'success': not errors,
+            'statuses': statuses,
+            'errors': errors
+        })
+    }
+
+def status_handler(event) -> Dict[str, Any]:
+    """GET /status/{publish_id} - Publish status, polled from TikTok with backoff"""
+    publish_id = (event.get('pathParameters') or {}).get('publish_id')
+    force = ((event.get('queryStringParameters') or {}).get('refresh') or '').lower() == 'true'
+
+    try:
+        record = poll_publish_status(publish_id, force=force)
+    except Exception as e:
+        logger.error(f"Error fetching publish status: {str(e)}")
+        return {
+            'statusCode': 502,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': f'Failed to fetch publish status: {str(e)}'
+            })
+        }
+
+    if record is None:
+        return {
+            'statusCode': 404,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': f'Unknown publish_id: {publish_id}'
+            })
+        }
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'success': True,
+            'publish_id': publish_id,
+            'status': record.get('status'),
+            'fail_reason': record.get('fail_reason'),
+            'uploaded_at': record.get('uploaded_at'),
+            'terminal': record.get('terminal'),
+            'next_check_at': record.get('next_check_at')
+        })
+    }
+
+def _post_options(item: Dict[str, Any]) -> Dict[str, Any]:
+    """post_video_to_tiktok arguments from a request item"""
+    return {
+        'title': item.get('title'),
+        'video_path': item.get('r2_video_url'),
+        'privacy_level': item.get('privacy_level', 'SELF_ONLY'),
+        'disable_duet': item.get('disable_duet', False),
+        'disable_comment': item.get('disable_comment', False),
+        'disable_stitch': item.get('disable_stitch', False),
+        'video_cover_timestamp_ms': item.get('video_cover_timestamp_ms'),
+        'video_source': item.get('video_source'),
+    }
+
+def post_batch(items: List[Dict[str, Any]], max_workers: int = POST_BATCH_MAX_WORKERS) -> List[Dict[str, Any]]:
+    """
+    Post many (open_id, video, title, options) items concurrently
+
+    Access tokens are fetched in one token API call and creator info once per
+    account, then the items are posted on a pool of at most max_workers threads.
+    Posts are tracked for GET /status/{publish_id} instead of waiting for a status.
+
+    Returns:
+        One result per item, in request order
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    runnable = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('r2_video_url') or not item.get('open_id') or not item.get('title'):
+            results[index] = {'index': index, 'success': False,
+                              'error': 'r2_video_url, open_id, and title are required'}
+            continue
+        try:
+            prepare_video_source(item['r2_video_url'], item.get('video_source'))
+        except ValueError as e:
+            results[index] = {'index': index, 'open_id': item['open_id'], 'success': False, 'error': str(e)}
+            continue
+        runnable.append(index)
+
+    open_ids = list(dict.fromkeys(items[index]['open_id'] for index in runnable))
+    access_tokens = get_access_tokens(open_ids) if open_ids else {}
+
+    def load_account(open_id):
+        access_token = access_tokens.get(open_id)
+        if not access_token:
+            return open_id, (None, False), 'Failed to get access token for the specified open_id'
+        try:
+            creator_info, access_tokens[open_id] = call_with_token_retry(
+                open_id, access_token, lambda token: load_creator_info(open_id, token))
+            return open_id, creator_info, None
+        except Exception as e:
+            return open_id, (None, False), f'Failed to query creator info: {str(e)}'
+
+    def post_one(index):
+        item = items[index]
+        open_id = item['open_id']
+        (creator_info, creator_info_from_cache), error = accounts[open_id]
+        if error:
+            return {'index': index, 'open_id': open_id, 'success': False, 'error': error}
+        key, existing = begin_post(open_id, item['r2_video_url'], item['title'], item.get('idempotency_key'))
+        if existing is not None:
+            if not existing.get('publish_id'):
+                return {'index': index, 'open_id': open_id, 'success': False, 'in_progress': True,
+                        'error': 'This post is already in progress'}
+            return dict({'index': index, 'open_id': open_id, 'success': True}, **repeated_post_result(existing))
+        try:
+            publish_id, _ = call_with_token_retry(open_id, access_tokens[open_id], lambda token: post_video_for_account(
+                open_id,
+                token,
+                creator_info=creator_info,
+                creator_info_from_cache=creator_info_from_cache,
+                **_post_options(item)
+            ))
+        except Exception as e:
+            logger.error(f"Batch item {index} for {open_id} failed: {str(e)}")
+            fail_post(key, open_id, e)
+            return {'index': index, 'open_id': open_id, 'success': False, 'error': str(e)}
+        finish_post(key, open_id, publish_id)
+        track_publish(publish_id, open_id)
+        return {'index': index, 'open_id': open_id, 'success': True, 'publish_id': publish_id}
+
+    workers = max(1, min(max_workers, len(runnable) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        accounts = {open_id: (info, error) for open_id, info, error in pool.map(load_account, open_ids)}
+        for result in pool.map(post_one, runnable):
+            results[result['index']] = result
+
+    return results
+
+def batch_handler(body: Dict[str, Any]) -> Dict[str, Any]:
+    """POST with {"items": [...]} - Post each item, returning per-item results"""
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': 'items must be a non-empty list'
+            })
+        }
+
+    if len(items) > POST_BATCH_MAX_ITEMS:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'error': f'At most {POST_BATCH_MAX_ITEMS} items are allowed per request'
+            })
+        }
+
+    max_workers = max(1, min(int(body.get('max_workers', POST_BATCH_MAX_WORKERS)), POST_BATCH_MAX_WORKERS))
+    results = post_batch(items, max_workers=max_workers)
+    failed = sum(1 for result in results if not result['success'])
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'success': failed == 0,
+            'results': results,
+            'total': len(results),
+            'failed': failed
+        })
+    }
+
+def flush_token_store(handler):
+    """Write back anything the embedded TokenStore buffered before the invocation ends"""
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            if _token_store is not None:
+                try:
+                    _token_store.flush()
+                except Exception as e:
+                    logger.error(f"Failed to flush buffered token writes: {str(e)}")
+    return wrapper
+
+# Create clients and open connections during the Lambda init phase
+# so the first invocation on a container does not pay for them
+if os.getenv("LAMBDA_PRIME_ON_INIT", "false").lower() == "true":
+    try:
+        get_tiktok_client().prime()
+    except Exception as e:
+        logger.warning(f"TikTok client priming failed: {str(e)}")
+    try:
+        if get_token_store() is not None:
+            get_token_store().prime()
+        else:
+            get_token_api_session().head(TOKEN_API_BASE_URL, timeout=DEFAULT_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Token store priming failed: {str(e)}")
+    if os.getenv("R2_ENDPOINT_URL"):
+        try:
+            get_r2_client()
+        except Exception as e:
+            logger.warning(f"R2 client priming failed: {str(e)}")
+
+def request_body(event: Dict[str, Any]) -> str:
+    """Raw request body text (API Gateway base64-encodes it when binary media types match)"""
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return body
+
+@flush_token_store
 def lambda_handler(event, context):
     """
     AWS Lambda handler for r2-to-tiktok-poster
@@ -170,6 +1140,24 @@ def lambda_handler(event, context):
     - disable_comment: Whether to disable comments (optional, defaults to False)
     - disable_stitch: Whether to disable stitch (optional, defaults to False)
     - video_cover_timestamp_ms: Timestamp for video cover (optional)
+    - video_source: PULL_FROM_URL or FILE_UPLOAD (optional, defaults to
+      TIKTOK_VIDEO_SOURCE). FILE_UPLOAD streams the R2 object to TikTok in
+      chunks instead of having TikTok pull it through the video worker.
+    - idempotency_key: Key identifying this post (optional). Repeats of a post,
+      by this key or else by open_id, r2_video_url and title, within
+      IDEMPOTENCY_WINDOW_SECONDS return the earlier publish_id and its last
+      known status with duplicate: true instead of posting again (409 while
+      the earlier post is still being initialised).
+    - wait_for_status: Wait 2s and fetch the status before returning
+      (optional, defaults to POST_WAIT_FOR_STATUS). When false, returns 202
+      right after video/init; poll GET /status/{publish_id} for the result.
+
+    A body of {"items": [{...}, ...]} with the fields above per item posts
+    them all concurrently (see batch_handler).
+
+    Also serves GET /status/{publish_id} (see status_handler), and a body of
+    {"posts": [{"open_id": ..., "publish_id": ...}, ...]} returns the current
+    status of each post (see bulk_status_handler).
 
     Returns:
     - publish_id: TikTok publish ID for tracking
@@ -178,12 +1166,21 @@ def lambda_handler(event, context):
     - error: error message if failed
     """
 
+    if event.get('httpMethod') == 'GET' and (event.get('pathParameters') or {}).get('publish_id'):
+        return status_handler(event)
+
     try:
         if 'body' in event:
-            body = json.loads(event['body'])
+            body = json.loads(request_body(event))
         else:
             body = event
 
+        if 'items' in body:
+            return batch_handler(body)
+
+        if 'posts' in body:
+            return bulk_status_handler(body)
+
         r2_video_url = body.get('r2_video_url')
         open_id = body.get('open_id')
         title = body.get('title')
@@ -206,6 +1203,10 @@ def lambda_handler(event, context):
         disable_comment = body.get('disable_comment', False)
         disable_stitch = body.get('disable_stitch', False)
         video_cover_timestamp_ms = body.get('video_cover_timestamp_ms')
+        video_source = body.get('video_source')
+
+        # Reject unsupported sources before spending any API calls
+        prepare_video_source(r2_video_url, video_source)
 
         logger.info(f"Posting video to TikTok for open_id: {open_id}")
 
@@ -225,9 +1226,12 @@ def lambda_handler(event, context):
 
         logger.info(f"Querying creator info for validation (TikTok UX guidelines)")
         try:
-            creator_info = query_creator_info(access_token)
+            (creator_info, creator_info_from_cache), access_token = call_with_token_retry(
+                open_id, access_token, lambda token: load_creator_info(open_id, token))
             logger.info(f"Available privacy levels: {creator_info.get('privacy_level_options', [])}")
         except Exception as e:
+            if isinstance(e, TikTokAPIError) and e.status_code in (429, 503):
+                raise
             logger.error(f"Failed to query creator info: {str(e)}")
             return {
                 'statusCode': 400,
@@ -241,21 +1245,74 @@ def lambda_handler(event, context):
                 })
             }
 
-        publish_id = post_video_to_tiktok(
-            access_token=access_token,
-            title=title,
-            video_path=r2_video_url,
-            privacy_level=privacy_level,
-            disable_duet=disable_duet,
-            disable_comment=disable_comment,
-            disable_stitch=disable_stitch,
-            video_cover_timestamp_ms=video_cover_timestamp_ms
-        )
+        idempotency, existing = begin_post(open_id, r2_video_url, title, body.get('idempotency_key'))
+        if existing is not None:
+            if not existing.get('publish_id'):
+                return {
+                    'statusCode': 409,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Retry-After': str(POST_IN_PROGRESS_RETRY_SECONDS)
+                    },
+                    'body': json.dumps({
+                        'success': False,
+                        'error': 'This post is already in progress'
+                    })
+                }
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(dict({'success': True}, **repeated_post_result(existing)))
+            }
+
+        try:
+            publish_id, access_token = call_with_token_retry(open_id, access_token, lambda token: post_video_for_account(
+                open_id,
+                token,
+                creator_info=creator_info,
+                creator_info_from_cache=creator_info_from_cache,
+                title=title,
+                video_path=r2_video_url,
+                privacy_level=privacy_level,
+                disable_duet=disable_duet,
+                disable_comment=disable_comment,
+                disable_stitch=disable_stitch,
+                video_cover_timestamp_ms=video_cover_timestamp_ms,
+                video_source=video_source
+            ))
+        except Exception as e:
+            fail_post(idempotency, open_id, e)
+            raise
+        finish_post(idempotency, open_id, publish_id)
 
         logger.info(f"Video posted successfully with publish_id: {publish_id}")
 
+        # Tracked before the status fetch, so the post is recorded even if that fails
+        record = track_publish(publish_id, open_id)
+        if not body.get('wait_for_status', POST_WAIT_FOR_STATUS):
+            return {
+                'statusCode': 202,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': True,
+                    'publish_id': publish_id,
+                    'status': None,
+                    'status_url': f'/status/{publish_id}'
+                })
+            }
+
         time.sleep(2)
-        status = get_post_status(access_token, publish_id)
+        status, access_token = call_with_token_retry(open_id, access_token,
+                                                     lambda token: get_post_status(token, publish_id))
+        if record is not None:
+            update_publish(record, status)
 
         return {
             'statusCode': 200,
@@ -272,6 +1329,23 @@ def lambda_handler(event, context):
             })
         }
 
+    except TikTokAPIError as e:
+        logger.error(f"Error posting video to TikTok: {str(e)}")
+        headers = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        }
+        if e.retry_after is not None:
+            headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return {
+            'statusCode': e.status_code if e.status_code in (429, 503) else 500,
+            'headers': headers,
+            'body': json.dumps({
+                'success': False,
+                'error': f'Failed to post video to TikTok: {str(e)}'
+            })
+        }
+
     except Exception as e:
         logger.error(f"Error posting video to TikTok: {str(e)}")
         return {
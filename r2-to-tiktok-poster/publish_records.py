@@ -0,0 +1,259 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import json
+import hashlib
+import threading
+import time
+import logging
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger()
+
+# Records and idempotency claims are kept in S3 (next to the tokens by default). An empty
+# value keeps them only in the warm container, which also turns idempotency off
+PUBLISH_RECORD_BUCKET = os.getenv("PUBLISH_RECORD_BUCKET", "tiktok-token-store")
+PUBLISH_RECORD_PREFIX = os.getenv("PUBLISH_RECORD_PREFIX", "publish_records/")
+
+# Exponential backoff between status fetches: base * 2^attempts, capped at max
+STATUS_POLL_BASE_DELAY = float(os.getenv("STATUS_POLL_BASE_DELAY", "2"))
+STATUS_POLL_MAX_DELAY = float(os.getenv("STATUS_POLL_MAX_DELAY", "300"))
+# Records still processing after this long are closed as TIMED_OUT
+STATUS_POLL_MAX_AGE_SECONDS = int(os.getenv("STATUS_POLL_MAX_AGE_SECONDS", "86400"))
+
+# Repeats of a post within this window return the earlier publish_id (0 disables)
+IDEMPOTENCY_WINDOW_SECONDS = int(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", "86400"))
+# A claim that never got a publish_id is treated as abandoned after this long
+IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS = int(os.getenv("IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS", "900"))
+
+TERMINAL_STATUSES = {"PUBLISH_COMPLETE", "FAILED", "SEND_TO_USER_INBOX", "TIMED_OUT"}
+
+
+def new_record(publish_id: str, open_id: str, now: Optional[float] = None) -> Dict[str, Any]:
+    """Record for a post that was just initialised and has not been polled yet"""
+    now = time.time() if now is None else now
+    return {
+        "publish_id": publish_id,
+        "open_id": open_id,
+        "status": None,
+        "fail_reason": None,
+        "uploaded_at": None,
+        "created_at": now,
+        "updated_at": now,
+        "attempts": 0,
+        "next_check_at": now + STATUS_POLL_BASE_DELAY,
+        "terminal": False,
+    }
+
+
+def apply_status(record: Dict[str, Any], status: Dict[str, Any], now: Optional[float] = None) -> Dict[str, Any]:
+    """Store a fetched status and schedule the next check with exponential backoff"""
+    now = time.time() if now is None else now
+    record["status"] = status.get("status")
+    record["fail_reason"] = status.get("fail_reason")
+    record["uploaded_at"] = status.get("uploaded_at") or record.get("uploaded_at")
+    record["attempts"] = record.get("attempts", 0) + 1
+    record["updated_at"] = now
+
+    if record["status"] not in TERMINAL_STATUSES and now - record["created_at"] >= STATUS_POLL_MAX_AGE_SECONDS:
+        record["status"] = "TIMED_OUT"
+    record["terminal"] = record["status"] in TERMINAL_STATUSES
+
+    delay = min(STATUS_POLL_MAX_DELAY, STATUS_POLL_BASE_DELAY * (2 ** record["attempts"]))
+    record["next_check_at"] = None if record["terminal"] else now + delay
+    return record
+
+
+def is_due(record: Dict[str, Any], now: Optional[float] = None) -> bool:
+    """Whether a pending record's next status check is due"""
+    now = time.time() if now is None else now
+    return not record.get("terminal") and (record.get("next_check_at") or 0) <= now
+
+
+def idempotency_key(open_id: str, video_url: str, title: str, caller_key: Optional[str] = None) -> str:
+    """Key identifying a post: the caller's idempotency key, or the video and title, per account"""
+    parts = [open_id, caller_key] if caller_key else [open_id, video_url, title]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def is_live_claim(claim: Dict[str, Any], now: Optional[float] = None,
+                  window: Optional[int] = None, claim_timeout: Optional[int] = None) -> bool:
+    """Whether an idempotency claim still stands (its post is in progress or recent)"""
+    now = time.time() if now is None else now
+    window = IDEMPOTENCY_WINDOW_SECONDS if window is None else window
+    claim_timeout = IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS if claim_timeout is None else claim_timeout
+    age = now - claim.get("created_at", 0)
+    return age < (window if claim.get("publish_id") else claim_timeout)
+
+
+def claim_idempotency(store, key: str, open_id: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Claim an idempotency key for a new post
+
+    Returns:
+        None if the caller now holds the claim and should post, otherwise the
+        live claim of an earlier post (with its publish_id once it is known)
+    """
+    now = time.time() if now is None else now
+    claim = {"key": key, "open_id": open_id, "publish_id": None, "created_at": now}
+    while True:
+        existing = store.get_claim(key)
+        if existing is not None and is_live_claim(existing, now):
+            return existing
+        # Losing this race means another invocation claimed the key first; look again
+        if store.create_claim(claim, replace=existing):
+            return None
+
+
+class MemoryPublishRecordStore:
+    """Publish records held in the warm container (lost when the container is recycled)"""
+
+    def __init__(self):
+        self._records = {}
+        self._claims = {}
+        self._lock = threading.Lock()
+
+    def get(self, publish_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(publish_id)
+            return dict(record) if record else None
+
+    def put(self, record: Dict[str, Any], created: bool = False):
+        with self._lock:
+            self._records[record["publish_id"]] = dict(record)
+
+    def list_pending(self) -> List[str]:
+        with self._lock:
+            return [publish_id for publish_id, record in self._records.items() if not record.get("terminal")]
+
+    def get_claim(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            claim = self._claims.get(key)
+            return dict(claim) if claim else None
+
+    def create_claim(self, claim: Dict[str, Any], replace: Optional[Dict[str, Any]] = None) -> bool:
+        """Store claim if the key is unclaimed (or still holds replace); False if it changed"""
+        with self._lock:
+            if self._claims.get(claim["key"]) != replace:
+                return False
+            self._claims[claim["key"]] = dict(claim)
+            return True
+
+    def put_claim(self, claim: Dict[str, Any]):
+        with self._lock:
+            self._claims[claim["key"]] = dict(claim)
+
+    def delete_claim(self, key: str):
+        with self._lock:
+            self._claims.pop(key, None)
+
+
+class S3PublishRecordStore:
+    """Publish records stored as one JSON object each, plus a marker per pending record
+
+    The markers let the poller list only posts that are still processing.
+    Idempotency claims are created with conditional writes (If-None-Match /
+    If-Match), so concurrent retries of a post cannot both claim it.
+    """
+
+    def __init__(self, bucket: str, prefix: str = PUBLISH_RECORD_PREFIX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("s3")
+        return self._client
+
+    def _record_key(self, publish_id: str) -> str:
+        return f"{self.prefix}{publish_id}.json"
+
+    def _pending_key(self, publish_id: str) -> str:
+        return f"{self.prefix}pending/{publish_id}"
+
+    def get(self, publish_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._record_key(publish_id))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response["Body"].read())
+
+    def put(self, record: Dict[str, Any], created: bool = False):
+        """Store a record; created marks the first write of a post, which adds its pending marker"""
+        publish_id = record["publish_id"]
+        self.client.put_object(Bucket=self.bucket, Key=self._record_key(publish_id),
+                               Body=json.dumps(record).encode("utf-8"), ContentType="application/json")
+        if record.get("terminal"):
+            self.client.delete_object(Bucket=self.bucket, Key=self._pending_key(publish_id))
+        elif created:
+            self.client.put_object(Bucket=self.bucket, Key=self._pending_key(publish_id), Body=b"")
+
+    def _claim_key(self, key: str) -> str:
+        return f"{self.prefix}idempotency/{key}.json"
+
+    def get_claim(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._claim_key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        claim = json.loads(response["Body"].read())
+        claim["_etag"] = response.get("ETag")
+        return claim
+
+    def create_claim(self, claim: Dict[str, Any], replace: Optional[Dict[str, Any]] = None) -> bool:
+        """Store claim if the key is unclaimed (or still holds replace); False if it changed"""
+        from botocore.exceptions import ClientError
+        condition = {"IfMatch": replace["_etag"]} if replace else {"IfNoneMatch": "*"}
+        try:
+            self._put_claim(claim, **condition)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return False
+            raise
+        return True
+
+    def put_claim(self, claim: Dict[str, Any]):
+        self._put_claim(claim)
+
+    def _put_claim(self, claim: Dict[str, Any], **condition):
+        body = {k: v for k, v in claim.items() if k != "_etag"}
+        self.client.put_object(Bucket=self.bucket, Key=self._claim_key(claim["key"]),
+                               Body=json.dumps(body).encode("utf-8"), ContentType="application/json",
+                               **condition)
+
+    def delete_claim(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._claim_key(key))
+
+    def list_pending(self) -> List[str]:
+        marker_prefix = self._pending_key("")
+        publish_ids = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=marker_prefix):
+            publish_ids.extend(item["Key"][len(marker_prefix):] for item in page.get("Contents", []))
+        return publish_ids
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def is_shared_store() -> bool:
+    """Whether records and claims are seen by every container (not just this one)"""
+    return bool(PUBLISH_RECORD_BUCKET)
+
+
+def get_record_store():
+    """Publish record store for this container, created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if PUBLISH_RECORD_BUCKET:
+                    _store = S3PublishRecordStore(PUBLISH_RECORD_BUCKET)
+                else:
+                    _store = MemoryPublishRecordStore()
+    return _store
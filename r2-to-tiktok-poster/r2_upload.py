@@ -0,0 +1,219 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import logging
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger()
+
+R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME", "my-tiktok-videos")
+# Path prefix under which the video worker serves R2 objects (https://<worker>/videos/<key>)
+R2_WORKER_PATH_PREFIX = os.getenv("R2_WORKER_PATH_PREFIX", "/videos/")
+
+# Preferred chunk size; clamped to TikTok's limits for each video
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(16 * 1024 * 1024)))
+# Chunks read from R2 ahead of the one being uploaded; memory use is about (this + 1) * chunk size
+UPLOAD_MAX_IN_FLIGHT = int(os.getenv("UPLOAD_MAX_IN_FLIGHT", "3"))
+UPLOAD_CHUNK_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_CHUNK_TIMEOUT_SECONDS", "120"))
+
+# TikTok FILE_UPLOAD limits: chunks of 5-64 MB, the final chunk absorbs the remainder
+# (up to 128 MB), at most 1000 chunks; videos under 5 MB are sent as one chunk
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+MAX_CHUNK_COUNT = 1000
+
+# How PULL_FROM_URL videos are handed to TikTok: "worker" (the URL as given) or
+# "presigned" (a presigned R2 GET URL for the same object, so TikTok pulls straight from R2)
+VIDEO_URL_STRATEGY = os.getenv("VIDEO_URL_STRATEGY", "worker").lower()
+PRESIGNED_URL_TTL_SECONDS = int(os.getenv("PRESIGNED_URL_TTL_SECONDS", "3600"))
+# Presigned URLs are reused until they have less than this long left
+PRESIGNED_URL_REFRESH_SECONDS = int(os.getenv("PRESIGNED_URL_REFRESH_SECONDS", "900"))
+
+_r2_client = None
+_r2_client_lock = threading.Lock()
+_upload_session = None
+_presigned_urls: Dict[str, Tuple[str, float]] = {}
+_presigned_urls_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """A chunk was rejected by TikTok's upload server"""
+
+
+def get_r2_client():
+    """Return the R2 client, creating it once per container"""
+    global _r2_client
+    if _r2_client is None:
+        with _r2_client_lock:
+            if _r2_client is None:
+                import boto3
+                from botocore.config import Config
+                _r2_client = boto3.client(
+                    's3',
+                    endpoint_url=os.environ['R2_ENDPOINT_URL'],
+                    aws_access_key_id=os.environ['R2_ACCESS_KEY_ID'],
+                    aws_secret_access_key=os.environ['R2_SECRET_ACCESS_KEY'],
+                    region_name='auto',
+                    config=Config(signature_version='s3v4')
+                )
+    return _r2_client
+
+def get_upload_session() -> requests.Session:
+    """Session reused for chunk PUTs so they share one connection to the upload host"""
+    global _upload_session
+    if _upload_session is None:
+        _upload_session = requests.Session()
+    return _upload_session
+
+def r2_object_key(video_url: str) -> str:
+    """
+    Object key in R2_BUCKET_NAME for a video URL
+
+    Accepts the video worker URL (https://<worker>/videos/<key>) and
+    path-style R2 URLs (https://<endpoint>/<bucket>/<key>).
+
+    Raises:
+        ValueError: If the URL does not point into the bucket
+    """
+    path = urlparse(video_url).path
+    for prefix in (R2_WORKER_PATH_PREFIX, f"/{R2_BUCKET_NAME}/"):
+        if path.startswith(prefix) and len(path) > len(prefix):
+            return path[len(prefix):]
+    raise ValueError(f"FILE_UPLOAD needs a video in R2 bucket {R2_BUCKET_NAME}. Got: {video_url}")
+
+def presigned_video_url(key: str) -> str:
+    """Presigned R2 GET URL for key, reused until shortly before it expires"""
+    now = time.time()
+    with _presigned_urls_lock:
+        cached = _presigned_urls.get(key)
+        if cached and now < cached[1] - PRESIGNED_URL_REFRESH_SECONDS:
+            return cached[0]
+
+    # Signing is local, no request is made to R2
+    url = get_r2_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': R2_BUCKET_NAME, 'Key': key},
+        ExpiresIn=PRESIGNED_URL_TTL_SECONDS,
+    )
+    with _presigned_urls_lock:
+        for expired in [k for k, (_, expires_at) in _presigned_urls.items() if expires_at <= now]:
+            del _presigned_urls[expired]
+        _presigned_urls[key] = (url, now + PRESIGNED_URL_TTL_SECONDS)
+    return url
+
+def pull_url(video_url: str) -> str:
+    """
+    URL TikTok should pull a video from, according to VIDEO_URL_STRATEGY
+
+    With "presigned", URLs into R2_BUCKET_NAME are swapped for a presigned R2
+    URL of the same object; other URLs are passed through unchanged.
+    """
+    if VIDEO_URL_STRATEGY != "presigned":
+        return video_url
+    try:
+        key = r2_object_key(video_url)
+    except ValueError:
+        return video_url
+    return presigned_video_url(key)
+
+def plan_chunks(video_size: int, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Tuple[int, int]:
+    """
+    Chunk size and count for a video, following TikTok's FILE_UPLOAD rules
+
+    Returns:
+        Tuple of (chunk_size, total_chunk_count); the last chunk also carries
+        the remainder of video_size / chunk_size
+    """
+    if video_size <= 0:
+        raise ValueError("Video is empty")
+    if video_size < MIN_CHUNK_SIZE:
+        return video_size, 1
+
+    chunk_size = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size, video_size))
+    if video_size // chunk_size > MAX_CHUNK_COUNT:
+        chunk_size = -(-video_size // MAX_CHUNK_COUNT)
+        if chunk_size > MAX_CHUNK_SIZE:
+            raise ValueError(f"Video of {video_size} bytes exceeds the FILE_UPLOAD size limit")
+    return chunk_size, video_size // chunk_size
+
+def chunk_ranges(video_size: int, chunk_size: int, total_chunk_count: int) -> List[Tuple[int, int]]:
+    """Inclusive (first, last) byte ranges of each chunk"""
+    ranges = [(index * chunk_size, (index + 1) * chunk_size - 1) for index in range(total_chunk_count)]
+    ranges[-1] = (ranges[-1][0], video_size - 1)
+    return ranges
+
+def describe_video(key: str) -> Dict[str, Any]:
+    """Size and content type of an R2 object plus its chunk plan"""
+    head = get_r2_client().head_object(Bucket=R2_BUCKET_NAME, Key=key)
+    video_size = head['ContentLength']
+    chunk_size, total_chunk_count = plan_chunks(video_size)
+    return {
+        "key": key,
+        "content_type": head.get('ContentType') or "video/mp4",
+        "video_size": video_size,
+        "chunk_size": chunk_size,
+        "total_chunk_count": total_chunk_count,
+    }
+
+def read_range(key: str, first: int, last: int) -> bytes:
+    """Ranged GET of one chunk from R2"""
+    response = get_r2_client().get_object(Bucket=R2_BUCKET_NAME, Key=key, Range=f"bytes={first}-{last}")
+    return response['Body'].read()
+
+def put_chunk(upload_url: str, data: bytes, first: int, last: int, video_size: int, content_type: str):
+    """PUT one chunk to TikTok's upload URL"""
+    response = get_upload_session().put(
+        upload_url,
+        data=data,
+        headers={
+            "Content-Type": content_type,
+            "Content-Length": str(len(data)),
+            "Content-Range": f"bytes {first}-{last}/{video_size}",
+        },
+        timeout=UPLOAD_CHUNK_TIMEOUT_SECONDS,
+    )
+    if response.status_code not in (200, 201, 206):
+        raise UploadError(f"Chunk {first}-{last} upload failed: {response.status_code} - {response.text}")
+
+def upload_video(upload_url: str, video: Dict[str, Any], max_in_flight: int = UPLOAD_MAX_IN_FLIGHT):
+    """
+    Stream an R2 object to TikTok's upload URL chunk by chunk
+
+    TikTok accepts the chunks of an upload only in order, so the PUTs are
+    sequential; up to max_in_flight ranged GETs from R2 run ahead of them,
+    which keeps the upload busy while bounding memory to the chunks read ahead.
+
+    Args:
+        upload_url: upload_url returned by the FILE_UPLOAD init request
+        video: Result of describe_video
+        max_in_flight: Chunks read from R2 ahead of the chunk being uploaded
+    """
+    ranges = chunk_ranges(video["video_size"], video["chunk_size"], video["total_chunk_count"])
+    max_in_flight = max(1, max_in_flight)
+    logger.info(f"Uploading {video['key']} ({video['video_size']} bytes) in {len(ranges)} chunks")
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        reads = {}
+
+        def schedule(index):
+            if index < len(ranges):
+                reads[index] = pool.submit(read_range, video["key"], *ranges[index])
+
+        for index in range(max_in_flight):
+            schedule(index)
+        try:
+            for index, (first, last) in enumerate(ranges):
+                data = reads.pop(index).result()
+                schedule(index + max_in_flight)
+                put_chunk(upload_url, data, first, last, video["video_size"], video["content_type"])
+                del data
+        finally:
+            for future in reads.values():
+                future.cancel()
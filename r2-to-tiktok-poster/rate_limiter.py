@@ -0,0 +1,168 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Tuple, Callable, Mapping
+
+# Per-user quotas of the TikTok Content Posting API (requests per minute per access token)
+DEFAULT_ENDPOINT_LIMITS = {
+    "/v2/post/publish/creator_info/query/": 20,
+    "/v2/post/publish/video/init/": 6,
+    "/v2/post/publish/status/fetch/": 30,
+}
+DEFAULT_USER_LIMIT_PER_MINUTE = int(os.getenv("TIKTOK_USER_RATE_LIMIT_PER_MINUTE", "20"))
+# Per-app budget of this container across all accounts
+APP_RATE_LIMIT_PER_MINUTE = int(os.getenv("TIKTOK_APP_RATE_LIMIT_PER_MINUTE", "600"))
+
+
+class RateLimitExceeded(Exception):
+    """No request slot became available before the caller's deadline"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens/second up to capacity"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token can be taken (0 if one is available now)"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float):
+        """Hold all requests until the server says the quota has reset, then let one through"""
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = max(self.tokens, 1.0)
+
+
+class RateLimiter:
+    """Token buckets per (endpoint, account) and per app, shared by all threads of the container
+
+    acquire() waits for a slot in every applicable bucket instead of failing,
+    up to the caller's deadline; penalize() applies a server-provided Retry-After.
+    """
+
+    def __init__(self, endpoint_limits: Optional[Mapping[str, int]] = None,
+                 default_limit: int = DEFAULT_USER_LIMIT_PER_MINUTE,
+                 app_limit: int = APP_RATE_LIMIT_PER_MINUTE,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.endpoint_limits = dict(DEFAULT_ENDPOINT_LIMITS if endpoint_limits is None else endpoint_limits)
+        self.default_limit = default_limit
+        self.app_limit = app_limit
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, scope: str, key: str, per_minute: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            bucket = self._buckets[(scope, key)] = TokenBucket(per_minute / 60.0, per_minute, now)
+        return bucket
+
+    def _buckets_for(self, endpoint: str, account_key: str, app_key: str, now: float):
+        user_limit = self.endpoint_limits.get(endpoint, self.default_limit)
+        return (self._bucket(endpoint, account_key, user_limit, now),
+                self._bucket("app", app_key, self.app_limit, now))
+
+    def reserve(self, endpoint: str, account_key: str, app_key: str) -> float:
+        """Take a slot if one is free now; otherwise return the seconds until one may be"""
+        with self._lock:
+            now = self.clock()
+            buckets = self._buckets_for(endpoint, account_key, app_key, now)
+            wait = max(bucket.wait_time(now) for bucket in buckets)
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.take(now)
+            return wait
+
+    def _check_deadline(self, endpoint: str, wait: float, deadline: float):
+        if self.clock() + wait > deadline:
+            raise RateLimitExceeded(
+                f"Rate limit for {endpoint} would not reset within the deadline (retry in {wait:.1f}s)", wait
+            )
+
+    def acquire(self, endpoint: str, account_key: str, app_key: str, deadline: float):
+        """Take a slot for one request, waiting if needed; raises RateLimitExceeded past deadline"""
+        while True:
+            wait = self.reserve(endpoint, account_key, app_key)
+            if wait == 0:
+                return
+            self._check_deadline(endpoint, wait, deadline)
+            self.sleep(wait)
+
+    async def acquire_async(self, endpoint: str, account_key: str, app_key: str, deadline: float):
+        """acquire() for coroutines: waits with asyncio.sleep instead of blocking the loop"""
+        while True:
+            wait = self.reserve(endpoint, account_key, app_key)
+            if wait == 0:
+                return
+            self._check_deadline(endpoint, wait, deadline)
+            await asyncio.sleep(wait)
+
+    def penalize(self, endpoint: str, account_key: str, app_key: str, retry_after: float,
+                 app_wide: bool = False):
+        """Block the account's bucket (or the whole app's) for retry_after seconds"""
+        with self._lock:
+            now = self.clock()
+            user_bucket, app_bucket = self._buckets_for(endpoint, account_key, app_key, now)
+            (app_bucket if app_wide else user_bucket).block(now + retry_after)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+def parse_retry_after(headers: Mapping[str, str], now: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds to wait according to Retry-After (delta seconds or HTTP date)
+    or X-RateLimit-Reset (delta seconds or epoch seconds) response headers
+    """
+    now = time.time() if now is None else now
+    lowered = {key.lower(): value for key, value in (headers or {}).items()}
+
+    retry_after = lowered.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+
+    reset = lowered.get("x-ratelimit-reset")
+    if reset:
+        try:
+            value = float(reset)
+        except ValueError:
+            return None
+        # Large values are absolute epoch timestamps rather than a delay
+        return max(0.0, value - now) if value > 1e9 else max(0.0, value)
+    return None
@@ -0,0 +1,59 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import logging
+from lambda_function import poll_publish_statuses, flush_token_store, STATUS_POLL_CONCURRENCY
+from publish_records import get_record_store
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Stop starting new polls when less than this much of the invocation is left
+STATUS_POLL_TIME_RESERVE_MS = int(os.getenv("STATUS_POLL_TIME_RESERVE_MS", "5000"))
+
+
+@flush_token_store
+def lambda_handler(event, context):
+    """
+    AWS Lambda handler for scheduled (EventBridge) publish status polling
+
+    Polls every pending publish record whose backoff delay has elapsed,
+    STATUS_POLL_CONCURRENCY at a time, and records the final result once
+    TikTok reports a terminal status.
+    Reads the records the poster shares through PUBLISH_RECORD_BUCKET.
+
+    Returns:
+    - completed: publish_ids that reached a terminal status in this run
+    - pending: number of records still processing
+    - errors: publish_ids whose status fetch failed
+    """
+    completed = []
+    errors = []
+    pending = 0
+
+    publish_ids = get_record_store().list_pending()
+    # Poll in rounds of concurrent fetches so the time check still applies between rounds
+    for start in range(0, len(publish_ids), STATUS_POLL_CONCURRENCY):
+        chunk = publish_ids[start:start + STATUS_POLL_CONCURRENCY]
+        if context is not None and context.get_remaining_time_in_millis() < STATUS_POLL_TIME_RESERVE_MS:
+            pending += len(publish_ids) - start
+            break
+
+        for publish_id, record in poll_publish_statuses(chunk).items():
+            if isinstance(record, Exception):
+                logger.error(f"Failed to poll publish {publish_id}: {str(record)}")
+                errors.append(publish_id)
+                pending += 1
+            elif record and record.get('terminal'):
+                completed.append(publish_id)
+                logger.info(f"Publish {publish_id} finished with status {record.get('status')}")
+            elif record:
+                pending += 1
+
+    return {
+        'completed': completed,
+        'pending': pending,
+        'errors': errors
+    }
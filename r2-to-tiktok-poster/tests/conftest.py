@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import lambda_function
+import publish_records
+from rate_limiter import RateLimiter
+
+
+@pytest.fixture(autouse=True)
+def clear_creator_info_cache(monkeypatch):
+    monkeypatch.setattr(lambda_function, "CREATOR_INFO_CACHE_FILE", "")
+    lambda_function.invalidate_creator_info()
+    lambda_function.invalidate_access_token()
+    lambda_function._tiktok_resilience.reset()
+    lambda_function._token_api_resilience.reset()
+    yield
+    lambda_function.invalidate_creator_info()
+    lambda_function.invalidate_access_token()
+
+
+@pytest.fixture(autouse=True)
+def memory_publish_records(monkeypatch):
+    store = publish_records.MemoryPublishRecordStore()
+    monkeypatch.setattr(publish_records, "_store", store)
+    return store
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiter(monkeypatch):
+    limiter = RateLimiter()
+    monkeypatch.setattr(lambda_function, "_rate_limiter", limiter)
+    return limiter
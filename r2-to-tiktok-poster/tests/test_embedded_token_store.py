@@ -0,0 +1,54 @@
+import time
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import lambda_function
+
+
+@pytest.fixture
+def embedded_store(monkeypatch, tmp_path):
+    monkeypatch.setattr(lambda_function, 'TOKEN_STORE_MODE', 'embedded')
+    token_store_class = lambda_function.get_token_store()
+
+    import token_store
+    from token_backends import SQLiteBackend
+    monkeypatch.setattr(token_store, '_backend', SQLiteBackend(str(tmp_path / 'tokens.sqlite3')))
+    token_store.TokenStore.clear_cache()
+    yield token_store_class
+    token_store.TokenStore.clear_cache()
+
+
+class TestEmbeddedTokenStore:
+
+    @patch('lambda_function.get_token_api_session')
+    def test_reads_tokens_in_process(self, mock_session, embedded_store):
+        embedded_store.save_token({'access_token': 'act.a', 'expires_at': time.time() + 3600}, 'user_a')
+
+        assert lambda_function.get_access_token('user_a') == 'act.a'
+        assert lambda_function.get_access_token('missing') is None
+        mock_session.assert_not_called()
+
+    @patch('requests.post')
+    def test_refreshes_expired_token_like_the_api(self, mock_post, embedded_store):
+        refreshed = MagicMock(status_code=200)
+        refreshed.json.return_value = {'access_token': 'act.new', 'refresh_token': 'rft.new', 'expires_in': 3600}
+        mock_post.return_value = refreshed
+        embedded_store.save_token({'access_token': 'act.old', 'refresh_token': 'rft.old',
+                                   'expires_at': time.time() - 1}, 'user_a')
+
+        assert lambda_function.get_access_tokens(['user_a', 'missing']) == {'user_a': 'act.new', 'missing': None}
+        assert embedded_store.load_token('user_a')['refresh_token'] == 'rft.new'
+
+    @patch('lambda_function.get_token_api_session')
+    def test_falls_back_to_http_when_store_fails(self, mock_session, embedded_store, monkeypatch):
+        monkeypatch.setattr(embedded_store, 'get_token', MagicMock(side_effect=RuntimeError('AccessDenied')))
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = MagicMock(status_code=200)
+        mock_get.return_value.json.return_value = {'access_token': 'act.http'}
+
+        assert lambda_function.get_access_token('user_a') == 'act.http'
+
+    def test_http_mode_does_not_load_the_store(self):
+        assert lambda_function.TOKEN_STORE_MODE == 'http'
+        assert lambda_function.get_token_store() is None
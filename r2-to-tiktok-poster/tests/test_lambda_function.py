@@ -2,9 +2,16 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dependencies'))
 
+import asyncio
 import json
+import base64
+import threading
+import time
+import httpx
 import pytest
 from unittest.mock import patch, MagicMock
+import publish_records
+import lambda_function
 from lambda_function import lambda_handler, get_access_token, make_tiktok_api_request, query_creator_info, prepare_video_source
 
 
@@ -51,34 +58,48 @@ class TestR2ToTikTokPoster:
         assert response_body['success'] is False
         assert 'r2_video_url, open_id, and title are required' in response_body['error']
 
-    @patch('lambda_function.requests.get')
-    def test_get_access_token_success(self, mock_requests_get):
+    def test_lambda_handler_base64_encoded_body(self):
+        event = {
+            'body': base64.b64encode(json.dumps({
+                'r2_video_url': 'https://r2-endpoint.com/test.mp4'
+            }).encode('utf-8')).decode('ascii'),
+            'isBase64Encoded': True
+        }
+
+        result = lambda_handler(event, {})
+
+        assert result['statusCode'] == 400
+        assert 'r2_video_url, open_id, and title are required' in json.loads(result['body'])['error']
+
+    @patch('lambda_function.get_token_api_session')
+    def test_get_access_token_success(self, mock_session):
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.json.return_value = {'access_token': 'test-token'}
-        mock_requests_get.return_value = mock_response
+        mock_session.return_value.get.return_value = mock_response
 
         token = get_access_token('test-open-id')
 
         assert token == 'test-token'
-        mock_requests_get.assert_called_once_with(
-            'https://6kg6mdmiz6.execute-api.ap-northeast-1.amazonaws.com/prod/token/test-open-id'
+        mock_session.return_value.get.assert_called_once_with(
+            'https://6kg6mdmiz6.execute-api.ap-northeast-1.amazonaws.com/prod/token/test-open-id',
+            timeout=lambda_function.DEFAULT_TIMEOUT
         )
 
-    @patch('lambda_function.requests.post')
-    def test_make_tiktok_api_request_success(self, mock_requests_post):
+    @patch('lambda_function.get_tiktok_client')
+    def test_make_tiktok_api_request_success(self, mock_client):
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.json.return_value = {
             'error': {'code': 'ok'},
             'data': {'publish_id': 'test-id'}
         }
-        mock_requests_post.return_value = mock_response
+        mock_client.return_value.post.return_value = mock_response
 
         result = make_tiktok_api_request('/test/endpoint', {'test': 'data'}, 'test-token')
 
         assert result['data']['publish_id'] == 'test-id'
-        mock_requests_post.assert_called_once()
+        mock_client.return_value.post.assert_called_once()
 
     @patch('lambda_function.make_tiktok_api_request')
     def test_query_creator_info_success(self, mock_make_api_request):
@@ -104,6 +125,31 @@ class TestR2ToTikTokPoster:
         with pytest.raises(ValueError, match="Only URL sources are supported"):
             prepare_video_source('/local/path/video.mp4')
 
+    @patch('lambda_function.upload_video')
+    @patch('lambda_function.describe_video')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_file_upload_source_streams_from_r2(self, mock_api, mock_describe, mock_upload):
+        video = {'key': 'test.mp4', 'content_type': 'video/mp4', 'video_size': 50_000_000,
+                 'chunk_size': 16_777_216, 'total_chunk_count': 2}
+        mock_describe.return_value = video
+        mock_api.return_value = {'error': {'code': 'ok'},
+                                 'data': {'publish_id': 'p1', 'upload_url': 'https://upload.example/u'}}
+
+        publish_id = lambda_function.post_video_to_tiktok(
+            access_token='test-token', title='t', video_path='https://r2-endpoint.com/my-tiktok-videos/test.mp4',
+            creator_info={'privacy_level_options': ['SELF_ONLY']}, video_source='file_upload')
+
+        assert publish_id == 'p1'
+        mock_describe.assert_called_once_with('test.mp4')
+        assert mock_api.call_args[0][1]['source_info'] == {
+            'source': 'FILE_UPLOAD', 'video_size': 50_000_000, 'chunk_size': 16_777_216, 'total_chunk_count': 2
+        }
+        mock_upload.assert_called_once_with('https://upload.example/u', video)
+
+    def test_prepare_video_source_rejects_unknown_source(self):
+        with pytest.raises(ValueError, match="Unsupported video_source"):
+            prepare_video_source('https://example.com/video.mp4', 'INLINE')
+
     @patch('lambda_function.get_access_token')
     @patch('lambda_function.make_tiktok_api_request')
     def test_lambda_handler_invalid_privacy_level(self, mock_make_api_request, mock_get_access_token):
@@ -150,5 +196,549 @@ class TestR2ToTikTokPoster:
         assert 'Only URL sources are supported' in response_body['error']
 
 
+class TestCreatorInfoCache:
+
+    CREATOR_INFO = {'data': {'privacy_level_options': ['PUBLIC_TO_EVERYONE', 'SELF_ONLY']}}
+
+    def _event(self, privacy_level='SELF_ONLY', title='Test video title #test'):
+        return {
+            'body': json.dumps({
+                'r2_video_url': 'https://r2-endpoint.com/my-tiktok-videos/test.mp4',
+                'open_id': 'test-open-id',
+                'title': title,
+                'privacy_level': privacy_level
+            })
+        }
+
+    def _api(self, endpoint, data, access_token):
+        if endpoint == '/v2/post/publish/creator_info/query/':
+            return self.CREATOR_INFO
+        if endpoint == '/v2/post/publish/video/init/':
+            return {'data': {'publish_id': 'test-publish-id'}}
+        return {'data': {'status': 'PROCESSING_UPLOAD'}}
+
+    @staticmethod
+    def _endpoints(mock_api):
+        return [c.args[0] for c in mock_api.call_args_list]
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_creator_info_is_queried_once_across_posts(self, mock_api, mock_token, mock_sleep):
+        mock_api.side_effect = self._api
+
+        for i in range(3):
+            assert lambda_handler(self._event(title=f'Video {i}'), {})['statusCode'] == 200
+
+        assert self._endpoints(mock_api).count('/v2/post/publish/creator_info/query/') == 1
+        assert self._endpoints(mock_api).count('/v2/post/publish/video/init/') == 3
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_creator_info_expires_after_ttl(self, mock_api, mock_token, mock_sleep, monkeypatch):
+        mock_api.side_effect = self._api
+        monkeypatch.setattr(lambda_function, 'CREATOR_INFO_TTL_SECONDS', 0)
+
+        lambda_handler(self._event(title='First'), {})
+        lambda_handler(self._event(title='Second'), {})
+
+        assert self._endpoints(mock_api).count('/v2/post/publish/creator_info/query/') == 2
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_stale_cached_privacy_options_are_refreshed(self, mock_api, mock_token, mock_sleep):
+        mock_api.side_effect = self._api
+        lambda_handler(self._event(), {})
+
+        # The creator opened their account to the public after we cached their settings
+        self.CREATOR_INFO = {'data': {'privacy_level_options': ['PUBLIC_TO_EVERYONE', 'MUTUAL_FOLLOW_FRIENDS', 'SELF_ONLY']}}
+        result = lambda_handler(self._event('MUTUAL_FOLLOW_FRIENDS', title='Another video'), {})
+
+        assert result['statusCode'] == 200
+        assert self._endpoints(mock_api).count('/v2/post/publish/creator_info/query/') == 2
+
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_rejected_init_retries_once_with_fresh_creator_info(self, mock_api):
+        calls = []
+
+        def api(endpoint, data, access_token):
+            calls.append(endpoint)
+            if endpoint == '/v2/post/publish/video/init/' and calls.count(endpoint) == 1:
+                raise lambda_function.TikTokAPIError('API error: mismatch', code='privacy_level_option_mismatch')
+            return self._api(endpoint, data, access_token)
+
+        mock_api.side_effect = api
+        lambda_function.get_creator_info('test-open-id', 'test-access-token')
+
+        publish_id = lambda_function.post_video_for_account(
+            'test-open-id', 'test-access-token',
+            title='t', video_path='https://example.com/video.mp4', privacy_level='SELF_ONLY'
+        )
+
+        assert publish_id == 'test-publish-id'
+        assert calls == ['/v2/post/publish/creator_info/query/', '/v2/post/publish/video/init/',
+                         '/v2/post/publish/creator_info/query/', '/v2/post/publish/video/init/']
+
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_cache_is_persisted_to_file(self, mock_api, monkeypatch, tmp_path):
+        mock_api.return_value = self.CREATOR_INFO
+        monkeypatch.setattr(lambda_function, 'CREATOR_INFO_CACHE_FILE', str(tmp_path / 'creator_info.json'))
+        lambda_function.get_creator_info('test-open-id', 'test-access-token')
+
+        # Simulate a new container reading the same file
+        lambda_function._creator_info_cache.clear()
+        monkeypatch.setattr(lambda_function, '_creator_info_file_loaded', False)
+        info = lambda_function.get_creator_info('test-open-id', 'test-access-token')
+
+        assert info['privacy_level_options'] == ['PUBLIC_TO_EVERYONE', 'SELF_ONLY']
+        assert mock_api.call_count == 1
+
+
+class TestPublishStatusTracking:
+
+    def _post_event(self, **extra):
+        return {
+            'body': json.dumps(dict({
+                'r2_video_url': 'https://r2-endpoint.com/my-tiktok-videos/test.mp4',
+                'open_id': 'test-open-id',
+                'title': 'Test video title #test'
+            }, **extra))
+        }
+
+    def _status_event(self, publish_id, **query):
+        return {'httpMethod': 'GET', 'resource': '/status/{publish_id}',
+                'pathParameters': {'publish_id': publish_id}, 'queryStringParameters': query or None}
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_returns_immediately_without_status_fetch(self, mock_api, mock_token, mock_sleep):
+        mock_api.side_effect = [
+            {'data': {'privacy_level_options': ['SELF_ONLY']}},
+            {'data': {'publish_id': 'test-publish-id'}},
+        ]
+
+        result = lambda_handler(self._post_event(wait_for_status=False), {})
+
+        assert result['statusCode'] == 202
+        assert json.loads(result['body'])['publish_id'] == 'test-publish-id'
+        mock_sleep.assert_not_called()
+        assert mock_api.call_count == 2
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.get_post_status')
+    def test_status_route_polls_with_backoff_until_terminal(self, mock_status, mock_token, memory_publish_records):
+        lambda_function.track_publish('test-publish-id', 'test-open-id')
+        mock_status.side_effect = [
+            {'status': 'PROCESSING_UPLOAD'},
+            {'status': 'PUBLISH_COMPLETE', 'uploaded_at': '2023-01-01T00:00:00Z'},
+        ]
+
+        first = json.loads(lambda_handler(self._status_event('test-publish-id', refresh='true'), {})['body'])
+        assert first['status'] == 'PROCESSING_UPLOAD'
+        assert first['terminal'] is False
+
+        # Not due yet: answered from the record without calling TikTok
+        again = json.loads(lambda_handler(self._status_event('test-publish-id'), {})['body'])
+        assert again['status'] == 'PROCESSING_UPLOAD'
+        assert mock_status.call_count == 1
+
+        final = json.loads(lambda_handler(self._status_event('test-publish-id', refresh='true'), {})['body'])
+        assert final['status'] == 'PUBLISH_COMPLETE'
+        assert final['terminal'] is True
+        assert memory_publish_records.list_pending() == []
+
+        lambda_handler(self._status_event('test-publish-id', refresh='true'), {})
+        assert mock_status.call_count == 2
+
+    def test_status_route_unknown_publish_id(self):
+        result = lambda_handler(self._status_event('missing'), {})
+
+        assert result['statusCode'] == 404
+
+    @patch('lambda_function.get_access_token', return_value='fresh-token')
+    @patch('lambda_function.get_access_tokens')
+    @patch('lambda_function.get_post_status_async')
+    def test_poll_many_fetches_tokens_once_and_retries_rejected_token(self, mock_status, mock_tokens,
+                                                                        mock_token, memory_publish_records):
+        for publish_id, open_id in (('p1', 'user_a'), ('p2', 'user_a'), ('p3', 'user_b')):
+            lambda_function.track_publish(publish_id, open_id)
+        mock_tokens.return_value = {'user_a': 'token-a', 'user_b': 'stale-token'}
+
+        async def fetch_status(token, publish_id):
+            if token == 'stale-token':
+                raise lambda_function.TikTokAPIError('expired', status_code=401)
+            return {'status': 'PUBLISH_COMPLETE'}
+        mock_status.side_effect = fetch_status
+
+        results = lambda_function.poll_publish_statuses(['p1', 'p2', 'p3', 'missing'], force=True)
+
+        assert {publish_id: record and record['status'] for publish_id, record in results.items()} == {
+            'p1': 'PUBLISH_COMPLETE', 'p2': 'PUBLISH_COMPLETE', 'p3': 'PUBLISH_COMPLETE', 'missing': None
+        }
+        mock_tokens.assert_called_once_with(['user_a', 'user_b'])
+        mock_token.assert_called_once_with('user_b', force=True)
+        assert memory_publish_records.list_pending() == []
+
+
+class TestBatchPosting:
+
+    def _item(self, open_id, **extra):
+        return dict({'r2_video_url': 'https://r2-endpoint.com/v.mp4', 'open_id': open_id, 'title': f'Video for {open_id}'}, **extra)
+
+    @patch('lambda_function.get_access_tokens')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_posts_items_with_shared_lookups(self, mock_api, mock_tokens):
+        mock_tokens.side_effect = lambda open_ids: {open_id: f'token-{open_id}' for open_id in open_ids if open_id != 'no_token'}
+        publish_ids = iter(range(100))
+        lock = threading.Lock()
+
+        def api(endpoint, data, access_token):
+            if endpoint == '/v2/post/publish/creator_info/query/':
+                return {'data': {'privacy_level_options': ['SELF_ONLY']}}
+            with lock:
+                return {'data': {'publish_id': f'p{next(publish_ids)}'}}
+
+        mock_api.side_effect = api
+        items = [self._item('user_a'), self._item('user_b'), self._item('user_a', title='Second video for user_a'),
+                 self._item('no_token'), {'open_id': 'user_c'}, self._item('user_b', r2_video_url='/local.mp4')]
+
+        result = lambda_handler({'body': json.dumps({'items': items})}, {})
+
+        assert result['statusCode'] == 200
+        body = json.loads(result['body'])
+        assert [r['success'] for r in body['results']] == [True, True, True, False, False, False]
+        assert [r['index'] for r in body['results']] == list(range(6))
+        assert body['failed'] == 3
+        mock_tokens.assert_called_once_with(['user_a', 'user_b', 'no_token'])
+        endpoints = [c.args[0] for c in mock_api.call_args_list]
+        assert endpoints.count('/v2/post/publish/creator_info/query/') == 2
+        assert endpoints.count('/v2/post/publish/video/init/') == 3
+        assert lambda_function.get_record_store().get(body['results'][0]['publish_id'])['open_id'] == 'user_a'
+
+    @patch('lambda_function.get_access_tokens')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_presign_failure_fails_only_its_item(self, mock_api, mock_tokens, monkeypatch):
+        import r2_upload
+        monkeypatch.setattr(r2_upload, 'VIDEO_URL_STRATEGY', 'presigned')
+        monkeypatch.setattr(r2_upload, '_r2_client', None)
+        monkeypatch.setattr(r2_upload, '_presigned_urls', {})
+        monkeypatch.delenv('R2_ENDPOINT_URL', raising=False)
+        mock_tokens.side_effect = lambda open_ids: {open_id: f'token-{open_id}' for open_id in open_ids}
+        mock_api.side_effect = lambda endpoint, data, access_token: (
+            {'data': {'privacy_level_options': ['SELF_ONLY']}} if endpoint == '/v2/post/publish/creator_info/query/'
+            else {'data': {'publish_id': 'p1'}})
+        items = [self._item('user_a', r2_video_url='https://r2-endpoint.com/my-tiktok-videos/v.mp4'),
+                 self._item('user_b', r2_video_url='https://example.com/v.mp4')]
+
+        result = lambda_handler({'body': json.dumps({'items': items})}, {})
+
+        assert result['statusCode'] == 200
+        assert [r['success'] for r in json.loads(result['body'])['results']] == [False, True]
+        init = [c.args[1] for c in mock_api.call_args_list if c.args[0] == '/v2/post/publish/video/init/']
+        assert init[0]['source_info']['video_url'] == 'https://example.com/v.mp4'
+
+    def test_rejects_oversized_batch(self, monkeypatch):
+        monkeypatch.setattr(lambda_function, 'POST_BATCH_MAX_ITEMS', 2)
+
+        result = lambda_handler({'body': json.dumps({'items': [self._item('a')] * 3})}, {})
+
+        assert result['statusCode'] == 400
+
+    @patch('lambda_function.get_token_api_session')
+    def test_get_access_tokens_uses_batch_route(self, mock_session):
+        mock_post = mock_session.return_value.post
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.return_value = {
+            'results': {'user_a': {'access_token': 'act.a'}, 'user_b': {'error': 'not_found'}}
+        }
+
+        assert lambda_function.get_access_tokens(['user_a', 'user_b']) == {'user_a': 'act.a', 'user_b': None}
+        assert mock_post.call_args.args[0].endswith('/tokens/batch')
+
+
+class TestAccessTokenCache:
+
+    def _token_response(self, access_token, expires_in):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {'access_token': access_token, 'expires_at': time.time() + expires_in}
+        return response
+
+    @patch('lambda_function.get_token_api_session')
+    def test_reuses_token_until_shortly_before_expiry(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = self._token_response('act.a', 3600)
+
+        assert [get_access_token('user_a') for _ in range(3)] == ['act.a'] * 3
+        assert mock_get.call_count == 1
+
+        # Inside the skew window the token is fetched again
+        mock_get.return_value = self._token_response('act.b', 60)
+        lambda_function.invalidate_access_token('user_a')
+        get_access_token('user_a')
+        get_access_token('user_a')
+        assert mock_get.call_count == 3
+
+    @patch('lambda_function.get_token_api_session')
+    def test_batch_fetches_only_uncached_tokens(self, mock_session):
+        mock_session.return_value.get.return_value = self._token_response('act.a', 3600)
+        get_access_token('user_a')
+        mock_post = mock_session.return_value.post
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.return_value = {'results': {'user_b': {'access_token': 'act.b'}}}
+
+        assert lambda_function.get_access_tokens(['user_a', 'user_b']) == {'user_a': 'act.a', 'user_b': 'act.b'}
+        assert mock_post.call_args.kwargs['json'] == {'open_ids': ['user_b']}
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.get_token_api_session')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_401_invalidates_token_and_retries_once(self, mock_api, mock_session, mock_sleep):
+        mock_session.return_value.get.side_effect = [self._token_response('act.revoked', 3600),
+                                                     self._token_response('act.new', 3600)]
+
+        def api(endpoint, data, access_token):
+            if access_token == 'act.revoked':
+                raise lambda_function.TikTokAPIError('API request failed: 401', code='access_token_invalid', status_code=401)
+            if endpoint == '/v2/post/publish/creator_info/query/':
+                return {'data': {'privacy_level_options': ['SELF_ONLY']}}
+            if endpoint == '/v2/post/publish/video/init/':
+                return {'data': {'publish_id': 'p1'}}
+            return {'data': {'status': 'PROCESSING_UPLOAD'}}
+
+        mock_api.side_effect = api
+        result = lambda_handler({'body': json.dumps({
+            'r2_video_url': 'https://r2-endpoint.com/v.mp4', 'open_id': 'user_a', 'title': 't'
+        })}, {})
+
+        assert result['statusCode'] == 200
+        assert mock_session.return_value.get.call_count == 2
+        assert mock_session.return_value.get.call_args.args[0].endswith('/token/user_a?refresh=true')
+        assert get_access_token('user_a') == 'act.new'
+
+    @patch('lambda_function.get_token_api_session')
+    def test_401_with_unchanged_token_is_not_retried(self, mock_session):
+        mock_session.return_value.get.return_value = self._token_response('act.revoked', 3600)
+        operation = MagicMock(side_effect=lambda_function.TikTokAPIError('API request failed: 401', status_code=401))
+
+        with pytest.raises(lambda_function.TikTokAPIError, match='no fresh token'):
+            lambda_function.call_with_token_retry('user_a', 'act.revoked', operation)
+
+        assert operation.call_count == 1
+
+
+
+class TestIdempotentPosting:
+
+    def _event(self, **extra):
+        return {'body': json.dumps(dict({
+            'r2_video_url': 'https://r2-endpoint.com/my-tiktok-videos/test.mp4',
+            'open_id': 'test-open-id',
+            'title': 'Test video title #test',
+            'wait_for_status': False
+        }, **extra))}
+
+    def _api(self, endpoint, data, access_token):
+        if endpoint == '/v2/post/publish/creator_info/query/':
+            return {'data': {'privacy_level_options': ['SELF_ONLY']}}
+        return {'data': {'publish_id': f'p{self.inits}'}}
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_repeat_returns_earlier_publish_id(self, mock_api, mock_token):
+        self.inits = 0
+        mock_api.side_effect = self._api
+
+        first = json.loads(lambda_handler(self._event(), {})['body'])
+        repeat = lambda_handler(self._event(), {})
+
+        assert repeat['statusCode'] == 200
+        body = json.loads(repeat['body'])
+        assert body['publish_id'] == first['publish_id']
+        assert body['duplicate'] is True
+        endpoints = [c.args[0] for c in mock_api.call_args_list]
+        assert endpoints.count('/v2/post/publish/video/init/') == 1
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_caller_key_overrides_content_identity(self, mock_api, mock_token):
+        self.inits = 0
+        mock_api.side_effect = self._api
+
+        lambda_handler(self._event(idempotency_key='job-1'), {})
+        repeat = json.loads(lambda_handler(self._event(idempotency_key='job-1', title='Edited title'), {})['body'])
+        other = json.loads(lambda_handler(self._event(idempotency_key='job-2'), {})['body'])
+
+        assert repeat['duplicate'] is True
+        assert 'duplicate' not in other
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_rejected_post_releases_claim(self, mock_api, mock_token):
+        mock_api.side_effect = [{'data': {'privacy_level_options': ['SELF_ONLY']}},
+                                lambda_function.TikTokAPIError('boom', status_code=400),
+                                {'data': {'publish_id': 'p1'}}]
+
+        assert lambda_handler(self._event(), {})['statusCode'] == 500
+        retry = lambda_handler(self._event(), {})
+
+        assert retry['statusCode'] == 202
+        assert json.loads(retry['body'])['publish_id'] == 'p1'
+
+    @pytest.mark.parametrize('error', [httpx.ReadTimeout('timed out'),
+                                       lambda_function.TikTokAPIError('boom', status_code=500)])
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_post_with_unknown_outcome_keeps_claim(self, mock_api, mock_token, error):
+        mock_api.side_effect = [{'data': {'privacy_level_options': ['SELF_ONLY']}}, error]
+
+        assert lambda_handler(self._event(), {})['statusCode'] == 500
+        retry = lambda_handler(self._event(), {})
+
+        assert retry['statusCode'] == 409
+        endpoints = [c.args[0] for c in mock_api.call_args_list]
+        assert endpoints.count('/v2/post/publish/video/init/') == 1
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_in_progress_and_expired_claims(self, mock_api, mock_token, memory_publish_records):
+        self.inits = 0
+        mock_api.side_effect = self._api
+        key = lambda_function.idempotency_key('test-open-id', 'https://r2-endpoint.com/my-tiktok-videos/test.mp4',
+                                              'Test video title #test')
+        memory_publish_records.put_claim({'key': key, 'open_id': 'test-open-id', 'publish_id': None,
+                                          'created_at': time.time()})
+
+        in_progress = lambda_handler(self._event(), {})
+        assert in_progress['statusCode'] == 409
+        assert 'Retry-After' in in_progress['headers']
+
+        # Past the window the old post no longer counts as a repeat
+        memory_publish_records.put_claim({'key': key, 'open_id': 'test-open-id', 'publish_id': 'old',
+                                          'created_at': time.time() - lambda_function.IDEMPOTENCY_WINDOW_SECONDS - 1})
+        fresh = lambda_handler(self._event(), {})
+        assert fresh['statusCode'] == 202
+        assert memory_publish_records.get_claim(key)['publish_id'] == json.loads(fresh['body'])['publish_id']
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_without_shared_store_posts_are_not_claimed(self, mock_api, mock_token, monkeypatch):
+        self.inits = 0
+        mock_api.side_effect = self._api
+        monkeypatch.setattr(publish_records, 'PUBLISH_RECORD_BUCKET', '')
+
+        lambda_handler(self._event(), {})
+        repeat = json.loads(lambda_handler(self._event(), {})['body'])
+
+        assert 'duplicate' not in repeat
+        endpoints = [c.args[0] for c in mock_api.call_args_list]
+        assert endpoints.count('/v2/post/publish/video/init/') == 2
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.get_post_status', side_effect=lambda_function.TikTokAPIError('boom', status_code=500))
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.make_tiktok_api_request')
+    def test_post_is_tracked_when_status_fetch_fails(self, mock_api, mock_token, mock_status, mock_sleep,
+                                                     memory_publish_records):
+        self.inits = 0
+        mock_api.side_effect = self._api
+
+        result = lambda_handler(self._event(wait_for_status=True), {})
+
+        assert result['statusCode'] == 500
+        assert memory_publish_records.list_pending() == ['p0']
+
+
+class TestBulkStatus:
+
+    @patch('lambda_function.get_access_tokens')
+    @patch('lambda_function.get_post_status_async')
+    def test_groups_by_account_and_returns_compact_map(self, mock_status, mock_tokens):
+        mock_tokens.side_effect = lambda open_ids: {open_id: f'token-{open_id}' for open_id in open_ids
+                                                    if open_id != 'no_token'}
+        in_flight = []
+        peak = []
+
+        async def fetch_status(token, publish_id):
+            in_flight.append(publish_id)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(publish_id)
+            if publish_id == 'broken':
+                raise lambda_function.TikTokAPIError('API error: boom', status_code=500)
+            return {'status': 'PUBLISH_COMPLETE' if token == 'token-user_a' else 'PROCESSING_UPLOAD',
+                    'fail_reason': None}
+        mock_status.side_effect = fetch_status
+
+        posts = [{'open_id': 'user_a', 'publish_id': f'a{i}'} for i in range(20)]
+        posts += [{'open_id': 'user_b', 'publish_id': 'b0'}, {'open_id': 'user_b', 'publish_id': 'broken'},
+                  {'open_id': 'no_token', 'publish_id': 'n0'}]
+        with patch.object(lambda_function, 'STATUS_POLL_CONCURRENCY', 4):
+            result = lambda_handler({'body': json.dumps({'posts': posts})}, {})
+
+        assert result['statusCode'] == 200
+        body = json.loads(result['body'])
+        assert body['statuses']['a0'] == {'status': 'PUBLISH_COMPLETE'}
+        assert body['statuses']['b0'] == {'status': 'PROCESSING_UPLOAD'}
+        assert set(body['errors']) == {'broken', 'n0'}
+        assert body['success'] is False
+        mock_tokens.assert_called_once_with(['user_a', 'user_b', 'no_token'])
+        assert mock_status.call_count == 22
+        assert max(peak) <= 4
+
+    def test_rejects_invalid_posts(self, monkeypatch):
+        assert lambda_handler({'body': json.dumps({'posts': [{'open_id': 'user_a'}]})}, {})['statusCode'] == 400
+
+        monkeypatch.setattr(lambda_function, 'STATUS_BULK_MAX_ITEMS', 1)
+        posts = [{'open_id': 'user_a', 'publish_id': 'p1'}, {'open_id': 'user_a', 'publish_id': 'p2'}]
+        assert lambda_handler({'body': json.dumps({'posts': posts})}, {})['statusCode'] == 400
+
+
+class TestTikTokResilience:
+
+    def _response(self, status_code, body=None):
+        response = MagicMock(status_code=status_code, headers={}, text='')
+        response.json.return_value = body or {'error': {'code': 'ok'}, 'data': {'publish_id': 'p1'}}
+        return response
+
+    @pytest.fixture(autouse=True)
+    def no_backoff_sleep(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr(lambda_function, '_tiktok_resilience',
+                            lambda_function.Resilience('tiktok', sleep=sleeps.append))
+        return sleeps
+
+    @patch('lambda_function.get_tiktok_client')
+    def test_reads_are_retried_but_init_is_not(self, mock_client, no_backoff_sleep):
+        post = mock_client.return_value.post
+        post.side_effect = [self._response(503), self._response(200)]
+        assert make_tiktok_api_request('/v2/post/publish/status/fetch/', {}, 'token')['data']
+        assert post.call_count == 2
+        assert len(no_backoff_sleep) == 1
+
+        post.reset_mock()
+        post.side_effect = [self._response(503), self._response(200)]
+        with pytest.raises(lambda_function.TikTokAPIError) as error:
+            make_tiktok_api_request('/v2/post/publish/video/init/', {}, 'token')
+        assert error.value.status_code == 503
+        assert post.call_count == 1
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.get_tiktok_client')
+    def test_open_circuit_fails_fast_with_503(self, mock_client, mock_token):
+        breaker = lambda_function._tiktok_resilience.breaker
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        result = lambda_handler({'body': json.dumps({
+            'r2_video_url': 'https://r2-endpoint.com/v.mp4', 'open_id': 'user_a', 'title': 't'
+        })}, {})
+
+        assert result['statusCode'] == 503
+        assert 'Retry-After' in result['headers']
+        mock_client.return_value.post.assert_not_called()
+
 if __name__ == '__main__':
     pytest.main([__file__])
@@ -0,0 +1,130 @@
+import time
+from io import BytesIO
+from unittest.mock import patch, MagicMock
+
+import lambda_function
+import publish_records
+import status_poller
+from publish_records import new_record, apply_status, is_due, claim_idempotency, S3PublishRecordStore
+
+
+def _s3_store():
+    objects = {}
+    client = MagicMock()
+    client.put_object.side_effect = lambda Bucket, Key, Body, **kwargs: objects.__setitem__(Key, Body)
+    client.delete_object.side_effect = lambda Bucket, Key: objects.pop(Key, None)
+    client.get_object.side_effect = lambda Bucket, Key: {'Body': BytesIO(objects[Key])}
+    client.get_paginator.return_value.paginate.side_effect = lambda Bucket, Prefix: [
+        {'Contents': [{'Key': key} for key in sorted(objects) if key.startswith(Prefix)]}
+    ]
+    return S3PublishRecordStore('bucket', prefix='publish_records/', client=client)
+
+
+class TestPublishRecords:
+
+    def test_backoff_doubles_until_capped(self, monkeypatch):
+        monkeypatch.setattr(publish_records, 'STATUS_POLL_BASE_DELAY', 2)
+        monkeypatch.setattr(publish_records, 'STATUS_POLL_MAX_DELAY', 10)
+        record = new_record('p1', 'user_a', now=0)
+
+        delays = []
+        for now in (10, 20, 30, 40):
+            apply_status(record, {'status': 'PROCESSING_UPLOAD'}, now=now)
+            delays.append(record['next_check_at'] - now)
+
+        assert delays == [4, 8, 10, 10]
+        assert not is_due(record, now=45)
+        assert is_due(record, now=50)
+
+    def test_terminal_status_stops_polling(self):
+        record = apply_status(new_record('p1', 'user_a', now=0), {'status': 'FAILED', 'fail_reason': 'file_format_check_failed'}, now=5)
+
+        assert record['terminal'] is True
+        assert record['next_check_at'] is None
+        assert not is_due(record, now=1000)
+
+    def test_gives_up_after_max_age(self, monkeypatch):
+        monkeypatch.setattr(publish_records, 'STATUS_POLL_MAX_AGE_SECONDS', 60)
+        record = apply_status(new_record('p1', 'user_a', now=0), {'status': 'PROCESSING_UPLOAD'}, now=61)
+
+        assert record['status'] == 'TIMED_OUT'
+        assert record['terminal'] is True
+
+    def test_s3_store_tracks_pending_markers(self):
+        store = _s3_store()
+
+        record = new_record('p1', 'user_a')
+        store.put(record, created=True)
+        assert store.list_pending() == ['p1']
+
+        store.put(apply_status(record, {'status': 'PUBLISH_COMPLETE'}))
+        assert store.list_pending() == []
+        assert store.get('p1')['status'] == 'PUBLISH_COMPLETE'
+
+
+    def test_post_tracked_with_status_is_pending(self):
+        store = _s3_store()
+
+        with patch('lambda_function.get_record_store', return_value=store):
+            lambda_function.track_publish('p1', 'user_a', {'status': 'PROCESSING_UPLOAD'})
+            lambda_function.track_publish('p2', 'user_a', {'status': 'PUBLISH_COMPLETE'})
+
+        assert store.list_pending() == ['p1']
+        assert store.get('p1')['attempts'] == 1
+
+        # Later polls rewrite the record without touching the marker
+        store.put(apply_status(store.get('p1'), {'status': 'PROCESSING_UPLOAD'}))
+        assert store.list_pending() == ['p1']
+
+    def test_s3_claims_are_conditional(self):
+        from botocore.exceptions import ClientError
+        objects = {}
+        versions = iter(range(1000))
+        client = MagicMock()
+        client.exceptions.NoSuchKey = KeyError
+
+        def put_object(Bucket, Key, Body, IfNoneMatch=None, IfMatch=None, **kwargs):
+            etag = objects.get(Key, (None, None))[1]
+            if (IfNoneMatch == '*' and Key in objects) or (IfMatch is not None and IfMatch != etag):
+                raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+            objects[Key] = (Body, f'"{next(versions)}"')
+
+        client.put_object.side_effect = put_object
+        client.get_object.side_effect = lambda Bucket, Key: {'Body': BytesIO(objects[Key][0]), 'ETag': objects[Key][1]}
+        store = S3PublishRecordStore('bucket', prefix='publish_records/', client=client)
+
+        assert claim_idempotency(store, 'k1', 'user_a', now=1000) is None
+        # A retry while the first post is still initialising sees its claim
+        assert claim_idempotency(store, 'k1', 'user_a', now=1001)['publish_id'] is None
+
+        store.put_claim({'key': 'k1', 'open_id': 'user_a', 'publish_id': 'p1', 'created_at': 1000})
+        assert claim_idempotency(store, 'k1', 'user_a', now=1002)['publish_id'] == 'p1'
+
+        stale = store.get_claim('k1')
+        assert claim_idempotency(store, 'k1', 'user_a', now=1000 + publish_records.IDEMPOTENCY_WINDOW_SECONDS) is None
+        # The stale view lost the race to the new claim
+        assert store.create_claim({'key': 'k1', 'open_id': 'user_a', 'publish_id': None, 'created_at': 0},
+                                  replace=stale) is False
+
+class TestStatusPoller:
+
+    @patch('lambda_function.get_access_tokens', return_value={'user_a': 'test-access-token'})
+    @patch('lambda_function.get_post_status_async')
+    def test_polls_due_records(self, mock_status, mock_token, memory_publish_records):
+        for publish_id in ('done', 'processing', 'not_due'):
+            record = new_record(publish_id, 'user_a', now=time.time() - 5)
+            if publish_id == 'not_due':
+                record['next_check_at'] = time.time() + 60
+            memory_publish_records.put(record)
+        async def fetch_status(token, publish_id):
+            return {
+                'done': {'status': 'PUBLISH_COMPLETE'},
+                'processing': {'status': 'PROCESSING_DOWNLOAD'},
+            }[publish_id]
+        mock_status.side_effect = fetch_status
+
+        result = status_poller.lambda_handler({}, None)
+
+        assert result == {'completed': ['done'], 'pending': 2, 'errors': []}
+        assert memory_publish_records.get('done')['terminal'] is True
+        assert mock_status.call_count == 2
@@ -0,0 +1,187 @@
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+
+import r2_upload
+from r2_upload import plan_chunks, chunk_ranges, r2_object_key, upload_video, UploadError
+
+MB = 1024 * 1024
+
+
+class FakeUploadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        first, last, total = map(int, re.match(r'bytes (\d+)-(\d+)/(\d+)', self.headers['Content-Range']).groups())
+        upload = self.server.upload
+
+        # Like TikTok, only accept the chunk that continues the upload
+        if first != len(upload) or last - first + 1 != len(data):
+            self._reply(416)
+            return
+        upload.extend(data)
+        self.server.ranges.append((first, last))
+        self._reply(201 if len(upload) == total else 206)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upload_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUploadHandler)
+    server.upload = bytearray()
+    server.ranges = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeR2:
+    """Ranged get_object over an in-memory object, with a fixed latency per read"""
+
+    def __init__(self, data, latency=0.0):
+        self.data = data
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, Range):
+        first, last = map(int, re.match(r'bytes=(\d+)-(\d+)', Range).groups())
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        return {'Body': BytesIO(self.data[first:last + 1])}
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(r2_upload, 'MIN_CHUNK_SIZE', 1000)
+    monkeypatch.setattr(r2_upload, 'MAX_CHUNK_SIZE', 4000)
+    monkeypatch.setattr(r2_upload, 'MAX_CHUNK_COUNT', 10)
+
+
+def _video(data, chunk_size):
+    size, count = plan_chunks(len(data), chunk_size)
+    return {'key': 'v.mp4', 'content_type': 'video/mp4', 'video_size': len(data),
+            'chunk_size': size, 'total_chunk_count': count}
+
+
+class TestChunkPlan:
+
+    def test_follows_tiktok_limits(self):
+        assert plan_chunks(3 * MB) == (3 * MB, 1)
+        assert plan_chunks(50 * MB, 16 * MB) == (16 * MB, 3)
+        assert plan_chunks(50 * MB, 1 * MB) == (5 * MB, 10)
+        assert plan_chunks(500 * MB, 100 * MB) == (64 * MB, 7)
+        # Too many chunks at the preferred size: grow the chunks instead
+        size, count = plan_chunks(8000 * MB, 5 * MB)
+        assert count <= 1000 and size >= 8 * MB
+
+    def test_last_chunk_absorbs_remainder(self):
+        size, count = plan_chunks(50 * MB, 16 * MB)
+        ranges = chunk_ranges(50 * MB, size, count)
+        assert ranges[0] == (0, 16 * MB - 1)
+        assert ranges[-1] == (32 * MB, 50 * MB - 1)
+        assert sum(last - first + 1 for first, last in ranges) == 50 * MB
+
+    def test_object_key_from_url(self):
+        assert r2_object_key('https://video-worker.example.workers.dev/videos/abc.mp4') == 'abc.mp4'
+        assert r2_object_key('https://r2-endpoint.com/my-tiktok-videos/test.mp4') == 'test.mp4'
+        with pytest.raises(ValueError):
+            r2_object_key('https://example.com/other/test.mp4')
+
+
+class TestUploadVideo:
+
+    def test_chunks_arrive_in_order_and_complete(self, upload_server, small_chunks, monkeypatch):
+        data = bytes(range(256)) * 41  # 10496 bytes: 10 chunks of 1000, the last one 1496
+        monkeypatch.setattr(r2_upload, '_r2_client', FakeR2(data))
+
+        upload_video(f'http://127.0.0.1:{upload_server.server_address[1]}/upload', _video(data, 1000),
+                     max_in_flight=4)
+
+        assert bytes(upload_server.upload) == data
+        assert upload_server.ranges[0] == (0, 999)
+        assert upload_server.ranges[-1] == (9000, 10495)
+        assert len(upload_server.ranges) == 10
+
+    def test_reads_overlap_with_uploads_within_bound(self, upload_server, small_chunks, monkeypatch):
+        data = b'x' * 8000
+        fake_r2 = FakeR2(data, latency=0.05)
+        monkeypatch.setattr(r2_upload, '_r2_client', fake_r2)
+        url = f'http://127.0.0.1:{upload_server.server_address[1]}/upload'
+
+        start = time.perf_counter()
+        upload_video(url, _video(data, 1000), max_in_flight=4)
+        elapsed = time.perf_counter() - start
+
+        # 8 reads of 50ms one after another would take 400ms
+        assert elapsed < 0.3
+        assert fake_r2.max_in_flight <= 4
+        assert bytes(upload_server.upload) == data
+
+    def test_rejected_chunk_raises(self, upload_server, small_chunks, monkeypatch):
+        data = b'x' * 3000
+        monkeypatch.setattr(r2_upload, '_r2_client', FakeR2(data))
+        upload_server.upload.extend(b'already started')
+
+        with pytest.raises(UploadError):
+            upload_video(f'http://127.0.0.1:{upload_server.server_address[1]}/upload', _video(data, 1000))
+
+
+class FakePresigner:
+    def __init__(self):
+        self.signed = []
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        self.signed.append(Params['Key'])
+        return f"https://r2-endpoint.com/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}&n={len(self.signed)}"
+
+
+class TestPresignedUrls:
+
+    @pytest.fixture
+    def presigner(self, monkeypatch):
+        presigner = FakePresigner()
+        monkeypatch.setattr(r2_upload, '_r2_client', presigner)
+        monkeypatch.setattr(r2_upload, '_presigned_urls', {})
+        monkeypatch.setattr(r2_upload, 'VIDEO_URL_STRATEGY', 'presigned')
+        return presigner
+
+    def test_presigned_url_is_cached_until_near_expiry(self, presigner, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(r2_upload.time, 'time', lambda: now[0])
+        worker_url = 'https://video-worker.example.workers.dev/videos/abc.mp4'
+
+        first = r2_upload.pull_url(worker_url)
+        assert first.startswith('https://r2-endpoint.com/my-tiktok-videos/abc.mp4?')
+        now[0] += r2_upload.PRESIGNED_URL_TTL_SECONDS - r2_upload.PRESIGNED_URL_REFRESH_SECONDS - 1
+        assert r2_upload.pull_url(worker_url) == first
+
+        now[0] += 2
+        assert r2_upload.pull_url(worker_url) != first
+        assert presigner.signed == ['abc.mp4', 'abc.mp4']
+
+    def test_urls_outside_bucket_and_worker_strategy_pass_through(self, presigner, monkeypatch):
+        assert r2_upload.pull_url('https://example.com/video.mp4') == 'https://example.com/video.mp4'
+
+        monkeypatch.setattr(r2_upload, 'VIDEO_URL_STRATEGY', 'worker')
+        worker_url = 'https://video-worker.example.workers.dev/videos/abc.mp4'
+        assert r2_upload.pull_url(worker_url) == worker_url
+        assert presigner.signed == []
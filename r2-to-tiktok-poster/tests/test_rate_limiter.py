@@ -0,0 +1,101 @@
+import json
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import lambda_function
+from rate_limiter import RateLimiter, RateLimitExceeded, parse_retry_after
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestRateLimiter:
+
+    def test_waits_for_refill_instead_of_failing(self):
+        clock = FakeClock()
+        limiter = _limiter(clock, endpoint_limits={'/init': 6})
+
+        for _ in range(7):
+            limiter.acquire('/init', 'user_a', 'app', deadline=60)
+
+        # The 7th request waits for one token at 6/min
+        assert clock.sleeps == [pytest.approx(10.0)]
+
+    def test_accounts_have_separate_buckets_but_share_the_app_bucket(self):
+        clock = FakeClock()
+        limiter = _limiter(clock, endpoint_limits={'/init': 1}, app_limit=2)
+
+        limiter.acquire('/init', 'user_a', 'app', deadline=0)
+        limiter.acquire('/init', 'user_b', 'app', deadline=0)
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire('/init', 'user_c', 'app', deadline=0)
+
+    def test_penalize_blocks_until_retry_after(self):
+        clock = FakeClock()
+        limiter = _limiter(clock)
+        limiter.penalize('/init', 'user_a', 'app', retry_after=7)
+
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            limiter.acquire('/init', 'user_a', 'app', deadline=5)
+        assert exc_info.value.retry_after == pytest.approx(7)
+
+        limiter.acquire('/init', 'user_a', 'app', deadline=10)
+        assert clock.now == pytest.approx(7)
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after({'Retry-After': '3'}) == 3
+        assert parse_retry_after({'retry-after': 'Thu, 01 Jan 1970 00:00:10 GMT'}, now=4) == 6
+        assert parse_retry_after({'X-RateLimit-Reset': '1700000030'}, now=1700000000) == 30
+        assert parse_retry_after({}) is None
+
+
+class TestRateLimitedRequests:
+
+    def _response(self, status_code, headers=None, body=None):
+        response = MagicMock(status_code=status_code, headers=headers or {}, text='')
+        response.json.return_value = body or {'error': {'code': 'ok'}, 'data': {}}
+        return response
+
+    @patch('lambda_function.get_tiktok_client')
+    def test_429_is_retried_after_retry_after(self, mock_client, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(lambda_function, '_rate_limiter', _limiter(clock))
+        mock_client.return_value.post.side_effect = [
+            self._response(429, {'Retry-After': '2'}, {'error': {'code': 'rate_limit_exceeded'}}),
+            self._response(200, body={'error': {'code': 'ok'}, 'data': {'publish_id': 'p1'}}),
+        ]
+
+        result = lambda_function.make_tiktok_api_request('/v2/post/publish/video/init/', {}, 'token')
+
+        assert result['data']['publish_id'] == 'p1'
+        assert clock.sleeps == [pytest.approx(2)]
+
+    @patch('lambda_function.get_access_token', return_value='test-access-token')
+    @patch('lambda_function.get_tiktok_client')
+    def test_handler_returns_429_when_deadline_passes(self, mock_client, mock_token, monkeypatch):
+        monkeypatch.setattr(lambda_function, 'TIKTOK_RATE_LIMIT_WAIT_SECONDS', 1)
+        mock_client.return_value.post.return_value = self._response(429, {'Retry-After': '60'}, {'error': {'code': 'rate_limit_exceeded'}})
+
+        result = lambda_function.lambda_handler({'body': json.dumps({
+            'r2_video_url': 'https://r2-endpoint.com/v.mp4', 'open_id': 'user_a', 'title': 't'
+        })}, {})
+
+        assert result['statusCode'] == 429
+        assert result['headers']['Retry-After'] == '60'
+        assert mock_client.return_value.post.call_count == 1
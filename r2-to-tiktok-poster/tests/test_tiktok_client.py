@@ -0,0 +1,72 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tiktok_client import TikTokClient
+
+
+class FakeTikTokHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.connections.add(self.client_address)
+        payload = json.dumps({'error': {'code': 'ok'}, 'data': {'echo': body,
+                                                                'auth': self.headers['Authorization']}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeTikTokHandler)
+    server.connections = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(fake_server):
+    client = TikTokClient(base_url=f'http://127.0.0.1:{fake_server.server_address[1]}', max_connections=4)
+    yield client
+    client.close()
+
+
+class TestTikTokClient:
+
+    def test_sync_post_reuses_connection(self, client, fake_server):
+        for i in range(5):
+            response = client.post('/v2/test/', headers={'Authorization': 'Bearer t'}, json={'n': i})
+            assert response.status_code == 200
+            assert response.json()['data'] == {'echo': {'n': i}, 'auth': 'Bearer t'}
+
+        assert len(fake_server.connections) == 1
+
+    def test_threads_share_the_pool(self, client, fake_server):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda i: client.post('/v2/test/', json={'n': i}), range(40)))
+
+        assert [r.json()['data']['echo']['n'] for r in responses] == list(range(40))
+        assert len(fake_server.connections) <= 4
+
+    def test_run_from_own_loop_is_rejected(self, client):
+        async def nested():
+            coro = client.request('POST', '/v2/test/', json={})
+            try:
+                client.run(coro)
+            finally:
+                coro.close()
+
+        with pytest.raises(RuntimeError):
+            client.run(nested())
@@ -0,0 +1,107 @@
+import sys
+import os
+# 相対パスで dependencies ディレクトリを追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dependencies'))
+
+import asyncio
+import threading
+from typing import Optional, Dict, Any
+
+TIKTOK_API_BASE_URL = os.getenv("TIKTOK_API_BASE_URL", "https://open.tiktokapis.com")
+# Upper bound of concurrent connections to the TikTok API per container
+TIKTOK_MAX_CONNECTIONS = int(os.getenv("TIKTOK_MAX_CONNECTIONS", "32"))
+# Per-request timeouts, so a slow TikTok endpoint cannot hold the invocation until the Lambda timeout
+TIKTOK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("TIKTOK_CONNECT_TIMEOUT_SECONDS", "3.05"))
+TIKTOK_READ_TIMEOUT_SECONDS = float(os.getenv("TIKTOK_READ_TIMEOUT_SECONDS", "15"))
+
+
+class TikTokClient:
+    """
+    Pooled keep-alive HTTP client for the TikTok API
+
+    An httpx.AsyncClient lives on an event loop owned by a background thread,
+    so connections are reused across calls and invocations of the warm
+    container. Async code awaits request(); synchronous code (and any number
+    of threads) goes through post(), which runs the request on that loop.
+    """
+
+    def __init__(self, base_url: str = TIKTOK_API_BASE_URL, max_connections: int = TIKTOK_MAX_CONNECTIONS):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Event loop of the background thread, started on first use"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="tiktok-client", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def _get_client(self):
+        # Only called on self.loop, so no locking is needed
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(TIKTOK_READ_TIMEOUT_SECONDS, connect=TIKTOK_CONNECT_TIMEOUT_SECONDS),
+            )
+        return self._client
+
+    async def request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None,
+                      json: Optional[Any] = None):
+        """Send a request on the pooled client (must be awaited on self.loop)"""
+        return await self._get_client().request(method, path, headers=headers, json=json)
+
+    def prime(self):
+        """Create the client and open a pooled connection (TCP + TLS) before the first request"""
+        async def connect():
+            await self.request("HEAD", "/")
+        self.run(connect())
+
+    def run(self, coro):
+        """Run a coroutine on the client's loop and wait for its result"""
+        if _running_on(self._loop):
+            raise RuntimeError("TikTokClient.run() cannot be called from the client's own event loop")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def post(self, path: str, headers: Optional[Dict[str, str]] = None, json: Optional[Any] = None):
+        """Synchronous POST for the existing blocking call sites"""
+        return self.run(self.request("POST", path, headers=headers, json=json))
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._client is not None:
+            self.run(self._client.aclose())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+def _running_on(loop: Optional[asyncio.AbstractEventLoop]) -> bool:
+    try:
+        return loop is not None and asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+_client: Optional[TikTokClient] = None
+_client_lock = threading.Lock()
+
+
+def get_tiktok_client() -> TikTokClient:
+    """TikTok client shared by the whole container, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TikTokClient()
+    return _client
@@ -0,0 +1,32 @@
+#!/bin/bash
+
+# Sourced by each Lambda's build.sh after dependencies/ is installed.
+# BUILD_MODE=slim trims the package for faster cold starts:
+# only the S3 service models are kept from botocore/boto3 data, and the
+# bytecode is precompiled and shipped (the Lambda filesystem is read-only,
+# so modules without it are compiled again on every cold start)
+
+# zip exclusions for bytecode; build.sh passes these to zip
+BYTECODE_EXCLUDES=(-x "__pycache__/*" -x "*.pyc")
+
+if [ "${BUILD_MODE:-full}" = "slim" ]; then
+  echo "✂️  Trimming unused botocore/boto3 data..."
+  KEEP_SERVICES="s3"
+  for data_dir in dependencies/botocore/data dependencies/boto3/data; do
+    [ -d "$data_dir" ] || continue
+    for service_dir in "$data_dir"/*/; do
+      service=$(basename "$service_dir")
+      case " $KEEP_SERVICES " in
+        *" $service "*) ;;
+        *) rm -rf "$service_dir" ;;
+      esac
+    done
+  done
+
+  # unchecked-hash .pyc files stay valid even though zip does not keep exact mtimes.
+  # Build with the same Python version as the Lambda runtime, or the bytecode is ignored
+  echo "🐍 Precompiling bytecode..."
+  python3 -m compileall -q -f -j 0 --invalidation-mode unchecked-hash -x '/tests/' . \
+    || echo "⚠️  Some files could not be compiled; they are compiled at import time instead"
+  BYTECODE_EXCLUDES=()
+fi